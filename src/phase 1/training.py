@@ -0,0 +1,263 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+#The classifier is built by src/phase 2/surrogate.py (shared with the active learning)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase 2"))
+from surrogate import build_model
+
+'''
+Training of the classifier of composites_DL.ipynb on the data generated by
+src/phase 2/data_generator.py (or active_learning, simulate_screened) without
+loading it in memory: the CSV files (shards, all with the same header) are
+read lazily through a tf.data pipeline
+lines of every shard, read in parallel (interleave) -> blocks of lines parsed
+in parallel (decode_csv) -> normalized features and labels -> cache of the
+blocks (memory or file) -> rows -> shuffle buffer -> batches -> prefetch
+The normalization is found first with one streaming pass through the training
+rows of the shards:
+columns that are not constant (as the notebook drops them) and the mean and
+standard deviation of each one, so every feature has mean 0 and std 1 (the
+notebook divides by the L2 norm of each column instead, which shrinks the
+features as the data grows). They're saved next to the model as the features
+spec (<model file>.json: columns, offset and scale) and used again for the
+inference, here (predict) or with the Surrogate of src/phase 2/surrogate.py
+A fraction of the rows (chosen by a hash of the line, so always the same
+ones) is kept for validation, and it's left out of the normalization and the
+weights of the labels too. The rows with labels predicted by a classifier
+(SIMULATED column of simulate_screened equal to 0) are not used
+Usage (from src/phase 1):
+  python training.py "../../data/shards/*.csv" --model classifier.keras --epochs 20
+'''
+
+#Columns of the data that are not features (label, probability and flag of
+#the screened data)
+NOT_FEATURES = ("Y", "P", "SIMULATED")
+AUTOTUNE = tf.data.AUTOTUNE
+
+'''
+Function that returns the shards given by a list of names or glob patterns
+(in order, without repeats) and their header (the same one for all of them)
+'''
+def shards(patterns):
+    files = []
+    for pattern in ([patterns] if isinstance(patterns, str) else patterns):
+        for filename in sorted(glob.glob(pattern)):
+            if filename not in files:
+                files.append(filename)
+    if not files:
+        raise ValueError("No data files found for " + str(patterns))
+    header = None
+    for filename in files:
+        with open(filename) as file:
+            names = file.readline().strip().split(",")
+        if header is None:
+            header = names
+        elif names != header:
+            raise ValueError("The header of " + filename + " is not the same as the one of " + files[0])
+    return files, header
+
+'''
+Function that returns the dataset of the lines of the shards (header
+skipped), read in parallel from all of them
+'''
+def lines(files, deterministic=True):
+    return tf.data.Dataset.from_tensor_slices(files).interleave(
+        lambda filename: tf.data.TextLineDataset(filename).skip(1),
+        cycle_length=min(len(files), 16), num_parallel_calls=AUTOTUNE, deterministic=deterministic)
+
+'''
+Function that parses a block of lines into a matrix of values (float64)
+'''
+def decode(block, header):
+    return tf.stack(tf.io.decode_csv(block, record_defaults=[tf.constant(0.0, tf.float64)]*len(header)), axis=1)
+
+'''
+Function that returns which lines of a block are kept for validation (the
+given fraction of them, by a hash of the line)
+'''
+def in_validation(block, validation):
+    return tf.strings.to_hash_bucket_fast(block, 10000) < int(validation*10000)
+
+'''
+Function that finds the statistics of the training rows of the shards (the
+ones not kept for validation, see in_validation) with one streaming pass,
+reading them by blocks of rows: num of rows used (simulated ones), mean,
+standard deviation, min and max of each column and num of rows of each label
+The blocks are combined with the parallel algorithm of Chan et al., so the
+variance doesn't lose precision with many rows
+'''
+def statistics(files, header, validation=0.05, block=8192):
+    cols = len(header)
+    n, mean, m2 = 0, np.zeros(cols), np.zeros(cols)
+    low, high = np.full(cols, np.inf), np.full(cols, -np.inf)
+    flag = header.index("SIMULATED") if "SIMULATED" in header else None
+    rows = lines(files).batch(block).map(lambda b: (decode(b, header), in_validation(b, validation)),
+                                         num_parallel_calls=AUTOTUNE)
+    for data, kept in rows.prefetch(AUTOTUNE).as_numpy_iterator():
+        data = data[~kept]
+        if flag is not None:
+            data = data[data[:,flag] == 1]
+        if len(data) == 0:
+            continue
+        nb, mean_b = len(data), data.mean(axis=0)
+        delta = mean_b - mean
+        m2 += ((data - mean_b)**2).sum(axis=0) + delta**2 * n*nb/(n+nb)
+        mean += delta * nb/(n+nb)
+        n += nb
+        np.minimum(low, data.min(axis=0), out=low)
+        np.maximum(high, data.max(axis=0), out=high)
+    if n == 0:
+        raise ValueError("No simulated training rows on the data files")
+    y = header.index("Y")
+    return {"rows": n, "mean": mean, "std": np.sqrt(m2/n), "min": low, "max": high,
+            "labels": [int(round(n*(1-mean[y]))), int(round(n*mean[y]))]}
+
+'''
+Function that returns the features spec of some statistics (see statistics):
+the columns that are not constant with their mean (offset) and standard
+deviation (scale)
+'''
+def normalization(stats, header):
+    columns, offset, scale = [], [], []
+    for c, name in enumerate(header):
+        if name in NOT_FEATURES or stats["min"][c] == stats["max"][c]:
+            continue
+        columns.append(name)
+        offset.append(float(stats["mean"][c]))
+        scale.append(float(stats["std"][c]))
+    return {"columns": columns, "offset": offset, "scale": scale}
+
+'''
+Function that saves a features spec as a JSON file
+'''
+def save_spec(filename, spec):
+    with open(filename, "w") as file:
+        json.dump(spec, file, indent=1)
+
+'''
+Function that loads a features spec (JSON file)
+'''
+def load_spec(filename):
+    with open(filename) as file:
+        spec = json.load(file)
+    spec.setdefault("offset", [0.0]*len(spec["columns"]))
+    return spec
+
+'''
+Function that returns the dataset of (features, label) of the shards for
+training or validation, normalized with the given features spec
+validation -> fraction of the rows kept for validation (by a hash of the line)
+part -> "train" or "validation" (or "all", every row with its features in
+        the order of the files, for inference)
+shuffle -> size of the shuffle buffer (rows), 0 to not shuffle
+cache -> file to cache the parsed blocks of rows on ("" for memory, None to
+         not cache)
+'''
+def dataset(files, header, spec, part="train", validation=0.05, batch_size=256, shuffle=100000, cache="",
+            block=4096, seed=0):
+    idx = tf.constant([header.index(name) for name in spec["columns"]])
+    offset = tf.constant(spec["offset"], tf.float64)
+    scale = tf.constant(spec["scale"], tf.float64)
+    flag = header.index("SIMULATED") if "SIMULATED" in header else None
+    y = header.index("Y")
+    #Function that parses a block of lines into its normalized features and labels
+    def parse(block_lines):
+        data = decode(block_lines, header)
+        keep = tf.ones(tf.shape(block_lines), tf.bool)
+        if part != "all":
+            if flag is not None:
+                keep &= tf.equal(data[:,flag], 1)
+            kept = in_validation(block_lines, validation)
+            keep &= kept if part == "validation" else ~kept
+        data = tf.boolean_mask(data, keep)
+        features = tf.cast((tf.gather(data, idx, axis=1) - offset)/scale, tf.float32)
+        return features, tf.cast(data[:,y], tf.int32)
+    ds = lines(files, deterministic=part == "all").batch(block).map(parse, num_parallel_calls=AUTOTUNE)
+    #Cached by blocks (one element per block instead of one per row)
+    if cache is not None:
+        ds = ds.cache(cache)
+    ds = ds.unbatch()
+    if shuffle > 0 and part == "train":
+        ds = ds.shuffle(shuffle, seed=seed, reshuffle_each_iteration=True)
+    return ds.batch(batch_size).prefetch(AUTOTUNE)
+
+'''
+Function that returns the rows per second given by a dataset (only reading
+it, no training), to compare with the ones of the training: if they're much
+larger, the training is bounded by the model and not by the data loading
+'''
+def throughput(ds, batches=200):
+    rows = 0
+    start_time = time.time()
+    for features, labels in ds.take(batches):
+        rows += int(features.shape[0])
+    elapsed = time.time() - start_time
+    return rows/elapsed if elapsed > 0 else 0
+
+'''
+Function that trains the classifier on the data files (names or glob
+patterns) and saves it (model_file) with its features spec
+(<model_file>.json). The labels are weighted so both have the same weight
+in total on the training rows (the notebook drops rows of label 1 instead)
+Returns the model and the history of the training
+'''
+def train(patterns, model_file="classifier.keras", epochs=50, batch_size=256, validation=0.05, shuffle=100000,
+          cache="", seed=0, verbose=1):
+    files, header = shards(patterns)
+    start_time = time.time()
+    stats = statistics(files, header, validation)
+    spec = normalization(stats, header)
+    save_spec(model_file + ".json", spec)
+    print("--- Statistics of {0} rows in {1:f} seconds, {2} features ---".format(
+        stats["rows"], time.time()-start_time, len(spec["columns"])))
+    train_ds = dataset(files, header, spec, "train", validation, batch_size, shuffle, cache, seed=seed)
+    val_ds = dataset(files, header, spec, "validation", validation, batch_size, 0, None if cache is None else "",
+                     seed=seed)
+    #Measured without the cache (a cache only read partially is discarded)
+    print("Input pipeline: {0:.0f} rows/s".format(
+        throughput(dataset(files, header, spec, "train", validation, batch_size, shuffle, None, seed=seed))))
+    counts = stats["labels"]
+    weights = {c: stats["rows"]/(2*counts[c]) if counts[c] > 0 else 1.0 for c in (0, 1)}
+    tf.keras.utils.set_random_seed(seed)
+    model = build_model(len(spec["columns"]))
+    history = model.fit(train_ds, validation_data=val_ds, epochs=epochs, class_weight=weights, verbose=verbose)
+    model.save(model_file)
+    return model, history
+
+'''
+Function that predicts the probability of label 1 of the rows of some data
+files with a trained classifier (saved by train, with its features spec).
+Returns an array with the probability of each row, in the order of the files
+'''
+def predict(patterns, model_file="classifier.keras", batch_size=4096):
+    files, header = shards(patterns)
+    spec = load_spec(model_file + ".json")
+    model = tf.keras.models.load_model(model_file)
+    ds = dataset(files, header, spec, "all", batch_size=batch_size, shuffle=0, cache=None)
+    return model.predict(ds.map(lambda features, labels: features), verbose=0)[:,1]
+
+'''
+Function with the command line interface of train
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Training of the classifier on generated data (tf.data pipeline)")
+    parser.add_argument("files", nargs="+", help="data files (CSV) or glob patterns")
+    parser.add_argument("--model", default="classifier.keras", help="file of the trained model")
+    parser.add_argument("--epochs", type=int, default=50, help="passes through the data (50 by default)")
+    parser.add_argument("--batch-size", type=int, default=256, help="rows per batch (256 by default)")
+    parser.add_argument("--validation", type=float, default=0.05, help="fraction of rows for validation")
+    parser.add_argument("--shuffle", type=int, default=100000, help="size of the shuffle buffer (rows)")
+    parser.add_argument("--cache", default="", help="file to cache the parsed rows (memory by default)")
+    args = parser.parse_args(argv)
+    train(args.files, args.model, args.epochs, args.batch_size, args.validation, args.shuffle, args.cache)
+
+'''
+Main block to call for main
+'''
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import time
+import numpy as np
+import wave_prop_analysis_V3
+import data_generator
+from data_generator import Checkpoint
+from surrogate import Surrogate, build_model, read_data, spec
+
+'''
+Active learning generation of the data: instead of simulating every
+configuration of a grid, the classifier (the model of
+src/phase 1/composites_DL.ipynb) is trained on the data simulated so far and
+the next configurations to simulate are the ones it knows least about
+Every round:
+1. An ensemble of <members> classifiers (different seeds) is trained on the
+   data simulated (CSV file, the same format as data_generator.simulate)
+2. Its accuracy is measured on a validation set (a fixed random sample of the
+   configurations, simulated once, on its own CSV file)
+3. The configurations not simulated yet are scored: how unsure the ensemble
+   is (mean probability close to 0.5) or how much its members disagree
+   (standard deviation of their probabilities), the largest of both
+4. The <batch> configurations with the largest scores are simulated and
+   appended to the data
+The loop starts with <initial> random configurations and stops once the
+validation accuracy doesn't improve by more than min_delta for <patience>
+rounds (plateau), or every configuration is simulated. Both CSV files are
+written through Checkpoint, so an interrupted loop is continued by calling
+it again with the same seed
+TensorFlow is only needed for the default classifier (train_keras), any
+function (features, labels, seed) -> model with a predict function can be
+used instead
+'''
+
+'''
+Function that trains a classifier of the notebook (surrogate.build_model, its
+weights initialized by the given seed) on some features (normalized) and
+labels. The labels are weighted so both have the same
+weight in total (the notebook drops rows of label 1 instead)
+'''
+def train_keras(x, y, seed=0, epochs=50, batch_size=16):
+    model = build_model(x.shape[1], seed=seed)
+    counts = np.bincount(y.astype(int), minlength=2)
+    weights = {c: len(y)/(2*counts[c]) if counts[c] > 0 else 1.0 for c in (0, 1)}
+    model.fit(x, y, epochs=epochs, batch_size=batch_size, class_weight=weights, verbose=0)
+    return model
+
+'''
+Function that trains an ensemble of classifiers on the rows of generated data
+(with the given header, Y the last column). Returns the list of members
+(Surrogate objects, see surrogate)
+'''
+def train_ensemble(header, data, members=5, train=train_keras, seed=0):
+    columns, scale = spec(header, data)
+    names = header[:-1]
+    ensemble = []
+    for m in range(members):
+        surrogate = Surrogate(None, columns, scale, names)
+        surrogate.model = train(surrogate.features(data[:,:-1]), data[:,-1], seed+m)
+        ensemble.append(surrogate)
+    return ensemble
+
+'''
+Function that returns the mean probability of label 1 given by the members
+of an ensemble to some rows (without Y) and their standard deviation
+'''
+def ensemble_probability(ensemble, rows):
+    p = np.array([member.probability(rows) for member in ensemble])
+    return p.mean(axis=0), p.std(axis=0)
+
+'''
+Function that returns the score of some rows for the active learning (the
+largest ones are simulated first): how unsure the ensemble is (1 for a mean
+probability of 0.5, 0 for 0 or 1) or how much its members disagree (twice
+the standard deviation, 1 at most), the largest of both
+'''
+def uncertainty(mean, std):
+    return np.maximum(1 - np.abs(2*mean - 1), 2*std)
+
+'''
+Function that simulates some configurations (in batches of the given size)
+and writes their rows on a Checkpoint
+'''
+def simulate_into(checkpoint, configs, batch=81, version=wave_prop_analysis_V3, cache="cache"):
+    for b in range(0, len(configs), batch):
+        chunk = configs[b:b+batch]
+        checkpoint.write(chunk, data_generator.simulate_configs(chunk, version, False, cache))
+
+'''
+Function that runs the active learning loop (see above) and exports the
+data simulated to a CSV file
+pool -> configurations to choose from (data_generator.configurations() by default)
+initial -> num of random configurations to start with
+batch -> num of configurations simulated every round
+validation -> num of random configurations of the validation set
+members -> num of classifiers of the ensemble
+patience, min_delta -> the loop stops after <patience> rounds without an
+                       improvement of the validation accuracy above min_delta
+max_rounds -> max num of rounds
+train -> function that trains a classifier (features, labels, seed) -> model
+seed -> seed of the random choices and of the classifiers
+filename, val_filename -> CSV files of the data and of the validation set
+Returns the history of the loop (list of (num of rows, validation accuracy)
+for every round) and the ensemble of the last round
+'''
+def active_learning(pool=None, initial=200, batch=200, validation=500, members=5, patience=3, min_delta=0.005,
+                    max_rounds=50, train=train_keras, seed=0, version=wave_prop_analysis_V3,
+                    filename='active_data.csv', val_filename='active_validation.csv', resume=True, cache="cache"):
+    pool = data_generator.configurations() if pool is None else pool
+    names = data_generator.header(data_generator.composite(*pool[0]))
+    order = np.random.default_rng(seed).permutation(len(pool))
+    #Validation set, simulated once
+    val_configs = [pool[n] for n in order[:validation]]
+    with Checkpoint(names, val_filename, resume) as checkpoint:
+        simulate_into(checkpoint, checkpoint.pending(val_configs), version=version, cache=cache)
+    val_data = read_data(val_filename)[1]
+    #Inputs of the rest of configurations (candidates), found only once
+    candidates = [pool[n] for n in order[validation:]]
+    rows = np.array([data_generator.features(config) for config in candidates])
+    history = []
+    best, stale = -1.0, 0
+    start_time = time.time()
+    with Checkpoint(names, filename, resume) as checkpoint:
+        simulate_into(checkpoint, checkpoint.pending(candidates[:initial]), version=version, cache=cache)
+        for r in range(max_rounds):
+            data = read_data(filename)[1]
+            ensemble = train_ensemble(names, data, members, train, seed)
+            mean, std = ensemble_probability(ensemble, val_data[:,:-1])
+            accuracy = float(np.mean((mean > 0.5) == (val_data[:,-1] == 1)))
+            history.append((len(data), accuracy))
+            print("Round {0}: {1} composites simulated, validation accuracy {2:.4f} ({3:f} seconds)".format(
+                r+1, len(data), accuracy, time.time()-start_time))
+            if accuracy > best + min_delta:
+                best, stale = accuracy, 0
+            else:
+                stale += 1
+                if stale >= patience:
+                    break #plateau
+            if r == max_rounds-1:
+                break #last round, its batch would never be trained on
+            #Next configurations to simulate: the largest scores not simulated yet
+            pending = np.array([n for n, config in enumerate(candidates)
+                                if data_generator.config_key(config) not in checkpoint.done], dtype=int)
+            if pending.size == 0:
+                break
+            mean, std = ensemble_probability(ensemble, rows[pending])
+            chosen = pending[np.argsort(-uncertainty(mean, std), kind='stable')[:batch]]
+            simulate_into(checkpoint, [candidates[n] for n in chosen], version=version, cache=cache)
+    print("--- {0} composites simulated, validation accuracy {1:.4f} ---".format(*history[-1]))
+    return history, ensemble
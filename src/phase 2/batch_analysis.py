@@ -0,0 +1,162 @@
+import argparse
+import glob
+import importlib
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from composite_reader import read_composite
+from failure import failure_analysis, failure_message
+from result_cache import ResultCache, simulate_cached
+
+'''
+Non-interactive analysis of many input files (same format as the ones of
+single_composite_analysis), simulated on a pool of worker processes
+For each file, one line of JSON is written with the analysis of the
+composite (option 7 of single_composite_analysis), the peak stresses of each
+layer and the times taken, in the order of the files:
+file -> input file
+status -> "ok" or "error" (then error has the message and nothing else is given)
+verdict -> "valid" (the composite can be considered), "failed" (a relevant
+           layer is above its failure stress) or "undefined" (a relevant
+           layer has no failure stresses)
+failed -> messages of the relevant layers above their failure stress (as
+          on single_composite_analysis, the layers counted from the first
+          one after the projectile)
+layers -> for each layer: its num (from 1, the projectile, as on the input
+          files), max and min stress (Pa, tension positive)
+          and, for the relevant ones, max hydrostatic tension and
+          compression and if they're above the failure stresses
+finalt, steps, nodes -> time simulated (micro-s), num of time steps and of nodes
+cached -> if the result was found on the cache
+read_seconds, simulate_seconds -> times taken to read and to simulate
+Usage (from src/phase 2):
+  python batch_analysis.py "../../data/*.txt" --workers 4 --output results.jsonl
+'''
+
+#Versions of the simulation code available (modules)
+VERSIONS = {"v2": "wave_prop_analysis_V2", "v3": "wave_prop_analysis_V3", "lattice": "wave_prop_lattice"}
+
+'''
+Function that returns the max and min stress of a simulated layer (from its
+stats or its mesh)
+'''
+def peaks(layer):
+    if layer.stats is not None:
+        return float(layer.stats.max), float(layer.stats.min)
+    return float(np.amax(layer.mesh)), float(np.amin(layer.mesh))
+
+'''
+Function that reads, simulates and analyses one input file (run by the
+workers). Receives a tuple with the file name, the name of the module of the
+version to use and the directory of the cache (None to not use it)
+With V3 only the reductions of the stresses are kept (no meshes). The
+probes, strides and windows of the files are ignored (the analysis needs
+every node and time step). Returns the record of the file (dictionary)
+'''
+def analyze_file(args):
+    filename, version_name, cache = args
+    try:
+        version = importlib.import_module(version_name)
+        reduce = version_name == "wave_prop_analysis_V3"
+        start_time = time.time()
+        all_layers, t, step, finalt, directives = read_composite(filename, not reduce, stride=1, window=False,
+                                                                 probes=[], interfaces=False)
+        read_seconds = time.time() - start_time
+        options = {"verbose": False}
+        if reduce:
+            options["storage"] = "reduce"
+        start_time = time.time()
+        store = ResultCache(cache) if cache is not None else None
+        result, found = simulate_cached(store, version, all_layers, t, step, **options)
+        simulate_seconds = time.time() - start_time
+        analysis = failure_analysis(all_layers)
+        if analysis is None:
+            verdict, failed = "undefined", []
+        else:
+            failed = [failure_message(i, tension, compression) for i, mt, mc, tension, compression in analysis]
+            failed = [message for message in failed if message != ""]
+            verdict = "failed" if failed else "valid"
+        relevant = {i: (mt, mc, tension, compression) for i, mt, mc, tension, compression in (analysis or [])}
+        layers = []
+        for i, layer in enumerate(all_layers):
+            max_stress, min_stress = peaks(layer)
+            record = {"layer": i+1, "max_stress": max_stress, "min_stress": min_stress}
+            if i in relevant:
+                mt, mc, tension, compression = relevant[i]
+                record.update({"hyd_tension": float(mt), "hyd_compression": float(mc),
+                               "tension_failed": bool(tension), "compression_failed": bool(compression)})
+            layers.append(record)
+        return {"file": filename, "status": "ok", "verdict": verdict, "failed": failed, "layers": layers,
+                "finalt": float(finalt), "steps": int(t.size), "nodes": int(sum(layer.numnod for layer in all_layers)),
+                "cached": found, "read_seconds": read_seconds, "simulate_seconds": simulate_seconds}
+    except Exception as e:
+        return {"file": filename, "status": "error", "error": "{0}: {1}".format(type(e).__name__, e)}
+
+'''
+Function that returns the files given by a list of names or glob patterns
+(in order, without repeats). Names not matching any file are kept, so their
+error is reported
+'''
+def expand(patterns):
+    files = []
+    for pattern in patterns:
+        for filename in sorted(glob.glob(pattern)) or [pattern]:
+            if filename not in files:
+                files.append(filename)
+    return files
+
+'''
+Function that analyses many input files (names or glob patterns) on a pool
+of worker processes and writes the record of each one as a line of JSON on
+the output (file name, or None for the standard output), in the order of the
+files. Prints a summary on the standard error
+workers -> num of worker processes (None, one per CPU)
+version -> "v2", "v3" or "lattice"
+cache -> directory of the cache of results, shared by all workers (None to not use it)
+Returns the list of records
+'''
+def analyze(patterns, workers=None, version="v3", output=None, cache="cache"):
+    files = expand(patterns)
+    records = []
+    start_time = time.time()
+    out = sys.stdout if output is None else open(output, "w")
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            #map returns the records in the order of the files
+            for record in executor.map(analyze_file, [(f, VERSIONS[version], cache) for f in files]):
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                records.append(record)
+    finally:
+        if output is not None:
+            out.close()
+    elapsed = time.time() - start_time
+    verdicts = [record.get("verdict", "error") for record in records]
+    print("--- {0} files in {1:f} seconds ({2:.2f} files/s): {3} valid, {4} failed, {5} undefined, {6} errors ---".format(
+        len(records), elapsed, len(records)/elapsed if elapsed > 0 else 0, verdicts.count("valid"),
+        verdicts.count("failed"), verdicts.count("undefined"), verdicts.count("error")), file=sys.stderr)
+    return records
+
+'''
+Function with the command line interface of analyze
+Returns the exit code: 0, or 1 if any file couldn't be analysed
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analysis of many composite input files (JSON lines output)")
+    parser.add_argument("files", nargs="+", help="input files or glob patterns")
+    parser.add_argument("--workers", type=int, default=None, help="num of worker processes (one per CPU by default)")
+    parser.add_argument("--version", choices=sorted(VERSIONS), default="v3", help="simulation code (v3 by default)")
+    parser.add_argument("--output", default=None, help="JSON lines file (standard output by default)")
+    parser.add_argument("--cache", default="cache", help="directory of the cache of results")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the cache of results")
+    args = parser.parse_args(argv)
+    records = analyze(args.files, args.workers, args.version, args.output, None if args.no_cache else args.cache)
+    return 1 if any(record["status"] == "error" for record in records) else 0
+
+'''
+Main block to call for main
+'''
+if __name__ == "__main__":
+    sys.exit(main())
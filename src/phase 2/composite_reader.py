@@ -0,0 +1,163 @@
+import numpy as np
+from wave_prop_analysis_V2 import Layer, Wave
+
+'''
+Function that returns the next line of the input file to consider (lines
+starting with # are comments) and the index of the line after it
+'''
+def next_line(lines, i):
+    while lines[i].startswith("#"):
+        i += 1
+    return lines[i].strip(), i+1
+
+'''
+Function that reads the optional directives at the end of the input file
+(after the initial waves), one per line with the form
+  <name>,<value>
+Directives available:
+  precision,<32 or 64> -> precision (bits) of the floats of the meshes
+  stride,<k> or stride,<k>,window -> only every k-th row of the meshes is
+      stored and, with window, the max and min of each node over the time
+      steps from a stored row until the next one (see Layer.nodes)
+  probe,<layer>,<node> or probe,<layer>,<position>mm -> records the stresses
+      of a node of a layer (numbered from 1, the projectile) given by its
+      index or its position in mm, one line per probe
+  probe,interfaces -> records the stresses at both sides of every interface
+With probes, only their series are recorded (storage "probes" of V3 and the
+lattice) and the meshes are not created
+Returns a dictionary with the values of the directives found
+'''
+def read_options(lines, i):
+    options = {}
+    for line in lines[i:]:
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        parts = line.split(",")
+        name = parts[0].strip().lower()
+        if name == "precision":
+            options["precision"] = int(parts[1])
+            if options["precision"] not in (32, 64):
+                raise ValueError("Precision must be 32 or 64 bits")
+        elif name == "stride":
+            options["stride"] = int(parts[1])
+            options["window"] = len(parts) > 2 and parts[2].strip().lower() == "window"
+            if options["stride"] < 1:
+                raise ValueError("Stride must be at least 1")
+        elif name == "probe":
+            if parts[1].strip().lower() == "interfaces":
+                options["interfaces"] = True
+                continue
+            node = parts[2].strip().lower()
+            node = float(node[:-2]) if node.endswith("mm") else int(node)
+            options.setdefault("probes", []).append((int(parts[1]), node))
+        else:
+            raise ValueError("Unknown directive on input file: " + parts[0])
+    return options
+
+'''
+Function that reads an input file describing a single composite (see the
+files on data/ for the format) and constructs the simulation: the layers
+(discretized, with the initial waves on them), the time vector, the time
+step, the total time to simulate and the directives of the file (see
+read_options)
+If alloc is False, the meshes of the layers are not created, and if a
+scratch directory is given they are memory-mapped files on it (see Layer.nodes)
+The precision (32 or 64 bits) of the meshes, the stride and window of
+their rows and the probes (list of (layer, node or position in mm)) and
+interfaces to record, if given, are used instead of the ones of the file
+(64 bits, every row and no probes by default), and so is the time step
+(0.01 micro-s by default)
+'''
+def read_composite(filename, alloc=True, scratch=None, precision=None, stride=None, window=None,
+                   probes=None, interfaces=None, step=None):
+    #Loop through file to construct simulation
+    with open(filename,"r") as file:
+        lines = file.readlines()
+    #First, we read the num of layers for composite
+    line, i = next_line(lines, 0)
+    qty_layers = int(line)
+    #Now, we construct the layers of the composite
+    all_layers = []
+    for l in range(qty_layers):
+        line, i = next_line(lines, i)
+        #We first split the line by commas
+        parts = line.split(",")
+        #Now, we use the values to construct a layer.
+        #Given that some are optional, we construct a dictionary with
+        #optional parameters (stress failures and relevant property)
+        optional = {}
+        for op in parts[5:]:
+            #Check it's ending char to add it to dictionary
+            if op[-1] == "r":
+                optional["rel"] = op[:-1] == "1"
+            elif op[-1] == "c":
+                optional["sf_c"] = float(op[:-1])
+            else:
+                optional["sf_t"] = float(op[:-1])
+        #Then, we create the layer
+        layer = Layer(float(parts[0]), float(parts[1]), float(parts[2]),
+                      float(parts[3]), float(parts[4]), **optional)
+        all_layers.append(layer)
+    #Now, we set the parameters for the simulation
+    line, i = next_line(lines, i)
+    parts = line.split(",")
+    #First, we check if 'r' or 't'
+    if parts[0] == 't':
+        finalt = float(parts[1])
+    else:
+        #We find the time according to the num of reverberations of the first wave needed
+        one_rev = 0
+        for l in all_layers[1:]: #loop avoiding first layer (projectile)
+            one_rev += (l.h/l.c)*2
+        finalt = round(one_rev*float(parts[1]),2)
+    if step is None:
+        step = 0.01 if len(parts) == 2 else float(parts[2])
+    #Then, we read the init conditions (init waves) to consider
+    #First, num of init waves
+    line, i = next_line(lines, i)
+    qty_waves = int(line)
+    #The lines of the waves are kept until the layers are discretized
+    wave_lines = []
+    for w in range(qty_waves):
+        line, i = next_line(lines, i)
+        wave_lines.append(line)
+    #Finally, the optional directives
+    options = read_options(lines, i)
+    if precision is not None:
+        options["precision"] = precision
+    if stride is not None:
+        options["stride"] = stride
+    if window is not None:
+        options["window"] = window
+    if probes is not None:
+        options["probes"] = probes
+    if interfaces is not None:
+        options["interfaces"] = interfaces
+    #Only the probes are recorded, the meshes aren't needed
+    if options.get("probes") or options.get("interfaces"):
+        alloc = False
+    dtype = np.float32 if options.get("precision", 64) == 32 else float
+    #Using the parameters, we create the time vector and we discretize each layer
+    t = np.arange(0, finalt, step)
+    for layer in all_layers:
+        layer.nodes(step,t.size,alloc,scratch,dtype,options.get("stride", 1),options.get("window", False))
+    #Now, we construct the waves and add them to respective layers
+    for line in wave_lines:
+        #We first split the line by commas
+        parts = line.split(",")
+        #Now, we use the values to construct a wave on the respective layer
+        layer_num = int(parts[0])
+        pos = parts[1]
+        if parts[3] == "s":
+            sigma = float(parts[2])
+        else:
+            vel = float(parts[2])
+            sigma = vel/(1/all_layers[0].rhoc+1/all_layers[1].rhoc)
+        if pos == "E":
+            wave = Wave(all_layers[layer_num-1].numnod-1,
+                        all_layers[layer_num-1].numnod,0,sigma)
+        else:
+            wave = Wave(0,all_layers[layer_num-1].numnod,1,sigma)
+        all_layers[layer_num-1].waves.append(wave)
+    return all_layers, t, step, finalt, options
@@ -0,0 +1,234 @@
+import argparse
+import time
+import numpy as np
+import wave_prop_analysis_V3
+import data_generator
+from composite_reader import read_composite
+
+'''
+Convergence study of the time step of a composite
+The time step sets the discretization of the layers too (dinit = c*step, and
+Layer.nodes rounds the width of each layer to a multiple of it), so a coarser
+step is cheaper (fewer time steps and nodes) but changes the peak stresses.
+The study simulates the composite at the given step (reference) and at
+successively coarser ones (step*ratio, step*ratio^2, ...) and finds the
+coarsest step whose peak hydrostatic stresses (max tension and compression
+of each relevant layer) stay within a tolerance of the reference ones and
+whose label (data_generator.label) is the same. Once a step fails, the
+coarser ones are not simulated.
+Optionally, the peaks are Richardson-extrapolated from the step found and the
+next coarser one (the two cheapest runs), assuming the error of the peaks
+goes as step^order. It's only meaningful when the peaks converge smoothly.
+The difference printed for it is how far the extrapolated peaks are from the
+reference ones (the size of the correction), not an estimate of their error
+The reference step of an input file is its own time step by default
+Usage (from src/phase 2):
+  python convergence.py ../../data/single1.txt --levels 5 --tol 0.02 --richardson
+  python convergence.py --config 0
+'''
+
+'''
+Function that returns the time step written on an input file (0.01 micro-s
+if it has none)
+'''
+def file_step(filename):
+    return read_composite(filename, False, probes=[], interfaces=False)[2]
+
+'''
+Function that returns the builder of an input file for the study: a function
+that, given the time step and if the meshes are allocated, reads the file
+with that time step and returns the layers and the time vector
+'''
+def file_builder(filename):
+    #Function that reads the composite of the file with the given time step
+    def build(step, alloc):
+        all_layers, t, step, finalt, options = read_composite(filename, alloc, stride=1, window=False, probes=[],
+                                                              interfaces=False, step=step)
+        return all_layers, t
+    return build
+
+'''
+Function that returns the builder (see file_builder) of a configuration of
+the data generator (parameters of data_generator.composite)
+'''
+def config_builder(config):
+    #Function that creates and prepares the composite with the given time step
+    def build(step, alloc):
+        all_layers = data_generator.composite(*config)
+        return all_layers, data_generator.prepare(all_layers, step, alloc)
+    return build
+
+'''
+Function that returns the peak hydrostatic stresses of the relevant layers
+of a simulated composite (first layer, the projectile, avoided): an array
+with the max tension (>= 0) and max compression (<= 0) of each one
+'''
+def peaks(all_layers):
+    values = []
+    for layer in all_layers[1:]:
+        if layer.rel:
+            hyd_max, hyd_min = layer.hydRange()
+            values.append((max(hyd_max, 0), min(hyd_min, 0)))
+    return np.array(values, dtype=float).reshape(-1,2)
+
+'''
+Function that returns the label of a simulated composite (see
+data_generator.label), or None if its relevant layers have no failure stresses
+'''
+def label(all_layers):
+    for layer in all_layers[1:]:
+        if layer.rel and (layer.sf_t is None or layer.sf_c is None):
+            return None
+    return data_generator.label(all_layers)
+
+'''
+Function that returns the error of some peaks (see peaks) relative to the
+reference ones: max difference over the max abs reference peak
+'''
+def peak_error(values, reference):
+    scale = np.abs(reference).max() if reference.size > 0 else 0
+    diff = np.abs(values - reference).max() if reference.size > 0 else 0
+    return diff/scale if scale > 0 else diff
+
+'''
+Function that returns the Richardson extrapolation of some values (peaks)
+from the ones obtained with a time step (fine) and with ratio times that
+step (coarse), assuming the error goes as step^order
+'''
+def extrapolate(fine, coarse, ratio=2, order=1):
+    return fine + (fine - coarse)/(ratio**order - 1)
+
+'''
+Function that simulates the composite of a builder with a time step, keeping
+only the reductions with V3 (the meshes are allocated for other versions)
+Returns the record of the run: step, num of time steps and of nodes, peaks,
+label and the seconds taken to simulate
+'''
+def simulate_step(build, step, version=wave_prop_analysis_V3):
+    reduce = version is wave_prop_analysis_V3
+    all_layers, t = build(step, not reduce)
+    options = {"verbose": False}
+    if reduce:
+        options["storage"] = "reduce"
+    start_time = time.time()
+    version.simulate_waves(all_layers, t, step, **options)
+    seconds = time.time() - start_time
+    record = {"step": step, "steps": int(t.size), "nodes": int(sum(layer.numnod for layer in all_layers)),
+              "peaks": peaks(all_layers), "label": label(all_layers), "seconds": seconds}
+    for layer in all_layers:
+        layer.free_mesh()
+    return record
+
+'''
+Class with the results of a convergence study
+runs -> record of each step simulated (see simulate_step), from the finest
+        (reference) one, with the error of its peaks ("error") and if it's
+        within the tolerance with the same label ("ok")
+step -> coarsest step found (the steps up to it are all within the tolerance)
+selected -> record of that step
+extrapolated -> Richardson extrapolation of the peaks (None if not asked)
+correction -> difference of the extrapolated peaks from the reference ones
+              (see peak_error), the size of the correction of the
+              extrapolation and not its error (None if not asked)
+'''
+class Convergence:
+    #Constructor of the Convergence class
+    def __init__(self,runs,tol,extrapolated=None):
+        self.runs = runs
+        self.tol = tol
+        passed = [run for run in runs if run["ok"]]
+        self.selected = passed[-1]
+        self.step = self.selected["step"]
+        self.extrapolated = extrapolated
+        self.correction = None if extrapolated is None else peak_error(extrapolated, runs[0]["peaks"])
+
+    #String representation (readable format) of the study
+    def __str__(self):
+        reference = self.runs[0]
+        lines = ["{0:>10}{1:>9}{2:>9}{3:>12}{4:>7}{5:>11}{6:>9}".format(
+            "Step", "Steps", "Nodes", "Error", "Label", "Seconds", "Speedup")]
+        for run in self.runs:
+            lines.append("{0:>10.4g}{1:>9}{2:>9}{3:>12.4e}{4:>7}{5:>11.4f}{6:>8.1f}x{7}".format(
+                run["step"], run["steps"], run["nodes"], run["error"], str(run["label"]), run["seconds"],
+                reference["seconds"]/run["seconds"] if run["seconds"] > 0 else 0, "" if run["ok"] else "  (out)"))
+        lines.append("Coarsest step within {0:g}: {1:g} micro-s".format(self.tol, self.step))
+        if self.extrapolated is not None:
+            lines.append("Richardson extrapolation from {0:g} and {1:g}: correction {2:.4e} from the reference".format(
+                self.step, self.runs[self.runs.index(self.selected)+1]["step"], self.correction))
+        return "\n".join(lines)
+
+    #String representation of the study
+    def __repr__(self):
+        return self.__str__()
+
+'''
+Function that runs the convergence study of a composite
+build -> builder of the composite (see file_builder and config_builder)
+step -> finest time step (reference), 0.01 micro-s by default (main uses
+        the one of the input file)
+ratio, levels -> the steps are step*ratio^k for k from 0 until levels-1
+tol -> max error of the peaks (see peak_error) for a step to be accepted
+version -> version of the simulation code (V3 by default)
+richardson, order -> if the peaks are extrapolated from the step found and the
+                     next coarser one (simulated if not done), assuming an
+                     error that goes as step^order
+If verbose, every run is printed once it's done. Returns a Convergence
+'''
+def convergence_study(build, step=0.01, ratio=2, levels=5, tol=0.01, version=wave_prop_analysis_V3,
+                      richardson=False, order=1, verbose=True):
+    runs = []
+    for k in range(levels):
+        run = simulate_step(build, step*ratio**k, version)
+        reference = runs[0] if runs else run
+        run["error"] = peak_error(run["peaks"], reference["peaks"])
+        run["ok"] = run["error"] <= tol and run["label"] == reference["label"]
+        runs.append(run)
+        if verbose:
+            print("Step {0:g}: {1} time steps, error {2:.4e}, label {3}, {4:f} seconds".format(
+                run["step"], run["steps"], run["error"], run["label"], run["seconds"]))
+        if not run["ok"]:
+            break #coarser steps aren't considered
+    extrapolated = None
+    if richardson:
+        passed = [run for run in runs if run["ok"]]
+        if len(runs) == len(passed):
+            #The next coarser step is needed for the extrapolation
+            run = simulate_step(build, step*ratio**len(runs), version)
+            run["error"] = peak_error(run["peaks"], runs[0]["peaks"])
+            run["ok"] = False #not checked, only used for the extrapolation
+            runs.append(run)
+        extrapolated = extrapolate(passed[-1]["peaks"], runs[len(passed)]["peaks"], ratio, order)
+    return Convergence(runs, tol, extrapolated)
+
+'''
+Function with the command line interface of convergence_study
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convergence study of the time step of a composite")
+    parser.add_argument("file", nargs="?", default=None, help="input file of the composite")
+    parser.add_argument("--config", type=int, default=None, help="configuration of the data generator instead")
+    parser.add_argument("--step", type=float, default=None,
+                        help="finest time step (the one of the input file, or 0.01, by default)")
+    parser.add_argument("--ratio", type=float, default=2, help="ratio between steps (2 by default)")
+    parser.add_argument("--levels", type=int, default=5, help="num of steps (5 by default)")
+    parser.add_argument("--tol", type=float, default=0.01, help="max relative error of the peaks (0.01 by default)")
+    parser.add_argument("--richardson", action="store_true", help="extrapolate the peaks")
+    parser.add_argument("--order", type=float, default=1, help="order of the error for the extrapolation")
+    args = parser.parse_args(argv)
+    step = args.step
+    if args.config is not None:
+        build = config_builder(data_generator.configurations()[args.config])
+        step = 0.01 if step is None else step
+    elif args.file is not None:
+        build = file_builder(args.file)
+        step = file_step(args.file) if step is None else step
+    else:
+        parser.error("an input file or --config is needed")
+    print(convergence_study(build, step, args.ratio, args.levels, args.tol, richardson=args.richardson,
+                            order=args.order))
+
+'''
+Main block to call for main
+'''
+if __name__ == "__main__":
+    main()
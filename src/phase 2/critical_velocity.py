@@ -0,0 +1,88 @@
+import numpy as np
+import wave_prop_analysis_V3
+
+'''
+Functions to find the critical impact velocity of a composite: the velocity
+of the projectile above which a relevant layer fails (hydrostatic stress
+above its failure stress, in tension or compression)
+The model is linear elastic, so every stress of the simulation scales with
+the initial sigma, which is proportional to the impact velocity:
+sigma = vel/(1/rhoc0+1/rhoc1)
+The stresses of one simulation at a known velocity (for example, a unit-load
+simulation at 1 m/s) give the stresses at any other velocity, so the critical
+velocities are found directly from them.
+'''
+
+'''
+Function that returns the impact velocity (m/s) that gives an initial sigma
+(Pa) on the given composite (layer 0 is the projectile)
+'''
+def impact_velocity(all_layers, sigma):
+    return sigma*(1/all_layers[0].rhoc+1/all_layers[1].rhoc)
+
+'''
+Function that returns the impact velocity (abs value, m/s) of the initial
+waves on the layers (the largest one, as all the initial waves come from the
+same impact)
+'''
+def initial_velocity(all_layers):
+    sigma = max((abs(wave.value) for layer in all_layers for wave in layer.waves), default=0)
+    return abs(impact_velocity(all_layers, sigma))
+
+'''
+Function that returns the velocities at which a layer fails by tension and
+by compression, given the impact velocity of its simulation (inf if the
+layer never fails that way or has no failure stress)
+'''
+def layer_velocities(layer, velocity):
+    hyd_max, hyd_min = layer.hydRange()
+    #Hydrostatic stresses for an impact at 1 m/s
+    hyd_max, hyd_min = hyd_max/velocity, hyd_min/velocity
+    vel_t = layer.sf_t/hyd_max if layer.sf_t is not None and hyd_max > 0 else np.inf
+    vel_c = layer.sf_c/-hyd_min if layer.sf_c is not None and hyd_min < 0 else np.inf
+    return vel_t, vel_c
+
+'''
+Function that finds the critical velocities of the relevant layers of a
+simulated composite (mesh or stats on its layers), given the impact velocity
+of the simulation
+Returns a list with (layer num, tension velocity, compression velocity) for
+each relevant layer and the critical velocity of the composite as a tuple
+(velocity, layer num, "tension" or "compression"), velocity inf if it never
+fails. For velocities above the critical one, data_generator.label gives 0
+The impact velocity must be positive (the stresses are divided by it)
+'''
+def critical_velocity(all_layers, velocity):
+    if not velocity > 0:
+        raise ValueError("The impact velocity of the simulation must be positive (got {0})".format(velocity))
+    layers = []
+    critical = (np.inf, None, None)
+    for i, layer in enumerate(all_layers[1:],1): #first layer (projectile) avoided
+        if layer.rel:
+            vel_t, vel_c = layer_velocities(layer, velocity)
+            layers.append((i, vel_t, vel_c))
+            if vel_t < critical[0]:
+                critical = (vel_t, i, "tension")
+            if vel_c < critical[0]:
+                critical = (vel_c, i, "compression")
+    return layers, critical
+
+'''
+Function that runs one unit-load simulation (the initial waves scaled to an
+impact at 1 m/s) and returns the critical velocities (see critical_velocity)
+Receives the layers (discretized, with the initial waves of the impact on
+them), the time vector and the time step. With V3, only the reductions of
+the stresses are kept (the layers can be discretized with alloc=False)
+'''
+def simulate_unit(all_layers, t, step, version=wave_prop_analysis_V3):
+    velocity = initial_velocity(all_layers)
+    if not velocity > 0:
+        raise ValueError("The composite has no initial waves to scale to an impact at 1 m/s")
+    for layer in all_layers:
+        for wave in layer.waves:
+            wave.value /= velocity
+    if version is wave_prop_analysis_V3:
+        version.simulate_waves(all_layers, t, step, verbose=False, storage="reduce")
+    else:
+        version.simulate_waves(all_layers, t, step, verbose=False)
+    return critical_velocity(all_layers, 1.0)
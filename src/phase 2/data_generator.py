@@ -1,6 +1,14 @@
 import numpy as np
 import csv
-from wave_prop_analysis_V2 import Layer, Wave, simulate_waves
+import os
+import time
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+import wave_prop_analysis_V2, wave_prop_analysis_V3
+from wave_prop_analysis_V2 import Layer, Wave
+from result_cache import ResultCache, simulate_cached
+from surrogate import Surrogate
+import samplers
 
 '''
 Function that checks if a given composite should be considered or not.
@@ -12,8 +20,9 @@ def label(all_layers):
         if layer.rel:
             #We first find both max tension and compression stresses for all
             #times and all points
-            max_tension = np.amax(layer.hydStress()) if np.amax(layer.hydStress()) > 0 else 0
-            max_compression = np.amin(layer.hydStress()) if np.amin(layer.hydStress()) < 0 else 0
+            hyd_max, hyd_min = layer.hydRange()
+            max_tension = hyd_max if hyd_max > 0 else 0
+            max_compression = hyd_min if hyd_min < 0 else 0
             #Finally, we check if stresses are above the failure stress
             if abs(max_compression) > layer.sf_c or abs(max_tension) > layer.sf_t:
                 return 0 #meaning it can't be considered
@@ -22,80 +31,377 @@ def label(all_layers):
     return 1
     
 '''
-Function that simulates the wave propagation for some generated data
-and exports data to a CSV file
+Function that checks if the composites of a batch should be considered or
+not, the same as label but for all of them at once (vectorized). All the
+composites must have the same num of layers and the stats (reductions) of
+their layers (simulate_batch or storage="reduce")
+Returns an array with the labels of the composites
 '''
-def simulate():
-    #Start setting the parameters for all layers to consider
-    data_layer1 = [(334e9,3690), (344e9,3970), (260e9,3590)]
-    h2 = np.linspace(0.5,0.7,9)
-    h4 = np.linspace(0.5,0.7,9)
-    h6 = np.linspace(0.5,0.7,9)
-    h9 = np.linspace(1,3,3)
-    #List to hold all the parameters to export to CSV
-    rows = []
-    i = 1
-    for data in data_layer1:
-        for h2i in h2:
-            for h4i in h4:
-                for h6i in h6:
-                    for h9i in h9:
-                        print(i, end="")
-                        #Create composite
-                        L0 = Layer(18.75,14e9,11340,1,0.431,sf_t=2069e6,rel=False)
-                        L1 = Layer(5,data[0],data[1],1,0.22,sf_t=742e6,rel=False)
-                        L2 = Layer(h2i,2.02e9,1104,1,0.3,sf_t=89e6,rel=False)
-                        L3 = Layer(4,70e9,2210,1,0.22,sf_t=48e6,rel=False)
-                        L4 = Layer(h4i,2.02e9,1104,1,0.3,sf_t=89e6,rel=False)
-                        L5 = Layer(4,70e9,2210,1,0.22,sf_t=48e6,rel=False)
-                        L6 = Layer(h6i,2.02e9,1104,1,0.3,sf_t=89e6,rel=False)
-                        L7 = Layer(4,70e9,2210,1,0.22,sf_t=48e6,rel=False)
-                        L8 = Layer(0.6,2.02e9,1104,1,0.3,sf_t=89e6,rel=False)
-                        L9 = Layer(h9i,2.586e9,1200,1,0.33,sf_t=104e6,rel=True)
-                        all_layers = [L0,L1,L2,L3,L4,L5,L6,L7,L8,L9]
-                        #Set num of nodes given the time for simulation
-                        step = 0.01
-                        one_rev = 0
-                        for l in all_layers[1:]: #loop avoiding first layer (projectile)
-                            one_rev += (l.h/l.c)*2
-                        finalt = round(one_rev,2)
-                        #Using the parameters, we create the time vector and we discretize each layer
-                        t = np.arange(0, finalt, step)
-                        for layer in all_layers:
-                            layer.nodes(step,t.size)
-                        #Set initial wave conditions
-                        sigma = -100/(1/all_layers[0].rhoc+1/all_layers[1].rhoc)
-                        wave = Wave(all_layers[0].numnod-1,all_layers[0].numnod,0,sigma)
-                        all_layers[0].waves.append(wave)
-                        wave = Wave(0,all_layers[1].numnod,1,sigma)
-                        all_layers[1].waves.append(wave)
-                        #SIMULATE WAVES
-                        simulate_waves(all_layers, t, step)
-                        #Label the result of simulation
-                        y = label(all_layers)
-                        #Append result into rows list (x inputs and y label)
-                        row = []
-                        for layer in all_layers:
-                            row.extend([layer.h, layer.E, layer.rho, layer.sf_t, layer.sf_c, (1 if layer.rel else 0)])
-                        row.append(y)
-                        rows.append(row)
-                        i += 1
-
-    #Once all composites were simulated, we export the data to a CSV file
-    #First, we create the header
+def label_batch(composites):
+    #Arrays (composites x layers) with the data of the layers (first one avoided)
+    get = lambda f: np.array([[f(layer) for layer in all_layers[1:]] for all_layers in composites], dtype=float)
+    v = get(lambda layer: layer.v)
+    rel = get(lambda layer: layer.rel) == 1
+    sf_t = get(lambda layer: layer.sf_t if layer.rel else np.inf)
+    sf_c = get(lambda layer: layer.sf_c if layer.rel else np.inf)
+    #Max and min hydrostatic stresses from the max and min stresses of the layers
+    hyd = lambda x: ((v*x/(1-v))*2 + x)/3
+    hyd_a = hyd(get(lambda layer: layer.stats.max))
+    hyd_b = hyd(get(lambda layer: layer.stats.min))
+    hyd_max = np.maximum(hyd_a, hyd_b)
+    hyd_min = np.minimum(hyd_a, hyd_b)
+    max_tension = np.where(hyd_max > 0, hyd_max, 0)
+    max_compression = np.where(hyd_min < 0, hyd_min, 0)
+    #Finally, we check if stresses are above the failure stress on relevant layers
+    failed = rel & ((abs(max_compression) > sf_c) | (abs(max_tension) > sf_t))
+    return np.where(failed.any(axis=1), 0, 1)
+
+'''
+Function that creates the layers of a composite of the generated data
+Receives the data (E, rho) of the first layer after the projectile (layer 1)
+and the widths of layers 2, 4, 6 and 9
+'''
+def composite(data, h2i, h4i, h6i, h9i):
+    L0 = Layer(18.75,14e9,11340,1,0.431,sf_t=2069e6,rel=False)
+    L1 = Layer(5,data[0],data[1],1,0.22,sf_t=742e6,rel=False)
+    L2 = Layer(h2i,2.02e9,1104,1,0.3,sf_t=89e6,rel=False)
+    L3 = Layer(4,70e9,2210,1,0.22,sf_t=48e6,rel=False)
+    L4 = Layer(h4i,2.02e9,1104,1,0.3,sf_t=89e6,rel=False)
+    L5 = Layer(4,70e9,2210,1,0.22,sf_t=48e6,rel=False)
+    L6 = Layer(h6i,2.02e9,1104,1,0.3,sf_t=89e6,rel=False)
+    L7 = Layer(4,70e9,2210,1,0.22,sf_t=48e6,rel=False)
+    L8 = Layer(0.6,2.02e9,1104,1,0.3,sf_t=89e6,rel=False)
+    L9 = Layer(h9i,2.586e9,1200,1,0.33,sf_t=104e6,rel=True)
+    return [L0,L1,L2,L3,L4,L5,L6,L7,L8,L9]
+
+'''
+Function that prepares a composite for the simulation: finds the time for
+one reverberation, discretizes the layers (allocating the meshes or not)
+and sets the initial waves for the impact of the projectile
+Returns the time vector for the simulation
+'''
+def prepare(all_layers, step=0.01, alloc=True):
+    #Set num of nodes given the time for simulation
+    one_rev = 0
+    for l in all_layers[1:]: #loop avoiding first layer (projectile)
+        one_rev += (l.h/l.c)*2
+    finalt = round(one_rev,2)
+    #Using the parameters, we create the time vector and we discretize each layer
+    t = np.arange(0, finalt, step)
+    for layer in all_layers:
+        layer.nodes(step,t.size,alloc)
+    #Set initial wave conditions
+    sigma = -100/(1/all_layers[0].rhoc+1/all_layers[1].rhoc)
+    wave = Wave(all_layers[0].numnod-1,all_layers[0].numnod,0,sigma)
+    all_layers[0].waves.append(wave)
+    wave = Wave(0,all_layers[1].numnod,1,sigma)
+    all_layers[1].waves.append(wave)
+    return t
+
+#Design space of the composites (parameters of the function composite, see
+#samplers): data (E, rho) of layer 1, one of the materials, and widths (mm)
+#of layers 2, 4, 6 and 9
+DESIGN_SPACE = [("data", [(334e9,3690), (344e9,3970), (260e9,3590)]),
+                ("h2i", (0.5,0.7)), ("h4i", (0.5,0.7)), ("h6i", (0.5,0.7)), ("h9i", (1,3))]
+#Num of values of each width on the full grid
+GRID_LEVELS = {"h2i": 9, "h4i": 9, "h6i": 9, "h9i": 3}
+
+'''
+Function that returns the list of all the configurations (parameters of
+the function composite) to simulate, given by a sampler of the design space
+(see samplers): "grid" (full grid, default), "lhs" or "sobol" (n
+configurations given by the seed)
+'''
+def configurations(sampler="grid", n=None, seed=0):
+    return samplers.sample(DESIGN_SPACE, n, sampler, seed, GRID_LEVELS)
+
+'''
+Function that returns the row to export for a simulated composite
+(x inputs and y label)
+'''
+def row(all_layers, y):
+    row = []
+    for layer in all_layers:
+        row.extend([layer.h, layer.E, layer.rho, layer.sf_t, layer.sf_c, (1 if layer.rel else 0)])
+    row.append(int(y))
+    return row
+
+'''
+Function that returns the inputs of the row of a configuration (without the
+label), the same as the ones of the row of its simulated composite (the
+widths of the layers are the ones of their discretization), without simulating it
+'''
+def features(config, step=0.01):
+    all_layers = composite(*config)
+    prepare(all_layers, step, False)
+    return row(all_layers, 0)[:-1]
+
+'''
+Function that returns the header of the exported data
+'''
+def header(all_layers):
     header = []
     for i, layer in enumerate(all_layers):
         l = "L"+str(i)
         header.extend([l+"_h",l+"_E",l+"_rho",l+"_sf_t",l+"_sf_c",l+"_rel"])
     header.append("Y")
-    #Now, we use the csv module to export the file
-    with open('all_data_2.csv', 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(header)
-        writer.writerows(rows)
+    return header
+
+'''
+Function that simulates and labels a list of configurations and returns
+their rows to export
+The version of the simulation code to use (V2 or V3) can be chosen, both
+give the same results. V3 simulates all the composites of the list together
+(batch) and only keeps the max/min stresses of the layers (reductions), as
+it's all the label needs, and stops each composite once a relevant layer
+fails (its label is 0 from then on). If verbose is False, nothing is printed
+V3 is the default for the batches: simulating one composite on its own (the
+whole mesh, as the benchmark does) it's slower than V2 on one reverberation,
+the simulation of the data, and only 2-3 times faster on 3 or 4, but in
+batches with only the reductions it takes ~0.05 seconds per composite on
+batches of 81 against ~0.3 with V2 (~0.07 on batches of 9, and on batches
+of 1 it's still not slower, ~0.21 against ~0.24)
+The results are kept on the cache of the given directory (None to not use
+it), so the composites already simulated are not simulated again
+'''
+def simulate_configs(configs, version=wave_prop_analysis_V3, verbose=True, cache=None):
+    step = 0.01
+    rows = []
+    store = ResultCache(cache) if cache is not None else None
+    if version is wave_prop_analysis_V3:
+        composites = [composite(*config) for config in configs]
+        ts = [prepare(all_layers, step, False) for all_layers in composites]
+        #Composites found on the cache are not simulated
+        missing = list(range(len(composites)))
+        if store is not None:
+            keys = [store.key(all_layers, t, step, version.__name__, storage="reduce", stop_on_failure=True)
+                    for all_layers, t in zip(composites, ts)]
+            missing = [n for n in missing if not store.load(keys[n], composites[n], ts[n])[0]]
+        #SIMULATE WAVES
+        if missing:
+            version.simulate_batch([composites[n] for n in missing], [ts[n] for n in missing], step,
+                                   stop_on_failure=True)
+            if store is not None:
+                for n in missing:
+                    store.save(keys[n], composites[n])
+        #Label the results of simulation
+        for all_layers, y in zip(composites, label_batch(composites)):
+            rows.append(row(all_layers, y))
+    else:
+        for i, config in enumerate(configs, 1):
+            if verbose:
+                print(i, end="")
+            all_layers = composite(*config)
+            t = prepare(all_layers, step)
+            #SIMULATE WAVES
+            simulate_cached(store, version, all_layers, t, step, verbose=verbose)
+            #Label the result of simulation
+            rows.append(row(all_layers, label(all_layers)))
+    return rows
+
+'''
+Function that runs simulate_configs on a worker process. Receives a tuple
+with the name of the module of the version to use, the configurations and
+the directory of the cache
+'''
+def simulate_worker(args):
+    version_name, configs, cache = args
+    return simulate_configs(configs, importlib.import_module(version_name), False, cache)
+
+'''
+Function that returns the key (text) of a configuration, used to record
+which configurations are done
+'''
+def config_key(config):
+    data, h2i, h4i, h6i, h9i = config
+    return ",".join(repr(float(x)) for x in (*data, h2i, h4i, h6i, h9i))
+
+'''
+Class that writes the rows of the simulated composites to a CSV file as
+they are completed (flushed on every write), and records the keys of the
+configurations done on a second file (<filename>.done, one key per line),
+so an interrupted generation can be continued
+If resume is True and both files exist, the configurations done are loaded
+(rows of the CSV without a key, from an interruption while writing, are
+removed). Otherwise, both files are started again with the given header
+If resume is True and the CSV has rows but no .done file (data not written by
+a Checkpoint, or its record lost), an error is raised instead of overwriting
+it: move it away or use resume=False to start it again
+'''
+class Checkpoint:
+    #Constructor of the Checkpoint class
+    def __init__(self, header, filename='all_data_2.csv', resume=True):
+        self.filename = filename
+        self.done_filename = filename + '.done'
+        keys, lines = [], []
+        if resume and os.path.exists(filename) and not os.path.exists(self.done_filename):
+            with open(filename, newline='') as file:
+                rows = sum(1 for line in file) - 1 #header avoided
+            if rows > 0:
+                raise ValueError("{0} has {1} rows but no {2} to resume from, it would be overwritten "
+                                 "(move it away or use resume=False)".format(filename, rows, self.done_filename))
+        if resume and os.path.exists(filename) and os.path.exists(self.done_filename):
+            #Only complete lines are considered on both files
+            with open(self.done_filename) as file:
+                keys = [line[:-1] for line in file if line.endswith('\n')]
+            with open(filename, newline='') as file:
+                lines = [line for line in file if line.endswith('\n')][:len(keys)+1]
+            keys = keys[:max(len(lines)-1, 0)]
+        self.done = set(keys)
+        #Files are written again with the rows and keys kept, and then opened to append
+        with open(filename, 'w', newline='') as file:
+            if lines:
+                file.writelines(lines)
+            else:
+                csv.writer(file).writerow(header)
+        with open(self.done_filename, 'w') as file:
+            file.writelines(key+'\n' for key in keys)
+        self.file = open(filename, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        self.done_file = open(self.done_filename, 'a')
+
+    #Function that returns the configurations of the list not done yet
+    def pending(self, configs):
+        return [config for config in configs if config_key(config) not in self.done]
+
+    #Function that writes the rows of some configurations and records them as done
+    #(rows are written to disk before their keys)
+    def write(self, configs, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        keys = [config_key(config) for config in configs]
+        self.done_file.writelines(key+'\n' for key in keys)
+        self.done_file.flush()
+        os.fsync(self.done_file.fileno())
+        self.done.update(keys)
+
+    #Function that closes both files
+    def close(self):
+        self.file.close()
+        self.done_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+'''
+Function that simulates the wave propagation for some generated data
+and exports data to a CSV file
+The configurations are simulated in batches of the given size (see
+simulate_configs for the versions of the simulation code) and the rows of
+each batch are written to the file once it's completed. If resume is True,
+the configurations done by a previous (interrupted) call are skipped.
+The results are kept on the cache of the given directory (None to not use it)
+The configurations are given by a sampler (see configurations), the full grid
+by default
+'''
+def simulate(version=wave_prop_analysis_V3, batch=81, filename='all_data_2.csv', resume=True, cache="cache",
+             sampler="grid", n=None, seed=0):
+    configs = configurations(sampler, n, seed)
+    with Checkpoint(header(composite(*configs[0])), filename, resume) as checkpoint:
+        pending = checkpoint.pending(configs)
+        print("{0} of {1} composites done, {2} to simulate".format(
+            len(configs)-len(pending), len(configs), len(pending)))
+        for b in range(0, len(pending), batch):
+            if version is wave_prop_analysis_V3:
+                print("Composites {0} to {1} of {2}".format(b+1, min(b+batch, len(pending)), len(pending)))
+            chunk = pending[b:b+batch]
+            checkpoint.write(chunk, simulate_configs(chunk, version, cache=cache))
+
+'''
+Function that simulates the wave propagation for some generated data
+using a pool of worker processes, and exports data to a CSV file
+The configurations are sent to the workers in chunks of the given size
+(with V3, each chunk is simulated as one batch) and the rows are written
+to the file in the same order as simulate, no matter the order the chunks
+are completed. If resume is True, the configurations done by a previous
+(interrupted) call are skipped
+workers -> num of worker processes (None, one per CPU)
+cache -> directory of the cache of results, shared by all workers (None to not use it)
+sampler, n, seed -> sampler of the configurations (see configurations)
+'''
+def simulate_parallel(workers=None, chunk=81, version=wave_prop_analysis_V3, filename='all_data_2.csv', resume=True,
+                      cache="cache", sampler="grid", n=None, seed=0):
+    configs = configurations(sampler, n, seed)
+    with Checkpoint(header(composite(*configs[0])), filename, resume) as checkpoint:
+        pending = checkpoint.pending(configs)
+        print("{0} of {1} composites done, {2} to simulate".format(
+            len(configs)-len(pending), len(configs), len(pending)))
+        chunks = [pending[b:b+chunk] for b in range(0, len(pending), chunk)]
+        done = 0
+        start_time = time.time()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            #map returns the results in the order of the chunks
+            results = executor.map(simulate_worker, [(version.__name__, c, cache) for c in chunks])
+            for configs_chunk, rows in zip(chunks, results):
+                checkpoint.write(configs_chunk, rows)
+                done += len(rows)
+                elapsed = time.time() - start_time
+                print("{0} of {1} composites ({2:.2f} composites/s)".format(
+                    done, len(pending), done/elapsed))
+        elapsed = time.time() - start_time
+        print("--- {0} composites in {1:f} seconds ({2:.2f} composites/s) ---".format(
+            done, elapsed, done/elapsed if elapsed > 0 else 0))
+
+'''
+Function that simulates the wave propagation for the generated data only
+where a trained classifier (see surrogate) is unsure, and exports data to a
+CSV file
+The configurations are scored by the classifier in blocks of <score_batch>
+of them: the ones with a predicted probability of label 1 inside the band
+(low, high) are simulated (in batches of the given size, see
+simulate_configs) and the rest are accepted with the predicted label. The
+rows have two more columns than the ones of simulate: P (probability
+predicted) and SIMULATED (1 if the label comes from the simulation, 0 if it
+was predicted). If resume is True, the configurations done by a previous
+(interrupted) call are skipped
+surrogate -> Surrogate object, or the file of a Keras model (and its
+             features spec, <file>.json) to load
+configs -> configurations to consider (all of configurations() by default)
+cache -> directory of the cache of results (None to not use it)
+Returns the num of configurations simulated and predicted
+'''
+def simulate_screened(surrogate, band=(0.1, 0.9), configs=None, batch=81, score_batch=100000,
+                      version=wave_prop_analysis_V3, filename='screened_data.csv', resume=True, cache="cache"):
+    configs = configurations() if configs is None else configs
+    names = header(composite(*configs[0]))
+    if isinstance(surrogate, str):
+        surrogate = Surrogate.load(surrogate, names[:-1])
+    simulated, predicted = 0, 0
+    start_time = time.time()
+    with Checkpoint(names + ["P", "SIMULATED"], filename, resume) as checkpoint:
+        pending = checkpoint.pending(configs)
+        print("{0} of {1} composites done, {2} to consider".format(
+            len(configs)-len(pending), len(configs), len(pending)))
+        for b in range(0, len(pending), score_batch):
+            block = pending[b:b+score_batch]
+            rows = [features(config) for config in block]
+            p = surrogate.probability(rows)
+            unsure = (p >= band[0]) & (p <= band[1])
+            #Configurations the classifier is sure about: predicted label
+            sure = np.nonzero(~unsure)[0]
+            checkpoint.write([block[n] for n in sure], [rows[n] + [int(p[n] > 0.5), p[n], 0] for n in sure])
+            predicted += sure.size
+            #The rest are simulated
+            unsure = np.nonzero(unsure)[0]
+            for u in range(0, unsure.size, batch):
+                idx = unsure[u:u+batch]
+                chunk = [block[n] for n in idx]
+                results = simulate_configs(chunk, version, False, cache)
+                checkpoint.write(chunk, [result + [p[n], 1] for n, result in zip(idx, results)])
+                simulated += idx.size
+            print("{0} of {1} composites, {2} simulated ({3:.1f}%)".format(
+                b+len(block), len(pending), simulated, 100*simulated/(simulated+predicted)))
+    elapsed = time.time() - start_time
+    print("--- {0} composites in {1:f} seconds: {2} simulated, {3} predicted ---".format(
+        simulated+predicted, elapsed, simulated, predicted))
+    return simulated, predicted
 
 '''
 Main block to call for simulate
 '''
 if __name__ == "__main__":
-    simulate()
\ No newline at end of file
+    simulate_parallel()
\ No newline at end of file
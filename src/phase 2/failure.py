@@ -0,0 +1,40 @@
+'''
+Analysis of the failure of a simulated composite (option 7 of
+single_composite_analysis), shared by the single composite analysis and by
+batch_analysis: its relevant layers are compared with their failure stresses
+'''
+
+'''
+Function that runs the analysis of a simulated composite (option 7 of
+single_composite_analysis): max hydrostatic tension and compression of each
+relevant layer and if they're above its failure stresses
+Returns None if a relevant layer has no failure stresses, otherwise a list
+with (layer num, max tension, max compression, tension failed, compression
+failed) for each relevant layer
+'''
+def failure_analysis(all_layers):
+    for layer in all_layers[1:]:
+        if layer.rel and layer.sf_c is None: #checking one is enough
+            return None
+    layers = []
+    for i, layer in enumerate(all_layers[1:],1): #first layer (projectile) avoided
+        if layer.rel:
+            hyd_max, hyd_min = layer.hydRange()
+            max_tension = hyd_max if hyd_max > 0 else 0
+            max_compression = hyd_min if hyd_min < 0 else 0
+            layers.append((i, max_tension, max_compression,
+                           abs(max_tension) > layer.sf_t, abs(max_compression) > layer.sf_c))
+    return layers
+
+'''
+Function that returns the message of a relevant layer above its failure
+stresses (empty if it's not), as printed by single_composite_analysis
+'''
+def failure_message(i, tension, compression):
+    if compression and tension:
+        return "Both tension and compression stresses in layer #"+str(i)+" are above failure stress"
+    elif compression:
+        return "Compression stress in layer #"+str(i)+" is above failure stress"
+    elif tension:
+        return "Tension stress in layer #"+str(i)+" are above failure stress"
+    return ""
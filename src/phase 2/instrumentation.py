@@ -0,0 +1,124 @@
+import time
+import numpy as np
+
+'''
+Instrumentation of the simulations of V3 (wave_prop_analysis_V3.run)
+An Instruments object given to simulate_waves or simulate_batch records,
+while the simulation runs:
+waves -> live waves at the end of each time step
+reflections -> waves reflected on the sides of the layers (free boundaries
+               and interfaces) on each time step
+transmissions -> waves transmitted to a neighbour layer on each time step
+lost -> transmitted waves discarded on each time step (V2 keeps only the last
+        one for each layer on a time step)
+merges -> waves combined with an existing one on each time step
+dropped -> waves dropped on each time step (culling, see atol and rtol)
+the same counts by layer (the layer of the wave reflected, the layer that
+receives the transmitted wave, the layer of the combined wave), the peak of
+live waves of each layer, the time spent on each phase of the time steps:
+copy -> copy of the previous row
+propagate -> movement, reflections and transmissions of the waves
+merge -> combination of waves
+apply -> changes of the waves added to the rows
+cull -> waves dropped (culling)
+record -> rows handed to the recorder (storage)
+other -> anything else (advance printed, composites of a batch completed)
+and the memory of each layer: mesh (dense storage) and peak of its waves.
+Without an Instruments object, the engine only checks for it (no overhead).
+The results are shown as a summary table (summary) and exported as a trace
+with a row per time step (trace, save_trace)
+'''
+class Instruments:
+    #Bytes of a wave on the engine (layer, position and direction as ints, value)
+    WAVE_BYTES = 32
+
+    #Constructor of the Instruments class
+    def __init__(self):
+        self.tsize = 0
+
+    #Function that starts the recording for a simulation, given the num of
+    #nodes of the layers, the num of time steps and the initial waves
+    def start(self,numnod,tsize,ints):
+        qty_layers = numnod.size
+        self.numnod = numnod
+        self.tsize = tsize
+        self.i = 1 #time step being simulated
+        self.initial = ints.shape[1]
+        self.steps = {name: np.zeros(tsize, dtype=np.int64)
+                      for name in ("waves", "reflections", "transmissions", "lost", "merges", "dropped")}
+        self.steps["waves"][0] = self.initial
+        self.layers = {name: np.zeros(qty_layers, dtype=np.int64)
+                       for name in ("reflections", "transmissions", "merges", "dropped")}
+        self.peak_waves = np.bincount(ints[0], minlength=qty_layers)
+        self.mesh_bytes = np.zeros(qty_layers, dtype=np.int64)
+        self.times = dict.fromkeys(("copy", "propagate", "merge", "apply", "cull", "record", "other"), 0.0)
+        self.total = 0.0
+        self.begin = self.clock = time.perf_counter()
+
+    #Function that adds the time since the last call to the given phase
+    def lap(self,phase):
+        now = time.perf_counter()
+        self.times[phase] += now - self.clock
+        self.clock = now
+
+    #Function that counts events of the current time step, given the layer of each one
+    def count(self,name,lays):
+        if lays.size > 0:
+            self.steps[name][self.i] += lays.size
+            if name in self.layers:
+                self.layers[name] += np.bincount(lays, minlength=self.numnod.size)
+
+    #Function that records the waves at the end of time step i
+    def end_step(self,i,ints):
+        self.steps["waves"][i] = ints.shape[1]
+        np.maximum(self.peak_waves, np.bincount(ints[0], minlength=self.numnod.size), out=self.peak_waves)
+        self.i = i+1
+
+    #Function that ends the recording, given the layers simulated (memory of their meshes)
+    def finish(self,all_layers):
+        self.total = time.perf_counter() - self.begin
+        for k, layer in enumerate(all_layers):
+            for name in ("mesh", "mesh_max", "mesh_min"):
+                mesh = getattr(layer, name, None)
+                if isinstance(mesh, np.ndarray):
+                    self.mesh_bytes[k] += mesh.nbytes
+
+    #Function that returns the trace (one value per time step) as a dictionary
+    #of arrays: step and the counts of each time step
+    def trace(self):
+        trace = {"step": np.arange(self.tsize)}
+        trace.update(self.steps)
+        return trace
+
+    #Function that saves the trace on a CSV file (one row per time step)
+    def save_trace(self,filename):
+        trace = self.trace()
+        np.savetxt(filename, np.column_stack(list(trace.values())), fmt="%d", delimiter=",",
+                   header=",".join(trace), comments="")
+
+    #Function that returns the summary of the simulation as a table (text)
+    def summary(self):
+        waves = self.steps["waves"]
+        lines = ["Time steps: {0}, total {1:f} seconds ({2:.0f} steps/s)".format(
+                     self.tsize, self.total, self.tsize/self.total if self.total > 0 else 0),
+                 "Waves: initial {0}, final {1}, peak {2} (step {3}), mean {4:.1f}".format(
+                     self.initial, waves[-1], waves.max(), waves.argmax(), waves.mean()),
+                 "Events: {0} reflections, {1} transmissions ({2} lost), {3} merges, {4} dropped".format(
+                     *(self.steps[name].sum() for name in ("reflections", "transmissions", "lost", "merges", "dropped"))),
+                 "{0:<10}{1:>12}{2:>8}".format("Phase", "Seconds", "%")]
+        for phase, seconds in self.times.items():
+            lines.append("{0:<10}{1:>12.4f}{2:>8.1f}".format(
+                phase, seconds, 100*seconds/self.total if self.total > 0 else 0))
+        lines.append("{0:<7}{1:>8}{2:>13}{3:>15}{4:>9}{5:>9}{6:>12}{7:>12}{8:>12}".format(
+            "Layer", "Nodes", "Reflections", "Transmissions", "Merges", "Dropped", "Peak waves", "Mesh MB",
+            "Waves KB"))
+        for k in range(self.numnod.size):
+            lines.append("{0:<7}{1:>8}{2:>13}{3:>15}{4:>9}{5:>9}{6:>12}{7:>12.2f}{8:>12.2f}".format(
+                k+1, self.numnod[k], self.layers["reflections"][k], self.layers["transmissions"][k],
+                self.layers["merges"][k], self.layers["dropped"][k], self.peak_waves[k],
+                self.mesh_bytes[k]/1e6, self.peak_waves[k]*self.WAVE_BYTES/1e3))
+        return "\n".join(lines)
+
+    #String representation (readable format) of the instruments
+    def __str__(self):
+        return self.summary()
@@ -0,0 +1,364 @@
+import threading
+import numpy as np
+
+'''
+Storage modes for the stresses of the layers during a simulation (V3)
+Recorders are built with the layers, their offsets and num of nodes on the
+flat rows and the time vector of the simulation.
+The engine works on flat rows of stresses (all the layers one after the
+other) and, on every time step i, hands to a recorder:
+prev -> complete row of stresses of the time step i-1
+cur -> row of the time step i, still missing the changes of step i+1
+and the sparse changes applied on that time step, (node, value) pairs for
+the current row and for the previous row. The recorder decides what to keep
+from them. At the end, the last row is handed to the finish function
+(before the end of the time vector if the simulation stopped early, then
+only the time steps until it are kept).
+'''
+
+'''
+Recorder that stores the complete mesh of every layer (dense, default)
+Each Layer must have its mesh allocated (Layer.nodes). If the meshes have a
+stride, only every stride-th row is stored, and if they have a window
+(mesh_max and mesh_min) the max and min of each node from a stored row
+until the next one are stored too
+'''
+class DenseRecorder:
+    #Constructor of the DenseRecorder class
+    def __init__(self,all_layers,off,numnod,t):
+        self.all_layers = all_layers
+        self.off = off
+        self.numnod = numnod
+        self.tsize = t.size
+        self.stride = getattr(all_layers[0], "stride", 1)
+        self.window = getattr(all_layers[0], "mesh_max", None) is not None
+        self.win_max = None #max and min of the current window (all layers)
+        self.win_min = None
+
+    #Function that stores the row of time step i (if needed) and adds it to the window
+    def store(self,i,row):
+        r, rem = divmod(i, self.stride)
+        if rem == 0:
+            for k, layer in enumerate(self.all_layers):
+                layer.mesh[r] = row[self.off[k]:self.off[k]+self.numnod[k]]
+        if self.window:
+            if rem == 0:
+                self.win_max = row.copy()
+                self.win_min = row.copy()
+            else:
+                np.maximum(self.win_max, row, out=self.win_max)
+                np.minimum(self.win_min, row, out=self.win_min)
+            #Window completed (or last time step)
+            if rem == self.stride-1 or i == self.tsize-1:
+                for k, layer in enumerate(self.all_layers):
+                    layer.mesh_max[r] = self.win_max[self.off[k]:self.off[k]+self.numnod[k]]
+                    layer.mesh_min[r] = self.win_min[self.off[k]:self.off[k]+self.numnod[k]]
+
+    #Function that stores the complete row of the previous time step
+    def step(self,i,prev,cur,changes_cur,changes_prev):
+        self.store(i-1, prev)
+
+    #Function that stores the last row of the simulation (the meshes end on it)
+    def finish(self,i,prev):
+        self.tsize = i+1
+        self.store(i, prev)
+        rows = i//self.stride + 1
+        for layer in self.all_layers:
+            if len(layer.mesh) > rows:
+                layer.mesh = layer.mesh[:rows]
+                if self.window:
+                    layer.mesh_max = layer.mesh_max[:rows]
+                    layer.mesh_min = layer.mesh_min[:rows]
+
+'''
+Recorder that only stores the sparse changes applied on every time step
+plus a complete row (keyframe) every <keyframe> time steps. The mesh of
+each layer is replaced by an EventMesh that rebuilds the rows and the
+time series of the nodes on demand
+'''
+class EventRecorder:
+    #Constructor of the EventRecorder class
+    def __init__(self,all_layers,off,numnod,t,keyframe=500):
+        self.all_layers = all_layers
+        self.off = off
+        self.numnod = numnod
+        self.tsize = t.size
+        self.keyframe = keyframe
+        self.keys = [np.zeros(numnod.sum())] #Row 0, before any change
+        self.cur = [(np.zeros(0, dtype=np.int32), np.zeros(0))] #No changes on step 0
+        self.prev = [(np.zeros(0, dtype=np.int32), np.zeros(0))]
+
+    #Function that stores the changes of the time step (zero values don't change
+    #any node) and, if needed, the keyframe
+    def step(self,i,prev,cur,changes_cur,changes_prev):
+        for changes, log in ((changes_cur, self.cur), (changes_prev, self.prev)):
+            nodes, vals = changes
+            mask = vals != 0
+            log.append((nodes[mask].astype(np.int32), vals[mask]))
+        if i % self.keyframe == 0:
+            self.keys.append(cur.copy())
+
+    #Function that builds the log and sets the EventMesh of each layer
+    def finish(self,i,prev):
+        log = EventLog(self.cur, self.prev, self.keys, self.keyframe, self.tsize)
+        for k, layer in enumerate(self.all_layers):
+            layer.mesh = EventMesh(log, self.off[k], self.numnod[k])
+
+'''
+Recorder that never stores the mesh, only running reductions of the rows of
+each layer. At the end, every layer has its mesh set to None and a
+LayerStats object on layer.stats
+For batches of composites, tsizes has the num of time steps of the composite
+of each layer (its rows don't change after that, only the first tsizes[k]
+rows are considered for the stats of each time step)
+'''
+class ReduceRecorder:
+    #Constructor of the ReduceRecorder class
+    def __init__(self,all_layers,off,numnod,t,tsizes=None):
+        self.all_layers = all_layers
+        self.off = off
+        self.numnod = numnod
+        self.t = t
+        self.tsizes = np.full(len(all_layers), t.size) if tsizes is None else tsizes
+        self.env_max = np.full(numnod.sum(), -np.inf)
+        self.env_min = np.full(numnod.sum(), np.inf)
+        self.t_max = np.zeros((t.size,len(all_layers)))
+        self.t_min = np.zeros((t.size,len(all_layers)))
+
+    #Function that adds a complete row to the reductions
+    def reduce(self,i,row):
+        np.maximum(self.env_max, row, out=self.env_max)
+        np.minimum(self.env_min, row, out=self.env_min)
+        self.t_max[i] = np.maximum.reduceat(row, self.off)
+        self.t_min[i] = np.minimum.reduceat(row, self.off)
+
+    #Function that adds the row of the previous time step
+    def step(self,i,prev,cur,changes_cur,changes_prev):
+        self.reduce(i-1, prev)
+
+    #Function that adds the last row and sets the stats of each layer
+    def finish(self,i,prev):
+        self.reduce(i, prev)
+        for k, layer in enumerate(self.all_layers):
+            nodes = slice(self.off[k], self.off[k]+self.numnod[k])
+            layer.mesh = None
+            tsize = min(self.tsizes[k], i+1)
+            layer.stats = LayerStats(self.env_max[nodes], self.env_min[nodes],
+                                     self.t_max[:tsize,k].copy(), self.t_min[:tsize,k].copy(), self.t[:tsize])
+
+'''
+Function that returns the nodes to record for a probe specification: list of
+(layer, node) pairs, layers numbered from 1 (the projectile) as on the input
+files and nodes given by their index (int, negative ones from the end of the
+layer) or by their position on the layer (float, in mm, nearest node).
+If interfaces is True, the nodes at both sides of every interface between
+layers are added. Returns a sorted list of (layer index, node) without repeats
+'''
+def probe_nodes(all_layers, probes=(), interfaces=False):
+    nodes = set()
+    for lay, node in probes:
+        if lay < 1 or lay > len(all_layers):
+            raise ValueError("Probe on a layer out of range: " + str(lay))
+        layer = all_layers[lay-1]
+        if isinstance(node, float):
+            if node < 0 or node > layer.h:
+                raise ValueError("Probe position out of layer {0}: {1} mm".format(lay, node))
+            j = min(int(round(node/layer.dinit)), layer.numnod-1)
+        else:
+            j = node + layer.numnod if node < 0 else node
+            if j < 0 or j >= layer.numnod:
+                raise ValueError("Probe node out of layer {0}: {1}".format(lay, node))
+        nodes.add((lay-1, j))
+    if interfaces:
+        for k in range(len(all_layers)-1):
+            nodes.add((k, all_layers[k].numnod-1))
+            nodes.add((k+1, 0))
+    return sorted(nodes)
+
+'''
+Recorder that only stores the time series of some nodes (probes, see
+probe_nodes), so the memory is O(time steps x probes) instead of
+O(time steps x nodes). At the end, every layer has its mesh set to None and
+the series of its probes on layer.probes, a dictionary node -> values for
+all times. The reductions of every layer (layer.stats, see ReduceRecorder)
+are kept too, so the max and min stresses (failure analysis, critical
+velocity) are still available
+'''
+class ProbeRecorder:
+    #Constructor of the ProbeRecorder class
+    def __init__(self,all_layers,off,numnod,t,probes=(),interfaces=False):
+        self.all_layers = all_layers
+        self.nodes = probe_nodes(all_layers, probes, interfaces)
+        self.flat = np.array([off[k]+j for k, j in self.nodes], dtype=int)
+        self.series = np.zeros((t.size,len(self.nodes)))
+        self.reductions = ReduceRecorder(all_layers,off,numnod,t)
+
+    #Function that stores the probes of the previous time step
+    def step(self,i,prev,cur,changes_cur,changes_prev):
+        self.series[i-1] = prev[self.flat]
+        self.reductions.step(i,prev,cur,changes_cur,changes_prev)
+
+    #Function that stores the probes of the last row and sets them (and the
+    #stats) on each layer
+    def finish(self,i,prev):
+        self.series[i] = prev[self.flat]
+        self.series = self.series[:i+1]
+        self.reductions.finish(i,prev)
+        for layer in self.all_layers:
+            layer.probes = {}
+        for c, (k, j) in enumerate(self.nodes):
+            self.all_layers[k].probes[j] = self.series[:,c]
+
+'''
+Class that holds the reductions of the stresses of a layer for a whole
+simulation:
+max, min -> max and min stress (all times and all nodes)
+env_max, env_min -> max and min stress of each node (all times)
+t_max, t_min -> max and min stress of each time step (all nodes)
+time_max, time_min -> time when the max and min stresses happen (micro-s)
+'''
+class LayerStats:
+    #Constructor of the LayerStats class
+    def __init__(self,env_max,env_min,t_max,t_min,t):
+        self.env_max = env_max
+        self.env_min = env_min
+        self.t_max = t_max
+        self.t_min = t_min
+        self.max = t_max.max()
+        self.min = t_min.min()
+        self.time_max = t[np.argmax(t_max)]
+        self.time_min = t[np.argmin(t_min)]
+
+    #String representation (readable format) of the stats
+    def __str__(self):
+        return "{{max = {0:.4e} Pa at {1:.2f} micro-s, min = {2:.4e} Pa at {3:.2f} micro-s}}".format(
+            self.max, self.time_max, self.min, self.time_min)
+
+    #String representation of the stats
+    def __repr__(self):
+        return self.__str__()
+
+'''
+Class that holds the sparse changes of a whole simulation (all layers)
+Changes are stored as flat arrays with pointers to the start of each time
+step (as a sparse CSR matrix):
+cur_nodes, cur_vals, cur_ptr -> changes on the row of the time step
+prev_nodes, prev_vals, prev_ptr -> changes on the row of the previous time step
+keys -> rows every <keyframe> time steps (before changes of the next step)
+The rows are rebuilt adding the changes in the same order the engine added
+them, so the values are exactly the same as the ones of a dense simulation
+'''
+class EventLog:
+    #Constructor of the EventLog class
+    def __init__(self,cur,prev,keys,keyframe,tsize):
+        self.cur_nodes, self.cur_vals, self.cur_ptr = EventLog.pack(cur)
+        self.prev_nodes, self.prev_vals, self.prev_ptr = EventLog.pack(prev)
+        self.keys = keys
+        self.keyframe = keyframe
+        self.tsize = tsize
+        #Last row built by each thread (num of row, row before changes of next
+        #step), so the export on the background doesn't share it with the plots
+        self.local = threading.local()
+
+    #Function that concatenates a list of (nodes, values) per time step
+    @staticmethod
+    def pack(changes):
+        ptr = np.zeros(len(changes)+1, dtype=int)
+        ptr[1:] = np.cumsum([nodes.size for nodes, vals in changes])
+        nodes = np.concatenate([nodes for nodes, vals in changes])
+        vals = np.concatenate([vals for nodes, vals in changes])
+        return nodes, vals, ptr
+
+    #Function that returns the complete row (all layers) of a time step
+    def row(self,r):
+        #We start from the nearest keyframe (or from the last row built, if closer)
+        k = (r // self.keyframe)*self.keyframe
+        cached = getattr(self.local, "cached", None) #read once
+        if cached is not None and k <= cached[0] <= r:
+            start, base = cached
+        else:
+            start, base = k, self.keys[r // self.keyframe]
+        base = base.copy()
+        a, b = self.cur_ptr[start+1], self.cur_ptr[r+1]
+        np.add.at(base, self.cur_nodes[a:b], self.cur_vals[a:b])
+        self.local.cached = (r, base)
+        #Finally, the changes done by the next step on this row
+        row = base.copy()
+        if r+1 < self.tsize:
+            a, b = self.prev_ptr[r+1], self.prev_ptr[r+2]
+            np.add.at(row, self.prev_nodes[a:b], self.prev_vals[a:b])
+        return row
+
+    #Function that returns the values of a node (flat numbering) for all times
+    def node(self,j):
+        #Cumulative sum of the changes of the node, in the same order
+        mask = self.cur_nodes == j
+        steps = np.searchsorted(self.cur_ptr, np.nonzero(mask)[0], side='right')-1
+        acc = np.add.accumulate(np.concatenate(([0.0], self.cur_vals[mask])))
+        #Value after the last change done up to each time step
+        last = np.searchsorted(steps, np.arange(self.tsize), side='right')
+        series = acc[last]
+        #Changes done by the next step on each row
+        mask = self.prev_nodes == j
+        steps = np.searchsorted(self.prev_ptr, np.nonzero(mask)[0], side='right')-1
+        np.add.at(series, steps-1, self.prev_vals[mask])
+        return series
+
+'''
+Class that represents the mesh of a layer stored as an EventLog
+It can be used as the mesh (numpy array) of the layer:
+mesh[i] -> row of time step i
+mesh[i][j], mesh[i,j] -> value of node j at time step i
+mesh[:,j] -> values of node j for all times
+len(mesh), mesh.shape, iteration through rows, np.array(mesh) (dense copy)
+'''
+class EventMesh:
+    #Constructor of the EventMesh class
+    def __init__(self,log,off,numnod):
+        self.log = log
+        self.off = off
+        self.numnod = numnod
+        self.shape = (log.tsize, numnod)
+        self.ndim = 2
+        self.dtype = np.dtype(float)
+
+    #Function that returns the row of time step i
+    def row(self,i):
+        i = i + self.shape[0] if i < 0 else i
+        if i < 0 or i >= self.shape[0]:
+            raise IndexError("time step out of range")
+        return self.log.row(i)[self.off:self.off+self.numnod]
+
+    #Function that returns the values of node j for all times
+    def column(self,j):
+        j = j + self.numnod if j < 0 else j
+        if j < 0 or j >= self.numnod:
+            raise IndexError("node out of range")
+        return self.log.node(self.off+j)
+
+    def __getitem__(self,key):
+        if isinstance(key, tuple):
+            rows, cols = key
+            if isinstance(rows, slice) and rows == slice(None) and not isinstance(cols, slice):
+                return self.column(int(cols))
+            return self[rows][...,cols]
+        if isinstance(key, slice):
+            return np.array([self.row(i) for i in range(*key.indices(self.shape[0]))]).reshape(-1,self.numnod)
+        return self.row(int(key))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for i in range(self.shape[0]):
+            yield self.row(i)
+
+    def __array__(self,dtype=None,copy=None):
+        dense = np.empty(self.shape)
+        for i in range(self.shape[0]):
+            dense[i] = self.row(i)
+        return dense if dtype is None else dense.astype(dtype)
+
+    @property
+    def T(self):
+        return np.asarray(self).T
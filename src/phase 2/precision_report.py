@@ -0,0 +1,90 @@
+import glob
+import os
+import numpy as np
+import wave_prop_analysis_V2
+import wave_prop_analysis_V3
+import data_generator
+from composite_reader import read_composite
+
+'''
+Report comparing the meshes stored in float32 (precision 32) against the
+ones in float64 (default): memory of the meshes, peak stresses (max and min
+of each layer) and the labels given by data_generator.label, for the input
+files on data/ and for some composites of the data generator, simulated with
+V2 and V3
+Both add the stresses of every time step in float64 and only store them in
+float32 (V2 through RowBuffer), so the error doesn't grow with the num of time
+steps: every stored value is just rounded to float32 (relative error up to
+~6e-8)
+'''
+
+#Versions of the simulation compared (name, module)
+VERSIONS = (("V2", wave_prop_analysis_V2), ("V3", wave_prop_analysis_V3))
+
+'''
+Function that returns the label of a simulated composite, or None if its
+relevant layers have no failure stresses
+'''
+def label(all_layers):
+    for layer in all_layers[1:]:
+        if layer.rel and (layer.sf_t is None or layer.sf_c is None):
+            return None
+    return data_generator.label(all_layers)
+
+'''
+Function that compares the peak stresses and labels of two simulations of the
+same composite (list of layers with float64 meshes and with float32 meshes)
+Returns the memory (bytes) of both, the max difference of the peak stresses
+relative to the max abs stress and both labels
+'''
+def compare(layers64, layers32):
+    max_stress = max(np.abs(layer.mesh).max() for layer in layers64)
+    diff = 0
+    for a, b in zip(layers64, layers32):
+        diff = max(diff, abs(float(a.mesh.max()) - float(b.mesh.max())), abs(float(a.mesh.min()) - float(b.mesh.min())))
+    return (sum(layer.mesh.nbytes for layer in layers64), sum(layer.mesh.nbytes for layer in layers32),
+            diff/max_stress if max_stress > 0 else diff, label(layers64), label(layers32))
+
+'''
+Function that prints the report for the input files on the given directory
+and for the composites of the data generator (one every <every> of them),
+with every version of the simulation
+'''
+def report(directory="../../data", every=81):
+    print("{0:<14}{1:<9}{2:>12}{3:>12}{4:>16}{5:>10}{6:>10}".format(
+        "Composite", "Version", "MB float64", "MB float32", "Peak rel. diff", "Label 64", "Label 32"))
+    for filename in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+        for name, version in VERSIONS:
+            results = []
+            for precision in (64, 32):
+                all_layers, t, step, finalt, options = read_composite(filename, precision=precision)
+                version.simulate_waves(all_layers, t, step, verbose=False)
+                results.append(all_layers)
+            mb64, mb32, diff, label64, label32 = compare(*results)
+            print("{0:<14}{1:<9}{2:>12.2f}{3:>12.2f}{4:>16.3e}{5:>10}{6:>10}".format(
+                os.path.basename(filename), name, mb64/1e6, mb32/1e6, diff, str(label64), str(label32)))
+    #Composites of the data generator
+    configs = data_generator.configurations()[::every]
+    for name, version in VERSIONS:
+        max_diff = 0
+        same = 0
+        for config in configs:
+            results = []
+            for dtype in (float, np.float32):
+                all_layers = data_generator.composite(*config)
+                t = data_generator.prepare(all_layers, 0.01, False)
+                for layer in all_layers:
+                    layer.mesh = np.zeros((t.size, layer.numnod), dtype=dtype)
+                version.simulate_waves(all_layers, t, 0.01, verbose=False)
+                results.append(all_layers)
+            mb64, mb32, diff, label64, label32 = compare(*results)
+            max_diff = max(max_diff, diff)
+            same += label64 == label32
+        print("Data generator ({3}): {0} composites, max peak rel. diff {1:.3e}, {2} of {0} same labels".format(
+            len(configs), max_diff, same, name))
+
+'''
+Main block to call for report
+'''
+if __name__ == "__main__":
+    report()
@@ -0,0 +1,192 @@
+import zipfile
+import numpy as np
+from wave_prop_analysis_V2 import Layer, Wave
+
+'''
+Archive with the results of a simulation (a zip file of numpy arrays, .npy)
+The archive keeps everything needed to look at the results again without
+simulating: the time vector, the time step, the parameters of each layer,
+its nodes (hval) and initial waves and its mesh (max/min of the windows and
+probes too, if any). Each mesh is stored compressed in chunks of rows (time
+steps), one array each, so a time step only reads its chunk and a node
+reads its column from every chunk, without loading the whole mesh:
+info.npy -> step, final time, stride of the meshes, num of layers, rows per chunk
+t.npy -> time vector of the simulation (the meshes have t[::stride])
+layer<k>/params.npy -> h, E, rho, m, v, sf_t, sf_c (nan if None), rel, numnod, dinit
+layer<k>/hval.npy -> position of the nodes (mm)
+layer<k>/waves.npy -> initial waves (pos, direct, value), one row each
+layer<k>/<mesh>/<c>.npy -> rows c*chunk until (c+1)*chunk of the mesh
+                           (<mesh> is mesh, mesh_max or mesh_min)
+layer<k>/probes.npy, layer<k>/probe_values.npy -> nodes recorded (probes
+                           storage) and their series (one column each)
+'''
+
+'''
+Function that returns the initial waves of each layer as arrays (pos,
+direct, value), to be saved with the results (the simulation replaces them)
+'''
+def initial_waves(all_layers):
+    return [np.array([(wave.pos, wave.direct, wave.value) for wave in layer.waves], dtype=float).reshape(-1,3)
+            for layer in all_layers]
+
+'''
+Function that saves the results of a simulation on an archive
+Receives the file name, the layers (after the simulation), the time vector,
+the time step, the initial waves of each layer (see initial_waves) and the
+num of rows (time steps) of each chunk of the meshes
+'''
+def save_archive(filename, all_layers, t, step, waves, chunk=256):
+    #Function that adds an array to the archive
+    def put(name, array):
+        with archive.open(name + ".npy", "w", force_zip64=True) as file:
+            np.save(file, np.ascontiguousarray(array))
+    stride = getattr(all_layers[0], "stride", 1)
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        put("info", np.array([step, t.size*step, stride, len(all_layers), chunk]))
+        put("t", t)
+        for k, layer in enumerate(all_layers):
+            name = "layer" + str(k)
+            nan = lambda x: np.nan if x is None else x
+            put(name + "/params", np.array([layer.h, layer.E, layer.rho, layer.m, layer.v, nan(layer.sf_t),
+                                            nan(layer.sf_c), layer.rel, layer.numnod, layer.dinit]))
+            put(name + "/hval", layer.hval())
+            put(name + "/waves", waves[k])
+            for mesh_name in ("mesh", "mesh_max", "mesh_min"):
+                mesh = getattr(layer, mesh_name, None)
+                if mesh is None or not hasattr(mesh, "shape"):
+                    continue
+                #Rows read by chunks, so memory-mapped or event meshes are never loaded entirely
+                for c in range(-(-len(mesh) // chunk)):
+                    put(name + "/" + mesh_name + "/" + str(c), mesh[c*chunk:(c+1)*chunk])
+            if getattr(layer, "probes", None) is not None:
+                nodes = sorted(layer.probes)
+                put(name + "/probes", np.array(nodes, dtype=int))
+                put(name + "/probe_values", np.column_stack([layer.probes[j] for j in nodes]).reshape(t.size,-1))
+
+'''
+Class that represents a mesh stored on an archive (chunks of rows)
+It can be used as the mesh (numpy array) of the layer, like an EventMesh:
+mesh[i] -> row of time step i
+mesh[i][j], mesh[i,j] -> value of node j at time step i
+mesh[:,j] -> values of node j for all times
+len(mesh), mesh.shape, iteration through rows, np.array(mesh) (dense copy)
+The last chunk read is kept, so reading the rows in order reads every
+chunk only once
+'''
+class ArchiveMesh:
+    #Constructor of the ArchiveMesh class
+    def __init__(self,archive,name,chunks,chunk):
+        self.archive = archive
+        self.name = name
+        self.chunk = chunk
+        self.chunks = chunks
+        self.cached = (None, None) #last chunk read (num of chunk, rows)
+        last = self.read(chunks-1)
+        self.shape = ((chunks-1)*chunk + last.shape[0], last.shape[1])
+        self.ndim = 2
+        self.dtype = last.dtype
+
+    #Function that returns the rows of chunk c
+    def read(self,c):
+        cached = self.cached #local copy, the export can read it from another thread
+        if cached[0] != c:
+            cached = (c, self.archive.read(self.name + "/" + str(c)))
+            self.cached = cached
+        return cached[1]
+
+    #Function that returns the row of time step i
+    def row(self,i):
+        i = i + self.shape[0] if i < 0 else i
+        if i < 0 or i >= self.shape[0]:
+            raise IndexError("time step out of range")
+        return self.read(i // self.chunk)[i % self.chunk]
+
+    #Function that returns the values of node j for all times
+    def column(self,j):
+        j = j + self.shape[1] if j < 0 else j
+        if j < 0 or j >= self.shape[1]:
+            raise IndexError("node out of range")
+        return np.concatenate([self.read(c)[:,j] for c in range(self.chunks)])
+
+    def __getitem__(self,key):
+        if isinstance(key, tuple):
+            rows, cols = key
+            if isinstance(rows, slice) and rows == slice(None) and not isinstance(cols, slice):
+                return self.column(int(cols))
+            return self[rows][...,cols]
+        if isinstance(key, slice):
+            return np.array([self.row(i) for i in range(*key.indices(self.shape[0]))]).reshape(-1,self.shape[1])
+        return self.row(int(key))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for i in range(self.shape[0]):
+            yield self.row(i)
+
+    def __array__(self,dtype=None,copy=None):
+        dense = np.concatenate([self.read(c) for c in range(self.chunks)])
+        return dense if dtype is None else dense.astype(dtype)
+
+    @property
+    def T(self):
+        return np.asarray(self).T
+
+'''
+Class that opens an archive (see save_archive) and rebuilds the layers of
+the simulation from it: Layer objects discretized as on the simulation, with
+their initial waves and their meshes as ArchiveMesh (only read when used)
+all_layers, t, step, finalt -> as returned by composite_reader.read_composite
+The archive is kept open until close is called (or the end of a with block)
+'''
+class ResultArchive:
+    #Constructor of the ResultArchive class
+    def __init__(self,filename):
+        self.zip = zipfile.ZipFile(filename, "r")
+        names = set(self.zip.namelist())
+        step, finalt, stride, qty_layers, chunk = self.read("info")
+        self.step = step
+        self.finalt = finalt
+        self.t = self.read("t")
+        self.all_layers = []
+        for k in range(int(qty_layers)):
+            name = "layer" + str(k)
+            h, E, rho, m, v, sf_t, sf_c, rel, numnod, dinit = self.read(name + "/params")
+            optional = {"rel": bool(rel)}
+            if not np.isnan(sf_t):
+                optional["sf_t"], optional["sf_c"] = sf_t, sf_c
+            layer = Layer(h, E, rho, m, v, **optional)
+            #Discretization of the simulation (Layer.nodes, without any mesh)
+            layer.dinit = dinit
+            layer.numnod = int(numnod)
+            layer.h = h
+            layer.stride = int(stride)
+            layer.mesh_files = []
+            layer.stats = None
+            layer.probes = None
+            for mesh_name in ("mesh", "mesh_max", "mesh_min"):
+                chunks = sum(1 for n in names if n.startswith(name + "/" + mesh_name + "/"))
+                setattr(layer, mesh_name, ArchiveMesh(self, name + "/" + mesh_name, chunks, int(chunk))
+                        if chunks > 0 else None)
+            if name + "/probes.npy" in names:
+                values = self.read(name + "/probe_values")
+                layer.probes = {j: values[:,c] for c, j in enumerate(self.read(name + "/probes").tolist())}
+            for pos, direct, value in self.read(name + "/waves"):
+                layer.waves.append(Wave(int(pos),layer.numnod,int(direct),value))
+            self.all_layers.append(layer)
+
+    #Function that reads an array of the archive
+    def read(self,name):
+        with self.zip.open(name + ".npy") as file:
+            return np.load(file)
+
+    #Function that closes the archive
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
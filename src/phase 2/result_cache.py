@@ -0,0 +1,171 @@
+import os
+import hashlib
+import numpy as np
+from mesh_storage import LayerStats
+from wave_prop_analysis_V2 import Wave
+from wave_prop_analysis_V3 import SimulationResult
+
+'''
+On-disk cache of the results of the simulations
+Each result is stored as a compressed numpy file (.npz) named by the hash of
+everything that defines the simulation (see ResultCache.key), so the same
+composite is found again no matter where it comes from (input file, data
+generator, ...) and by the version of the simulation code (engine) that
+ran it. The stresses are stored: the complete mesh of each layer (dense
+simulations, with the max/min of the windows if it has them) or its
+reductions (LayerStats, simulations with storage="reduce"), together with the
+waves of the layers at the end of the simulation (restored on the layers, as
+if it had run), the waves dropped if the simulation used culling and its
+failure if it stopped on it (stop_on_failure). The cache has a max
+size: once exceeded, the results used the longest time ago are removed
+(LRU, the time of the files is updated every time a result is used).
+'''
+class ResultCache:
+    #Constructor of the ResultCache class
+    def __init__(self,directory="cache",max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    #Function that returns the key (hash) of a simulation, given the layers
+    #(discretized, with the initial waves on them and the type, stride and
+    #window of their meshes, if any), the time vector, the time step, the
+    #engine (name of the module of the version that simulates it, the versions
+    #differ at round-off level) and any other option changing the results
+    #(storage, tolerances, ..., verbose and instruments are not considered)
+    @staticmethod
+    def key(all_layers, t, step, engine, **options):
+        #Floats are written in hex so the same values always give the same text
+        hexf = lambda x: float(x).hex()
+        parts = ["engine " + engine, "step " + hexf(step), "tsize " + str(t.size)]
+        for layer in all_layers:
+            parts.append("layer " + " ".join(hexf(x) for x in (layer.h, layer.E, layer.rho, layer.v))
+                         + " " + str(layer.numnod) + ("" if layer.mesh is None else " {0} {1} {2}".format(
+                             layer.mesh.dtype, getattr(layer, "stride", 1), getattr(layer, "mesh_max", None) is not None)))
+            for wave in layer.waves:
+                parts.append("wave {0} {1} {2}".format(wave.pos, wave.direct, hexf(wave.value)))
+        for name in sorted(options):
+            if name in ("verbose", "instruments"):
+                continue
+            parts.append("option {0} {1!r}".format(name, options[name]))
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    #Function that returns the path of the file of a key
+    def path(self,key):
+        return os.path.join(self.directory, key + ".npz")
+
+    #Function that loads a result into the layers (mesh or stats of each layer
+    #and the waves at the end of the simulation)
+    #Returns if the result was found and the SimulationResult stored with it
+    #(None if the simulation didn't return one)
+    def load(self,key,all_layers,t):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                for k, layer in enumerate(all_layers):
+                    if "mesh"+str(k) in data:
+                        layer.mesh = data["mesh"+str(k)]
+                        layer.stats = None
+                        if "mesh_max"+str(k) in data:
+                            layer.mesh_max = data["mesh_max"+str(k)]
+                            layer.mesh_min = data["mesh_min"+str(k)]
+                    else:
+                        t_max = data["t_max"+str(k)]
+                        layer.mesh = None
+                        layer.stats = LayerStats(data["env_max"+str(k)], data["env_min"+str(k)],
+                                                 t_max, data["t_min"+str(k)], t[:t_max.size])
+                    layer.waves = [Wave(int(pos), layer.numnod, int(direct), value)
+                                   for pos, direct, value in data["waves"+str(k)].tolist()]
+                result = None
+                if "dropped" in data:
+                    failures = None
+                    if "failure" in data:
+                        failures = [(float(data["failure"][0]), int(data["failure"][1]), str(data["failure_mode"]))]
+                    result = SimulationResult(data["tol"], int(data["dropped"]), data["discarded"],
+                                              data["bound"], data["peak"], failures)
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return False, None
+        #Most recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True, result
+
+    #Function that stores the result of the layers (after a simulation with
+    #dense storage or reductions) and the SimulationResult, if any
+    def save(self,key,all_layers,result=None):
+        arrays = {}
+        for k, layer in enumerate(all_layers):
+            if layer.stats is not None:
+                arrays["env_max"+str(k)] = layer.stats.env_max
+                arrays["env_min"+str(k)] = layer.stats.env_min
+                arrays["t_max"+str(k)] = layer.stats.t_max
+                arrays["t_min"+str(k)] = layer.stats.t_min
+            elif isinstance(layer.mesh, np.ndarray):
+                arrays["mesh"+str(k)] = layer.mesh
+                if getattr(layer, "mesh_max", None) is not None:
+                    arrays["mesh_max"+str(k)] = layer.mesh_max
+                    arrays["mesh_min"+str(k)] = layer.mesh_min
+            else:
+                return #Other storages are not cached
+            arrays["waves"+str(k)] = np.array([(wave.pos, wave.direct, wave.value) for wave in layer.waves],
+                                              dtype=float).reshape(-1,3)
+        if result is not None and hasattr(result, "dropped"):
+            arrays["tol"] = result.tol
+            arrays["dropped"] = result.dropped
+            arrays["discarded"] = result.discarded
+            arrays["bound"] = result.bound
+            arrays["peak"] = result.peak
+            if result.failure is not None:
+                arrays["failure"] = np.array(result.failure[:2], dtype=float)
+                arrays["failure_mode"] = np.array(result.failure[2])
+        #Written on a temporary file first, so a result is never read half written
+        path = self.path(key)
+        temp = path + "." + str(os.getpid()) + ".tmp"
+        with open(temp, "wb") as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(temp, path)
+        self.evict()
+
+    #Function that removes the results used the longest time ago until the
+    #size of the cache is below its max size
+    def evict(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                    files.append((stat.st_mtime, stat.st_size, name))
+                except FileNotFoundError:
+                    pass #removed by another process
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+'''
+Function that runs simulate_waves of the given version (module), unless its
+result is already on the cache (ResultCache or None to not use any)
+Receives the same parameters as simulate_waves (options are only given to it
+if used) and returns the result of simulate_waves and if it was found on the
+cache. Simulations with storage="events" or "probes" (the series of the
+probes are not stored) or with instruments (they have to run to be recorded)
+are not cached
+'''
+def simulate_cached(cache, version, all_layers, t, step, **options):
+    if cache is None or options.get("storage") in ("events", "probes") or options.get("instruments") is not None:
+        return version.simulate_waves(all_layers, t, step, **options), False
+    #Dense storage is the default
+    key = cache.key(all_layers, t, step, version.__name__, **dict({"storage": "dense"}, **options))
+    found, result = cache.load(key, all_layers, t)
+    if found:
+        return result, True
+    result = version.simulate_waves(all_layers, t, step, **options)
+    cache.save(key, all_layers, result)
+    return result, False
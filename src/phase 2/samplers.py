@@ -0,0 +1,150 @@
+import itertools
+import numpy as np
+
+'''
+Samplers of a design space: the configurations (values of the parameters)
+to simulate. A design space is a list of parameters, in the order they're
+given to the function that creates the composite, each one a tuple
+(name, values) where values is:
+(low, high) -> continuous parameter (tuple), any value in that range
+[a, b, ...] -> categorical parameter (list), one of the choices
+Samplers available:
+grid -> full grid: every choice of the categorical parameters and <levels>
+        evenly spaced values of each continuous one (the num of
+        configurations multiplies with every parameter added)
+lhs -> Latin hypercube of n configurations: the range of every parameter is
+       split into n equal parts and each part gets exactly one configuration
+sobol -> first n points of the scrambled Sobol sequence (low discrepancy,
+         best balanced for n a power of 2)
+lhs and sobol draw n points of the unit hypercube (one dimension per
+parameter) mapped to the parameters: low + u*(high-low) for the continuous
+ones and the choice floor(u*choices) for the categorical ones, so the
+budget of simulations is fixed no matter the num of parameters. Both are
+given by a seed (the same seed gives the same configurations)
+'''
+
+#Bits of the points of the Sobol sequence (up to 2^30 points)
+BITS = 30
+
+#Direction numbers of the Sobol sequence (Joe and Kuo, new-joe-kuo-6.21201)
+#for the dimensions after the first one: degree s and coefficients a of the
+#primitive polynomial and initial numbers m
+DIRECTIONS = [
+    (1, 0, (1,)), (2, 1, (1, 3)), (3, 1, (1, 3, 1)), (3, 2, (1, 1, 1)), (4, 1, (1, 1, 3, 3)),
+    (4, 4, (1, 3, 5, 13)), (5, 2, (1, 1, 5, 5, 17)), (5, 4, (1, 1, 5, 5, 5)), (5, 7, (1, 1, 7, 11, 19)),
+    (5, 11, (1, 1, 5, 1, 1)), (5, 13, (1, 1, 1, 3, 11)), (5, 14, (1, 3, 5, 5, 31)), (6, 1, (1, 3, 3, 9, 7, 49)),
+    (6, 13, (1, 1, 1, 15, 21, 21)), (6, 16, (1, 3, 1, 13, 27, 49)), (6, 19, (1, 1, 1, 15, 7, 5)),
+    (6, 22, (1, 3, 1, 15, 13, 25)), (6, 25, (1, 1, 5, 5, 19, 61)), (7, 1, (1, 3, 7, 11, 23, 15, 103)),
+    (7, 4, (1, 3, 7, 13, 13, 15, 69)),
+]
+
+'''
+Function that returns the direction numbers (integers of BITS bits) of the
+first d dimensions of the Sobol sequence, an array of d x BITS
+'''
+def sobol_directions(d):
+    if d > len(DIRECTIONS)+1:
+        raise ValueError("The Sobol sampler supports up to {0} parameters".format(len(DIRECTIONS)+1))
+    v = np.zeros((d,BITS), dtype=np.int64)
+    v[0] = 1 << np.arange(BITS-1, -1, -1) #first dimension: m = 1 for all
+    for k in range(1, d):
+        s, a, m0 = DIRECTIONS[k-1]
+        m = list(m0)
+        for j in range(s, BITS):
+            #Recurrence given by the primitive polynomial
+            new = m[j-s] ^ (m[j-s] << s)
+            for r in range(1, s):
+                if (a >> (s-1-r)) & 1:
+                    new ^= m[j-r] << r
+            m.append(new)
+        v[k] = [m[j] << (BITS-1-j) for j in range(BITS)]
+    return v
+
+'''
+Function that scrambles the direction numbers of one dimension with a random
+lower triangular binary matrix (linear matrix scrambling, Matousek)
+'''
+def scramble_directions(v, rng):
+    lower = np.tril(rng.integers(0, 2, (BITS,BITS)), -1) | np.eye(BITS, dtype=np.int64)
+    bits = (v[:,None] >> np.arange(BITS-1, -1, -1)) & 1 #one row of bits for each number, first the highest
+    bits = (bits @ lower.T) & 1
+    return bits @ (1 << np.arange(BITS-1, -1, -1))
+
+'''
+Function that returns the first n points of the Sobol sequence in d dimensions
+(array n x d, values in [0, 1)), scrambled with the given seed (linear matrix
+scrambling and a random digital shift) unless scramble is False
+'''
+def sobol(n, d, seed=0, scramble=True):
+    if n > 2**BITS:
+        raise ValueError("The Sobol sampler supports up to 2^{0} points".format(BITS))
+    v = sobol_directions(d)
+    shift = np.zeros(d, dtype=np.int64)
+    if scramble:
+        rng = np.random.default_rng(seed)
+        v = np.array([scramble_directions(v[k], rng) for k in range(d)])
+        shift = rng.integers(0, 2**BITS, d)
+    #Point i is the XOR of the direction numbers of the bits of its Gray code
+    i = np.arange(n, dtype=np.int64)
+    gray = i ^ (i >> 1)
+    points = np.zeros((n,d), dtype=np.int64)
+    for j in range(max(int(n-1).bit_length(), 1)):
+        points ^= ((gray >> j) & 1)[:,None] * v[:,j]
+    return (points ^ shift) / 2.0**BITS
+
+'''
+Function that returns a Latin hypercube of n points in d dimensions (array
+n x d, values in [0, 1)), given by a seed
+'''
+def latin_hypercube(n, d, seed=0):
+    rng = np.random.default_rng(seed)
+    return (np.array([rng.permutation(n) for k in range(d)]).T + rng.random((n,d))) / n
+
+'''
+Function that maps points of the unit hypercube (one dimension per parameter)
+to configurations of a design space (list of tuples, one value per parameter)
+'''
+def to_configs(space, points):
+    columns = []
+    for k, (name, values) in enumerate(space):
+        u = points[:,k]
+        if isinstance(values, list):
+            choice = np.minimum((u*len(values)).astype(int), len(values)-1)
+            columns.append([values[c] for c in choice])
+        else:
+            low, high = values
+            columns.append((low + u*(high-low)).tolist())
+    return list(zip(*columns))
+
+'''
+Function that returns the full grid of a design space: every choice of the
+categorical parameters and, for the continuous ones, the given num of evenly
+spaced values (levels, a dictionary name -> num of values, 2 by default),
+in the order of nested loops through the parameters
+'''
+def grid(space, levels=None):
+    levels = {} if levels is None else levels
+    axes = []
+    for name, values in space:
+        if isinstance(values, list):
+            axes.append(values)
+        else:
+            axes.append(np.linspace(values[0], values[1], levels.get(name, 2)))
+    return list(itertools.product(*axes))
+
+#Samplers of the unit hypercube available (besides the grid)
+SAMPLERS = {"lhs": latin_hypercube, "sobol": sobol}
+
+'''
+Function that returns the configurations of a design space given by a
+sampler: "grid" (levels of the continuous parameters, n is not used), "lhs"
+or "sobol" (n configurations, given by the seed)
+'''
+def sample(space, n=None, sampler="grid", seed=0, levels=None):
+    if sampler == "grid":
+        return grid(space, levels)
+    if sampler not in SAMPLERS:
+        raise ValueError("Unknown sampler: " + sampler)
+    if n is None or n < 1:
+        raise ValueError("The num of configurations is needed for the sampler " + sampler)
+    return to_configs(space, SAMPLERS[sampler](n, len(space), seed))
@@ -1,8 +1,13 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import xlsxwriter as xlsx
 import time
-from wave_prop_analysis_V2 import Layer, Wave, simulate_waves
+import wave_prop_analysis_V2, wave_prop_analysis_V3
+from composite_reader import read_composite
+from result_cache import ResultCache, simulate_cached
+from critical_velocity import initial_velocity, critical_velocity
+from result_archive import ResultArchive, initial_waves, save_archive
+from xlsx_export import export_background
+from failure import failure_analysis, failure_message
 
 '''
 Function that returns the middle column values of a given matrix
@@ -24,135 +29,99 @@ def column(matrix, i):
 
 '''
 Function that simulates the wave propagation on a single composite
+The version of the simulation code to use (V2, V3 or the event-driven
+wave_prop_lattice) can be chosen, all give the same results. With V3, the
+storage of the meshes and the tolerances to drop waves with small values
+(atol, rtol) can be chosen too (see wave_prop_analysis_V3.simulate_waves)
+The results are kept on the cache of the given directory (None to not use
+it), so an input file already simulated is not simulated again
+If a scratch directory is given, the dense meshes are memory-mapped files on
+it (for meshes larger than the memory, not cached), removed at the end
+The precision of the meshes (32 or 64 bits) and the stride of their rows
+(with or without the max/min of the windows) can be given too, instead of
+the ones of the input file (64 bits and every row by default). With a
+stride, the exports and plots use the rows stored (and the max/min of the
+windows for the max stresses)
+With probes (list of (layer, node or position in mm)) or interfaces, given
+here or on the input file, only the stresses of those nodes are recorded
+(V3 or the lattice): the export writes their series and the plot of the
+stress through time uses them. V3 keeps the reductions too, so the analysis
+and the critical velocity are still available (the other plots need the meshes)
+The results can be saved on an archive (see result_archive) on data/, and
+giving its name (.zip) instead of an input file opens them without simulating
+The xlsx export (see xlsx_export) is written on the background while the
+plots are made, optionally downsampled to a max num of rows and columns
 '''
-def simulate():
-    #Input file to read
+def simulate(version=wave_prop_analysis_V3, storage="dense", atol=0.0, rtol=0.0, cache="cache", scratch=None,
+             precision=None, stride=None, window=None, probes=None, interfaces=None):
+    #Input file to read (or archive with the results of a previous simulation)
     filename = "../../data/" + input("Enter input file name: ")
-    #Loop through file to construct simulation
-    with open(filename,"r") as file:
-        lines = file.readlines()
-        i = 0
-        #First, we read the num of layers for composite
-        qty_layers = -1
-        while qty_layers == -1:
-            if not lines[i].startswith("#"): #consider line that doesn't start with #
-                qty_layers = int(lines[i])
-            i += 1
-        #Now, we construct the layers of the composite
-        all_layers = []
-        for l in range(qty_layers):
-            done = False
-            while not done:
-                if not lines[i].startswith("#"): #consider line that doesn't start with #
-                    #We first split the line by commas
-                    parts = lines[i].strip().split(",")
-                    #Now, we use the values to construct a layer.
-                    #Given that some are optional, we construct a dictionary with
-                    #optional parameters (stress failures and relevant property)
-                    optional = {}
-                    for op in parts[5:]:
-                        #Check it's ending char to add it to dictionary
-                        if op[-1] == "r":
-                            optional["rel"] = op[:-1] == "1"
-                        elif op[-1] == "c":
-                            optional["sf_c"] = float(op[:-1])
-                        else:
-                            optional["sf_t"] = float(op[:-1])
-                    #Then, we create the layer
-                    layer = Layer(float(parts[0]), float(parts[1]), float(parts[2]),
-                                  float(parts[3]), float(parts[4]), **optional)
-                    all_layers.append(layer)    
-                    done = True
-                i += 1
-        #Now, we set the parameters for the simulation
-        finalt = -1
-        step = -1
-        while finalt == -1:
-            if not lines[i].startswith("#"): #consider line that doesn't start with #
-                parts = lines[i].strip().split(",")
-                #First, we check if 'r' or 't'
-                if parts[0] == 't':
-                    finalt = float(parts[1])
-                else:
-                    #We find the time according to the num of reverberations of the first wave needed
-                    one_rev = 0
-                    for l in all_layers[1:]: #loop avoiding first layer (projectile)
-                        one_rev += (l.h/l.c)*2
-                    finalt = round(one_rev*float(parts[1]),2)
-                step = 0.01 if len(parts) == 2 else float(parts[2])
-            i += 1
+    if filename.endswith(".zip"):
+        #Nothing to simulate, the meshes are read from the archive when used
+        archive = ResultArchive(filename)
+        all_layers, t, step, finalt = archive.all_layers, archive.t, archive.step, archive.finalt
+        print("\nResults of "+str(finalt)+" micro-s read from the archive")
+        velocity = initial_velocity(all_layers)
+    else:
+        archive = None
+        all_layers, t, step, finalt, directives = read_composite(filename, storage=="dense", scratch, precision,
+                                                                 stride, window, probes, interfaces)
         print("\nTime to simulate: "+str(finalt)+" micro-s")
-        #Using the parameters, we create the time vector and we discretize each layer
-        t = np.arange(0, finalt, step)
-        for layer in all_layers:
-            layer.nodes(step,t.size)
-        #Finally, we read the init conditions (init waves) to consider
-        #First, num of init waves
-        qty_waves = -1
-        while qty_waves == -1:
-            if not lines[i].startswith("#"): #consider line that doesn't start with #
-                qty_waves = int(lines[i])
-            i += 1
-        #Now, we construct the waves and add them to respective layers
-        for w in range(qty_waves):
-            done = False
-            while not done:
-                if not lines[i].startswith("#"): #consider line that doesn't start with #
-                    #We first split the line by commas
-                    parts = lines[i].strip().split(",")
-                    #Now, we use the values to construct a wave on the respective layer
-                    layer_num = int(parts[0])
-                    pos = parts[1]
-                    if parts[3] == "s":
-                        sigma = float(parts[2])
-                    else:
-                        vel = float(parts[2])
-                        sigma = vel/(1/all_layers[0].rhoc+1/all_layers[1].rhoc)
-                    if pos == "E":
-                        wave = Wave(all_layers[layer_num-1].numnod-1,
-                                    all_layers[layer_num-1].numnod,0,sigma)
-                    else:
-                        wave = Wave(0,all_layers[layer_num-1].numnod,1,sigma)
-                    all_layers[layer_num-1].waves.append(wave)
-                    done = True
-                i += 1
+        #Impact velocity of the initial waves, to scale the stresses (critical velocity)
+        velocity = initial_velocity(all_layers)
+        waves = initial_waves(all_layers)
                 
-    #SIMULATION
-    #Call for simulate_waves
-    start_time = time.time()
-    print("--- SIMULATION IN PROGRESS ---")
-    simulate_waves(all_layers, t, step) 
-    print("--- DONE! Took {:f} seconds ---".format((time.time() - start_time)))
+        #SIMULATION
+        #Call for simulate_waves
+        start_time = time.time()
+        print("--- SIMULATION IN PROGRESS ---")
+        #Optional arguments only given if used (V3), so any version can be called
+        options = {}
+        if storage != "dense":
+            options["storage"] = storage
+        if atol > 0 or rtol > 0:
+            options["atol"] = atol
+            options["rtol"] = rtol
+        #Only the probes are recorded, if any
+        if directives.get("probes") or directives.get("interfaces"):
+            options["storage"] = "probes"
+            options["probes"] = directives.get("probes", [])
+            options["interfaces"] = directives.get("interfaces", False)
+        store = ResultCache(cache) if cache is not None and scratch is None else None
+        result, found = simulate_cached(store, version, all_layers, t, step, **options)
+        if found:
+            print("--- Result found on the cache ---")
+        print("--- DONE! Took {:f} seconds ---".format((time.time() - start_time)))
+        if atol > 0 or rtol > 0:
+            print("Waves dropped: " + str(result))
+        
+        #Save the results on an archive, to open them again without simulating
+        saveData = input('Do you want to save the results on an archive (data/<name>.zip)? [Y/N] ')
+        if saveData.upper() == 'Y':
+            fileName = "../../data/" + input('Enter the name of the archive (without extension): ') + '.zip'
+            save_archive(fileName, all_layers, t, step, waves)
+    #Times of the rows stored on the meshes
+    t_mesh = t[::all_layers[0].stride]
     
-    #Export data to Excel file
-    saveData = input('First, do you want to save all data on an xlsx file? [Y/N] ')
+    #Export data to Excel file (on the background, while the plots are made)
+    exporter = None
+    saveData = input('Do you want to save all data on an xlsx file? [Y/N] ')
     if saveData.upper() == 'Y':
         fileName = input('Enter the name of the file to save (without extension): ')
         fileName += '.xlsx'
-        workbook = xlsx.Workbook(fileName)
-        for sheetNum, layToSave in enumerate(all_layers):
-            allCols = all_layers[sheetNum].hval()
-            parts = (len(allCols) // 16000) + 1
-            lastIndex = 0
-            for i in range(parts): #For loop in case a single sheet exceeds 16000 columns
-                if i == parts-1:
-                    endIndex = len(allCols)
-                else:
-                    endIndex = lastIndex+16000
-                cols = allCols[lastIndex:endIndex]
-                sheet = workbook.add_worksheet()
-                if parts > 1:
-                    sheet.name = 'Layer ' + str(sheetNum+1) + '.' + str(i+1)
-                else:
-                    sheet.name = 'Layer ' + str(sheetNum+1)
-                sheet.write_string(0,1,'h (mm)')
-                sheet.write_string(1,0,'t (micro-s)')
-                sheet.write_row(0,2,cols)
-                sheet.write_column(2,0,t)
-                for rowNum, data in enumerate(all_layers[sheetNum].mesh,2):
-                    sheet.write_row(rowNum,2,data[lastIndex:endIndex])
-                lastIndex += 16000 #Update to the next part (if any)
-        workbook.close()
+        size = input('Max num of rows (time steps) and columns (nodes) of each layer, as <rows>,<cols> (Enter for all): ')
+        size = [int(x) if x.strip() else None for x in size.split(",")] if size.strip() else []
+        size += [None]*(2-len(size))
+        exporter = export_background(fileName, all_layers, t, size[0], size[1])
+    
+    #Without meshes (only the probes or the reductions recorded), only the plot
+    #of the probes (1) and the analysis (7, 8, from the reductions) can be used
+    available = list(range(1,10))
+    if any(layer.mesh is None for layer in all_layers):
+        available = [1]*any(getattr(layer, "probes", None) is not None for layer in all_layers) \
+            + [7, 8]*all(getattr(layer, "stats", None) is not None for layer in all_layers) + [9]
+        print("The meshes were not recorded, only the options " + ", ".join(str(a) for a in available)
+              + " are available")
     
     #PLOTS
     #plots -> type[time vs stress at certain thickness, thickness vs stres at certain time] input from the user
@@ -162,11 +131,29 @@ def simulate():
             typ = int(input('What type of plot?\n\t1. t vs stress\n\t2. h vs stress\n' +
                             '\t3. t vs max stress (tension)\n\t4. t vs mas stress (compression)\n' +
                             '\t5. all_layers vs stress (all times)\n\t6. all_layers vs Hydrostatic Stress (all times)\n' +
-                            '\t7. Run analysis on composite\n\t8. Exit\n>> '))
-            if typ == 1:
+                            '\t7. Run analysis on composite\n\t8. Critical impact velocity\n\t9. Exit\n>> '))
+            if 1 <= typ <= 8 and typ not in available:
+                print(" << The meshes were not recorded, this option needs them (options available: "
+                      + ", ".join(str(a) for a in available) + "). >>")
+            elif typ == 1:
                 layToPlot = int(input('What layer you want to plot? (Number, 1 left, ...) '))
                 dist = input('Beginning, middle or end part of the layer? [B,M,E] ')
-                if(dist == 'B'):
+                probed = all_layers[layToPlot-1].probes
+                times = t_mesh
+                if probed is not None:
+                    #Only the probes were recorded, the node has to be one of them
+                    numnod = all_layers[layToPlot-1].numnod
+                    if dist not in ('B','M','E'):
+                        dist = 'M'
+                        print('Invalid choice, by default the middle will be plot')
+                    node = {'B': 0, 'M': numnod//2, 'E': numnod-1}[dist]
+                    if node not in probed:
+                        print('Node '+str(node)+' of the layer '+str(layToPlot)+' was not recorded (probes: '
+                              +str(sorted(probed))+')')
+                        continue
+                    values = probed[node]
+                    times = t #The probes have all the time steps
+                elif(dist == 'B'):
                     values = column(all_layers[layToPlot-1].mesh,0)
                 elif dist == 'M':
                     values = middleH(all_layers[layToPlot-1].mesh)
@@ -177,8 +164,8 @@ def simulate():
                     values = middleH(all_layers[layToPlot-1].mesh)
                     print('Invalid choice, by default the middle will be plot')
                 lab = dist + ' part of the layer '+str(layToPlot)
-                plt.plot(t,values, 'k',label=lab)
-                plt.axis([0,t[t.size-1],np.amin(values)-0.1,np.amax(values)+0.1])
+                plt.plot(times,values, 'k',label=lab)
+                plt.axis([0,times[times.size-1],np.amin(values)-0.1,np.amax(values)+0.1])
                 plt.xlabel('Time (microseconds)')
                 plt.ylabel('Stress (Pa)')
                 plt.legend(loc='best')
@@ -186,10 +173,10 @@ def simulate():
                 plt.show()
             elif typ == 2:
                 layToPlot = int(input('What layer you want to plot? (Number, 1 left, ...) '))
-                quest = 'What time (max 3 decimal places) you want to plot? [0 - '+str(t[t.size-1])+'] '
+                quest = 'What time (max 3 decimal places) you want to plot? [0 - '+str(t_mesh[t_mesh.size-1])+'] '
                 plot_time = float(input(quest))
                 if plot_time >= 0 and plot_time <= finalt:
-                    values = all_layers[layToPlot-1].mesh[np.where(abs(t - plot_time) < 0.0001)[0][0]]
+                    values = all_layers[layToPlot-1].mesh[np.where(abs(t_mesh - plot_time) < 0.0001)[0][0]]
                     vec = np.linspace(0.,all_layers[layToPlot-1].h,len(values))
                     lab = 'Layer '+str(layToPlot)+' at '+str(plot_time) +' ms'
                     plt.plot(vec,values, 'k',label=lab)
@@ -203,14 +190,17 @@ def simulate():
                     print('Invalid time')
             elif typ == 3:
                 layToPlot = int(input('What layer you want to plot? (Number, 1 left, ...) '))
-                maxValues = np.zeros(t.size)
-                for i in range(t.size):
-                    vec = all_layers[layToPlot-1].mesh[i][2:-2]
+                #With windows, their max has the peaks between the rows stored
+                mesh = all_layers[layToPlot-1].mesh_max
+                mesh = all_layers[layToPlot-1].mesh if mesh is None else mesh
+                maxValues = np.zeros(t_mesh.size)
+                for i in range(t_mesh.size):
+                    vec = mesh[i][2:-2]
                     vec = [l for l in vec if l >= 0] or [0]
                     maxValues[i] = max(vec)
                 lab = 'Max stress (T) on layer '+str(layToPlot)
-                plt.plot(t,maxValues, 'k',label=lab)
-                plt.axis([0,t[t.size-1], min(maxValues)-0.1, max(maxValues)+0.1])
+                plt.plot(t_mesh,maxValues, 'k',label=lab)
+                plt.axis([0,t_mesh[t_mesh.size-1], min(maxValues)-0.1, max(maxValues)+0.1])
                 plt.xlabel('Time (microseconds)')
                 plt.ylabel('Stress (Pa)')
                 plt.legend(loc='best')
@@ -218,14 +208,17 @@ def simulate():
                 plt.show()
             elif typ == 4:
                 layToPlot = int(input('What layer you want to plot? (Number, 1 left, ...) '))
-                maxValues = np.zeros(t.size)
-                for i in range(t.size):
-                    vec = all_layers[layToPlot-1].mesh[i][2:-2]
+                #With windows, their min has the peaks between the rows stored
+                mesh = all_layers[layToPlot-1].mesh_min
+                mesh = all_layers[layToPlot-1].mesh if mesh is None else mesh
+                maxValues = np.zeros(t_mesh.size)
+                for i in range(t_mesh.size):
+                    vec = mesh[i][2:-2]
                     vec = [l for l in vec if l <= 0] or [0]
                     maxValues[i] = min(vec)
                 lab = 'Max stress (C) on layer '+str(layToPlot)
-                plt.plot(t,maxValues, 'k',label=lab)
-                plt.axis([0,t[t.size-1], min(maxValues)-0.1, max(maxValues)+0.1])
+                plt.plot(t_mesh,maxValues, 'k',label=lab)
+                plt.axis([0,t_mesh[t_mesh.size-1], min(maxValues)-0.1, max(maxValues)+0.1])
                 plt.xlabel('Time (microseconds)')
                 plt.ylabel('Stress (Pa)')
                 plt.legend(loc='best')
@@ -299,33 +292,17 @@ def simulate():
             elif typ == 7:
                 #To run the analysis, we check if the relevant layers of the composite
                 #are within the valid range of stresses, i.e., below the failure stress
-                #First, check if all relevant layers have a failure stress
-                valid = True
-                for layer in all_layers[1:]:
-                    if layer.rel and layer.sf_c is None: #checking one is enough
-                        valid = False
-                        break
-                if valid:
-                    #If all valid, we loop through relevant layers to find the state of them
+                analysis = failure_analysis(all_layers)
+                if analysis is not None:
+                    #We check the state of the relevant layers (max tension and compression
+                    #stresses for all times and all points above the failure stress)
                     failed_layers = []
-                    for i,layer in enumerate(all_layers[1:],1):
-                        if layer.rel:
-                            #We first find both max tension and compression stresses for all
-                            #times and all points
-                            max_tension = np.amax(layer.hydStress()) if np.amax(layer.hydStress()) > 0 else 0
-                            max_compression = np.amin(layer.hydStress()) if np.amin(layer.hydStress()) < 0 else 0
-                            if i == 2:
-                                print(max_tension, max_compression)
-                            #Finally, we check if stresses are above the failure stress
-                            state = ""
-                            if abs(max_compression) > layer.sf_c and abs(max_tension) > layer.sf_t:
-                                state = "Both tension and compression stresses in layer #"+str(i)+" are above failure stress"
-                            elif abs(max_compression) > layer.sf_c:
-                                state = "Compression stress in layer #"+str(i)+" is above failure stress"
-                            elif abs(max_tension) > layer.sf_t:
-                                state = "Tension stress in layer #"+str(i)+" are above failure stress"
-                            if state != "":
-                                failed_layers.append(state)
+                    for i, max_tension, max_compression, tension, compression in analysis:
+                        if i == 2:
+                            print(max_tension, max_compression)
+                        state = failure_message(i, tension, compression)
+                        if state != "":
+                            failed_layers.append(state)
                     if len(failed_layers) > 0:
                         #Print messages
                         print("The composite MUST NOT be considered. The following occurred: ")
@@ -336,11 +313,35 @@ def simulate():
                 else:
                     print(" << The analysis can't be run because the relevant layers are not correctly defined. >>")
             elif typ == 8:
+                #The stresses scale with the impact velocity (linear model), so the
+                #velocities at which the relevant layers fail are found from this simulation
+                layers, critical = critical_velocity(all_layers, velocity)
+                if len(layers) == 0:
+                    print(" << There are no relevant layers on the composite. >>")
+                else:
+                    print("Simulated impact velocity: {0:.4f} m/s".format(velocity))
+                    for i, vel_t, vel_c in layers:
+                        print("Layer #{0}: fails by tension above {1:.4f} m/s, by compression above {2:.4f} m/s".format(i, vel_t, vel_c))
+                    if np.isinf(critical[0]):
+                        print("The composite never fails at any impact velocity.")
+                    else:
+                        print("Critical impact velocity of the composite: {0:.4f} m/s ({1} on layer #{2})".format(
+                            critical[0], critical[2], critical[1]))
+            elif typ == 9:
                 stop = True
             else:
                 print('Invalid type of plot')
         except Exception as e:
             print(e)
+    #The export has to finish before the meshes are freed
+    if exporter is not None and exporter.is_alive():
+        print("--- Waiting for the export to finish ---")
+        exporter.join()
+    #Memory-mapped meshes (if any) are removed
+    for layer in all_layers:
+        layer.free_mesh()
+    if archive is not None:
+        archive.close()
 
 '''
 Main block to call for simulate
@@ -1,8 +1,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import xlsxwriter as xlsx
 import time
 from wave_prop_analysis_V2 import Layer, Wave, simulate_waves
+from xlsx_export import export_background
 
 '''
 Function that returns the middle column values of a given matrix
@@ -24,8 +24,13 @@ def column(matrix, i):
 
 '''
 Function that simulates the wave propagation on a single composite
+The meshes are memory-mapped files on the scratch directory (the mesh of the
+PULPA layer alone takes several GB), written while simulating and read when
+exporting (on the background, see xlsx_export) and plotting. They are
+removed at the end (an interrupted run leaves them on the directory, scratch/
+by default, which is ignored by git)
 '''
-def simulate():
+def simulate(scratch="scratch"):
     #INIT PARAMETERS FOR THE COMPOSITE
     FLOOR = Layer(1.52,1.21*10**9,891.3544,1,20*10**3)
     EMPAQUE= Layer(3.5,1.3954*10**6,25.9586,1,1)
@@ -47,7 +52,7 @@ def simulate():
     
     #First, discretize each layer given finalt and step of time
     for layer in all_layers:
-        layer.nodes(step,t.size)
+        layer.nodes(step,t.size,scratch=scratch)
         
     #Now, set initial conditions - V1
     wave1 = Wave(all_layers[0].numnod-1,all_layers[0].numnod,0,sigma_i)
@@ -61,35 +66,13 @@ def simulate():
     print("--- {:f} seconds ---".format((time.time() - start_time)))
     
     
-    #Export data to Excel file
+    #Export data to Excel file (on the background, while the plots are made)
+    exporter = None
     saveData = input('First, do you want to save all data on an xlsx file? [Y/N] ')
     if saveData == 'Y' or saveData == 'y':
         fileName = input('Enter the name of the file to save (without extension): ')
         fileName += '.xlsx'
-        workbook = xlsx.Workbook(fileName)
-        for sheetNum, layToSave in enumerate(all_layers):
-            allCols = all_layers[sheetNum].hval()
-            parts = (len(allCols) // 16000) + 1
-            lastIndex = 0
-            for i in range(parts): #For loop in case a single sheet exceeds 16000 columns
-                if i == parts-1:
-                    endIndex = len(allCols)
-                else:
-                    endIndex = lastIndex+16000
-                cols = allCols[lastIndex:endIndex]
-                sheet = workbook.add_worksheet()
-                if parts > 1:
-                    sheet.name = 'Layer ' + str(sheetNum+1) + '.' + str(i+1)
-                else:
-                    sheet.name = 'Layer ' + str(sheetNum+1)
-                sheet.write_string(0,1,'h (mm)')
-                sheet.write_string(1,0,'t (micro-s)')
-                sheet.write_row(0,2,cols)
-                sheet.write_column(2,0,t)
-                for rowNum, data in enumerate(all_layers[sheetNum].mesh,2):
-                    sheet.write_row(rowNum,2,data[lastIndex:endIndex])
-                lastIndex += 16000 #Update to the next part (if any)
-        workbook.close()
+        exporter = export_background(fileName, all_layers, t)
     
     #PLOTS
     #plots -> type[time vs stress at certain thickness, thickness vs stres at certain time] input from the user
@@ -171,6 +154,12 @@ def simulate():
             print(e)
         finally:
             stop = input('Do you want to make another plot? [Y/N] ') == 'N'
+    #The export has to finish before the meshes are removed
+    if exporter is not None:
+        exporter.join()
+    #Memory-mapped meshes are removed
+    for layer in all_layers:
+        layer.free_mesh()
 
 '''
 Main block to call for simulate
@@ -1,8 +1,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import xlsxwriter as xlsx
 import time
 from wave_prop_analysis_V2 import Layer, Wave, simulate_waves
+from xlsx_export import export_xlsx
 
 '''
 Function that returns the middle column values of a given matrix
@@ -144,30 +144,7 @@ def simulate():
     if saveData.upper() == 'Y':
         fileName = input('Enter the name of the file to save (without extension): ')
         fileName += '.xlsx'
-        workbook = xlsx.Workbook(fileName)
-        for sheetNum, layToSave in enumerate(all_layers):
-            allCols = all_layers[sheetNum].hval()
-            parts = (len(allCols) // 16000) + 1
-            lastIndex = 0
-            for i in range(parts): #For loop in case a single sheet exceeds 16000 columns
-                if i == parts-1:
-                    endIndex = len(allCols)
-                else:
-                    endIndex = lastIndex+16000
-                cols = allCols[lastIndex:endIndex]
-                sheet = workbook.add_worksheet()
-                if parts > 1:
-                    sheet.name = 'Layer ' + str(sheetNum+1) + '.' + str(i+1)
-                else:
-                    sheet.name = 'Layer ' + str(sheetNum+1)
-                sheet.write_string(0,1,'h (mm)')
-                sheet.write_string(1,0,'t (micro-s)')
-                sheet.write_row(0,2,cols)
-                sheet.write_column(2,0,t)
-                for rowNum, data in enumerate(all_layers[sheetNum].mesh,2):
-                    sheet.write_row(rowNum,2,data[lastIndex:endIndex])
-                lastIndex += 16000 #Update to the next part (if any)
-        workbook.close()
+        export_xlsx(fileName, all_layers, t)
     
     #PLOTS
     #plots -> type[time vs stress at certain thickness, thickness vs stres at certain time] input from the user
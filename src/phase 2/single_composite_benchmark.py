@@ -1,160 +1,292 @@
-import numpy as np
+import argparse
+import contextlib
+import datetime
+import glob
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
 import time
-import copy as cp
-import wave_prop_analysis_V2, wave_prop_analysis_V1
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+try:
+    import resource
+except ImportError:
+    resource = None #not available on Windows, no RSS then
+import wave_prop_analysis_V1, wave_prop_analysis_V3
+import data_generator
+from wave_prop_analysis_V2 import Layer, Wave
+from composite_reader import read_composite
 
 '''
-Function that returns the middle column values of a given matrix
-depending on its parity
+Benchmark suite of the versions of the simulation code (engines)
+Every engine is run on a fixed set of workloads: the input files on data/,
+the first composite of the data generator and the mango composite (see
+single_composite_analysis_mango). Each (workload, engine) case runs on a
+new process, <repeats> times for the runtime and once more with tracemalloc
+for the peak memory, and gives:
+median, p90, min, max, mean -> runtime of the simulation (seconds, the
+                               construction of the composite is not included)
+steps_per_s -> time steps simulated per second (median runtime)
+waves_per_s -> wave steps (nodes updated by a wave on a time step, counted
+               once per workload with V3) simulated per second
+peak_bytes -> peak memory allocated while building and simulating (tracemalloc)
+max_rss_bytes -> max resident memory of the process of the case (RSS)
+storage -> what the engine keeps of the stresses: "dense" (the whole mesh,
+           allocated before the simulation and filled by it), "reduce" (only
+           the reductions, V3) or "fronts" (only the wavefronts of the
+           lattice, no mesh filled). Only the runtimes of the same storage
+           are comparable
+Engines that need the whole mesh are skipped on the workloads whose mesh
+would take more than max_mesh_bytes. The results are written as JSON, and
+compare prints the change of the median runtimes between two of them
+(for example, before and after a commit)
+Usage (from src/phase 2):
+  python single_composite_benchmark.py --output after.json
+  python single_composite_benchmark.py --compare before.json after.json
 '''
-def middleH(matrix):
-    if len(matrix[0])%2 == 0:
-        i = len(matrix[0])/2
-        return [(row[i]) for row in matrix]
-    else:
-        i = len(matrix[0])/2-0.5
-        return [row[int(i)] for row in matrix]
+
+#Engines: module, options for simulate_waves and storage (the meshes are
+#needed for "dense")
+ENGINES = {
+    "v1": ("wave_prop_analysis_V1", {}, "dense"),
+    "v2": ("wave_prop_analysis_V2", {"verbose": False}, "dense"),
+    "v3": ("wave_prop_analysis_V3", {"verbose": False}, "dense"),
+    "v3-reduce": ("wave_prop_analysis_V3", {"verbose": False, "storage": "reduce"}, "reduce"),
+    "lattice": ("wave_prop_lattice", {"verbose": False}, "dense"),
+    "lattice-fronts": ("wave_prop_lattice", {"verbose": False}, "fronts"),
+}
 
 '''
-Function to get a vertical cut, a point/node through time
+Function that returns the workloads of the suite: name -> (kind, argument)
+The input files on the given directory, the first composite of the data
+generator and the mango composite
 '''
-def column(matrix, i):
-    return [row[int(i)] for row in matrix]
+def workloads(directory="../../data"):
+    loads = {}
+    for filename in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+        loads[os.path.basename(filename)] = ("file", filename)
+    loads["generator"] = ("generator", 0)
+    loads["mango"] = ("mango", 150)
+    return loads
 
 '''
-Function that simulates the wave propagation on a single composite
+Function that creates the mango composite (same as
+single_composite_analysis_mango) for a final time, discretized and with the
+initial waves. Returns the layers, the time vector and the time step
 '''
-def simulate():
-    #BENCHMARK SIMULATION
-    #We read as many different files as needed to run a benchmark simulation
-    #between the composites described on the files
-    num_composites = int(input("How many composites are up to compare? "))
-    filenames = []
-    #Loop to ask for all filenames
-    for i in range(num_composites):
-        filenames.append(input("Enter file #"+str(i+1)+": "))
-    #The simulation will be run for times 10, 20, 50 and 100
-    #The simulation will be applied to the num of composites requested
-    #The simulation will be tested using both versions of the main code
-    #The simulation will be run 3 times for each time, considering a time step of 0.01
-    versions = [wave_prop_analysis_V1, wave_prop_analysis_V2]
-    finalts = [10, 20, 50, 100]
+def mango_composite(finalt=150, alloc=True):
+    FLOOR = Layer(1.52,1.21*10**9,891.3544,1,20*10**3)
+    EMPAQUE= Layer(3.5,1.3954*10**6,25.9586,1,1)
+    CASCARA = Layer(1,10.4092*10**6,1075.29144,120*10**2,100)
+    PULPA = Layer(33,4.2741*10**6,1258.856,1.4*10**3,200)
+    REC_SEM = Layer(2,410.9037*10**6,1049.96,1.4*10**3,200)
+    SEM = Layer(12.5,36.9569*10**6,1064.85,1.4*10**3,200)
+    all_layers = [FLOOR,EMPAQUE,CASCARA,PULPA,REC_SEM,SEM]
+    sigma_i= -4.4294/(1/all_layers[0].rhoc+1/all_layers[1].rhoc)
     step = 0.01
-    n = 3
-    running_times = np.zeros((len(finalts),len(filenames),len(versions),n))
-    print("\n--- SIMULATION IN PROGRESS ---")
-    #First loop: final times considered
-    for ft, finalt in enumerate(finalts):
-        print(">> Simulating finalt = "+str(finalt))
-        #Second loop: both versions of simulation codes
-        for v, version in enumerate(versions):
-            #Third loop: files to simulate
-            for f, filename in enumerate(filenames):
-                #Loop through file to construct simulation
-                with open(filename,"r") as file:
-                    lines = file.readlines()
-                    i = 0
-                    #First, we read the num of layers for composite
-                    qty_layers = -1
-                    while qty_layers == -1:
-                        if not lines[i].startswith("#"): #consider line that doesn't start with #
-                            qty_layers = int(lines[i])
-                        i += 1
-                    #Now, we construct the layers of the composite
-                    all_layers = []
-                    for l in range(qty_layers):
-                        done = False
-                        while not done:
-                            if not lines[i].startswith("#"): #consider line that doesn't start with #
-                                #We first split the line by commas
-                                parts = lines[i].strip().split(",")
-                                #Now, we use the values to construct a layer
-                                rel = True if len(parts) == 5 else parts[5] == 'true'
-                                layer = version.Layer(float(parts[0]), float(parts[1]), float(parts[2]),
-                                              float(parts[3]), float(parts[4]), rel)
-                                all_layers.append(layer)    
-                                done = True
-                            i += 1
-                    #Now, we set the parameters for the simulation
-                    done = False
-                    while not done:
-                        if not lines[i].startswith("#"): #consider line that doesn't start with #
-                            # --- We can skip the line, not used for benchmark
-                            done = True
-                        i += 1
-                    #Using the parameters, we create the time vector and we discretize each layer
-                    t = np.arange(0, finalt, step)
-                    for layer in all_layers:
-                        layer.nodes(step,t.size)
-                    #Finally, we read the init conditions (init waves) to consider
-                    #First, num of init waves
-                    qty_waves = -1
-                    while qty_waves == -1:
-                        if not lines[i].startswith("#"): #consider line that doesn't start with #
-                            qty_waves = int(lines[i])
-                        i += 1
-                    #Now, we construct the waves and add them to respective layers
-                    for w in range(qty_waves):
-                        done = False
-                        while not done:
-                            if not lines[i].startswith("#"): #consider line that doesn't start with #
-                                #We first split the line by commas
-                                parts = lines[i].strip().split(",")
-                                #Now, we use the values to construct a wave on the respective layer
-                                layer_num = int(parts[0])
-                                pos = parts[1]
-                                if parts[3] == "s":
-                                    sigma = float(parts[2])
-                                else:
-                                    vel = float(parts[2])
-                                    sigma = vel/(1/all_layers[0].rhoc+1/all_layers[1].rhoc)
-                                if pos == "E":
-                                    wave = version.Wave(all_layers[layer_num-1].numnod-1,
-                                                all_layers[layer_num-1].numnod,0,sigma)
-                                else:
-                                    wave = version.Wave(0,all_layers[layer_num-1].numnod,1,sigma)
-                                all_layers[layer_num-1].waves.append(wave)
-                                done = True
-                            i += 1
-                #We're ready to run the simulation n times for each finalt
-                for i in range(n):
-                    #Run simulation and measure time
-                    layers_copy = cp.deepcopy(all_layers)
-                    start_time = time.time()
-                    version.simulate_waves(layers_copy, t, step)
-                    end_time = time.time()
-                    running_times[ft][f][v][i] = (end_time-start_time)
-                print("Composite #"+str(f+1)+" completed for version #"+str(v+1))
-    print("--- SIMULATION COMPLETED ---\n")
-    #Final printing of benchmark table!
-    #Header of table
-    print("-"*25+"-"*(num_composites*(13*len(versions))))
-    header = "{0:25s}"
-    for i in range(num_composites):
-        header += "{"+str(i+1)+":"+str(13*len(versions))+"s}"
-    print(header.format(*([""]+["|Composite #"+str(i+1) for i in range(num_composites)])))
-    print("-"*25+"-"*(num_composites*(13*len(versions))))
-    #Sub-header for the num of versions for each composite
-    subheader = ""
-    for i in range(len(versions)):
-        subheader += "{"+str(i+1)+":13s}"
-    print("{0:25s}".format("Running Time")+subheader.format(*([""]+["|V"+str(i+1) for i in range(len(versions))]))*num_composites)
-    print("-"*25+"-"*(num_composites*(13*len(versions))))
-    #Print each row finding the average of the running times
-    for ft, finalt in enumerate(finalts):
-        avgs = []
-        for f in range(num_composites):
-            for v in range(len(versions)):
-                #Find average of current composite and version
-                avgs.append(np.average(running_times[ft][f][v]))
-        #Print average values on the row
-        row = "{0:<25d}"
-        for i in range(len(avgs)):
-            row += "{"+str(i+1)+":<13.5f}"
-        print(row.format(*([finalt]+avgs)))
-    
-'''
-Main block to call for simulate
+    t = np.arange(0, finalt, step)
+    for layer in all_layers:
+        layer.nodes(step,t.size,alloc)
+    all_layers[0].waves.append(Wave(all_layers[0].numnod-1,all_layers[0].numnod,0,sigma_i))
+    all_layers[1].waves.append(Wave(0,all_layers[1].numnod,1,sigma_i))
+    return all_layers, t, step
+
+'''
+Function that builds the composite of a workload (layers of V2, meshes
+allocated or not). Returns the layers, the time vector and the time step
+'''
+def build(workload, alloc=True):
+    kind, arg = workload
+    if kind == "file":
+        all_layers, t, step, finalt, directives = read_composite(arg, alloc, stride=1, window=False,
+                                                                 probes=[], interfaces=False)
+    elif kind == "generator":
+        all_layers = data_generator.composite(*data_generator.configurations()[arg])
+        step = 0.01
+        t = data_generator.prepare(all_layers, step, alloc)
+    else:
+        all_layers, t, step = mango_composite(arg, alloc)
+    return all_layers, t, step
+
+'''
+Function that converts the layers of a composite (V2, discretized) into the
+ones of V1, with the same discretization and initial waves
+'''
+def to_v1(all_layers, tsize):
+    layers = []
+    for layer in all_layers:
+        optional = {"rel": layer.rel}
+        if layer.sf_t is not None:
+            optional["sf_t"], optional["sf_c"] = layer.sf_t, layer.sf_c
+        new = wave_prop_analysis_V1.Layer(layer.h, layer.E, layer.rho, layer.m, layer.v, **optional)
+        new.dinit = layer.dinit
+        new.numnod = layer.numnod
+        new.h = layer.h
+        new.mesh = np.zeros((tsize,layer.numnod))
+        new.waves = [wave_prop_analysis_V1.Wave(w.pos,w.size,w.direct,w.value) for w in layer.waves]
+        layers.append(new)
+    return layers
+
+'''
+Recorder (see mesh_storage) that only counts the wave steps: nodes changed
+by the waves on the rows of every time step
+'''
+class WaveCounter:
+    #Constructor of the WaveCounter class
+    def __init__(self):
+        self.count = 0
+
+    #Function that counts the changes of the time step
+    def step(self,i,prev,cur,changes_cur,changes_prev):
+        self.count += changes_cur[0].size
+
+    def finish(self,i,prev):
+        pass
+
+'''
+Function that returns the num of wave steps of a composite (simulated with
+V3, nothing stored)
+'''
+def wave_steps(all_layers, t):
+    counter = WaveCounter()
+    arrays = wave_prop_analysis_V3.layer_arrays([all_layers])
+    ints, value = wave_prop_analysis_V3.gather_waves(all_layers)
+    wave_prop_analysis_V3.run(arrays, ints, value, t.size, counter, False)
+    return counter.count
+
+'''
+Function that runs one case (workload, engine) on its process: the runtimes
+of <repeats> simulations and the peak memory of one more (tracemalloc) and
+of the process (RSS). Receives a tuple with the workload, the engine and the
+num of repeats
+'''
+def run_case(args):
+    workload, engine, repeats = args
+    module_name, options, storage = ENGINES[engine]
+    dense = storage == "dense"
+    version = importlib.import_module(module_name)
+    #Function that builds the composite for the engine and simulates it (the
+    #output of the engines is discarded), returning the runtime
+    def simulate():
+        with contextlib.redirect_stdout(io.StringIO()):
+            all_layers, t, step = build(workload, dense)
+            if engine == "v1":
+                all_layers = to_v1(all_layers, t.size) #V1 prints the arguments of its layers
+            start_time = time.perf_counter()
+            version.simulate_waves(all_layers, t, step, **options)
+            return time.perf_counter() - start_time
+    times = [simulate() for r in range(repeats)]
+    tracemalloc.start()
+    simulate()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024 if resource is not None else None
+    return times, peak, rss
+
+'''
+Function that returns the data of the environment of the benchmark (commit,
+date, versions and machine)
+'''
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "numpy": np.__version__, "machine": platform.platform(),
+            "cpus": os.cpu_count()}
+
+'''
+Function that runs the benchmark suite and writes the results as JSON
+directory -> directory of the input files to use as workloads
+engines, names -> engines and workloads to run (all by default)
+repeats -> num of runs of each case for the runtime
+max_mesh_bytes -> max size of the meshes for the engines that need them
+output -> JSON file (None to not write it)
+Returns the results (dictionary with the environment and one record per case)
+'''
+def benchmark(directory="../../data", engines=None, names=None, repeats=5, max_mesh_bytes=2**30,
+              output="benchmark.json"):
+    engines = list(ENGINES) if engines is None else engines
+    loads = workloads(directory)
+    names = list(loads) if names is None else names
+    results = []
+    print("{0:<16}{1:<16}{2:<9}{3:>11}{4:>11}{5:>13}{6:>14}{7:>11}".format(
+        "Workload", "Engine", "Storage", "Median (s)", "p90 (s)", "Steps/s", "Waves/s", "Peak MB"))
+    for name in names:
+        all_layers, t, step = build(loads[name], False)
+        nodes = sum(layer.numnod for layer in all_layers)
+        mesh_bytes = t.size*nodes*8
+        count = wave_steps(all_layers, t)
+        for engine in engines:
+            storage = ENGINES[engine][2]
+            record = {"workload": name, "engine": engine, "storage": storage, "steps": int(t.size),
+                      "nodes": int(nodes), "wave_steps": int(count)}
+            if storage == "dense" and mesh_bytes > max_mesh_bytes:
+                record["skipped"] = "mesh of {0:.1f} GB".format(mesh_bytes/1e9)
+                print("{0:<16}{1:<16}{2:<9}   skipped ({3})".format(name, engine, storage, record["skipped"]))
+                results.append(record)
+                continue
+            #A new process for each case, so the memory of one doesn't affect the others
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                times, peak, rss = executor.submit(run_case, (loads[name], engine, repeats)).result()
+            median = float(np.median(times))
+            record.update({"times": times, "median": median, "p90": float(np.percentile(times, 90)),
+                           "min": min(times), "max": max(times), "mean": float(np.mean(times)),
+                           "steps_per_s": t.size/median, "waves_per_s": count/median,
+                           "peak_bytes": peak, "max_rss_bytes": rss})
+            print("{0:<16}{1:<16}{2:<9}{3:>11.4f}{4:>11.4f}{5:>13.0f}{6:>14.0f}{7:>11.1f}".format(
+                name, engine, storage, median, record["p90"], record["steps_per_s"], record["waves_per_s"],
+                peak/1e6))
+            results.append(record)
+    data = {"environment": environment(), "repeats": repeats, "results": results}
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump(data, file, indent=1)
+    return data
+
+'''
+Function that prints the change of the median runtimes of the cases of two
+results of the benchmark (JSON files), for example before and after a commit
+The cases whose storage changed (or is not known, older results) are marked
+'''
+def compare(before, after):
+    with open(before) as file:
+        old = {(r["workload"], r["engine"]): r for r in json.load(file)["results"] if "median" in r}
+    with open(after) as file:
+        new = {(r["workload"], r["engine"]): r for r in json.load(file)["results"] if "median" in r}
+    print("{0:<16}{1:<16}{2:>13}{3:>13}{4:>10}".format("Workload", "Engine", "Before (s)", "After (s)", "Speedup"))
+    for key in new:
+        if key in old:
+            storages = (old[key].get("storage"), new[key].get("storage"))
+            note = "" if storages[0] == storages[1] else "  storage {0} -> {1}".format(*storages)
+            print("{0:<16}{1:<16}{2:>13.4f}{3:>13.4f}{4:>9.2f}x{5}".format(
+                key[0], key[1], old[key]["median"], new[key]["median"], old[key]["median"]/new[key]["median"], note))
+
+'''
+Function with the command line interface of benchmark and compare
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark suite of the simulation engines")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=None, help="engines to run (all by default)")
+    parser.add_argument("--workloads", nargs="+", default=None, help="workloads to run (all by default)")
+    parser.add_argument("--repeats", type=int, default=5, help="runs of each case (5 by default)")
+    parser.add_argument("--max-mesh-gb", type=float, default=1.0, help="max mesh size for the engines that need it")
+    parser.add_argument("--data", default="../../data", help="directory of the input files")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file of the results")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two results instead")
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+    else:
+        benchmark(args.data, args.engines, args.workloads, args.repeats, int(args.max_mesh_gb*2**30), args.output)
+
+'''
+Main block to call for main
 '''
 if __name__ == "__main__":
-    simulate()
\ No newline at end of file
+    main()
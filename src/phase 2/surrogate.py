@@ -0,0 +1,140 @@
+import csv
+import json
+import numpy as np
+
+'''
+Surrogate of the simulations: a trained classifier (the Keras model of
+src/phase 1/composites_DL.ipynb) that predicts the label of a composite from
+its row of the generated data (data_generator.row, without Y), so only the
+composites it's unsure about need to be simulated
+The model is trained on some of the columns of the data (the ones that are
+not constant) normalized by the L2 norm of each column (keras.utils.normalize
+with axis=0), so the same columns and norms are needed to use it on new
+composites: the features spec, a JSON file with
+columns -> names of the columns given to the model, in order
+scale -> value each column is divided by
+offset -> value subtracted from each column first (optional, 0 by default,
+          the spec of src/phase 1/training.py has the mean of each column)
+The L2 norms grow with the num of rows, so they must be the ones of the exact
+rows the model was trained on (the notebook normalizes its training split,
+70% of the rebalanced data, not the whole CSV). The notebook saves them with
+the model (classifier.keras and classifier.keras.json), found before the
+features are normalized:
+  feature_norms = np.linalg.norm(comp_features_train, axis=0)
+src/phase 1/training.py saves its spec (mean and standard deviation, which
+don't depend on the num of rows) next to the model too
+TensorFlow is only needed to load a Keras model (Surrogate.load), any object
+with a predict function (rows -> probabilities) can be used as the model
+'''
+
+#Columns of the data that are not features (label, probability and flag of
+#the screened data)
+NOT_FEATURES = ("Y", "P", "SIMULATED")
+
+'''
+Function that reads a CSV file of generated data. Returns its header and its
+rows (array, one row each)
+'''
+def read_data(filename):
+    with open(filename, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        data = np.array([[float(x) for x in line] for line in reader if line]).reshape(-1,len(header))
+    return header, data
+
+'''
+Function that returns the features spec of some rows of generated data (with
+the given header): the columns that are not constant (as the notebook drops
+them) and the L2 norm of each one (the normalization of the notebook). The
+rows must be exactly the ones the model is trained on
+'''
+def spec(header, data):
+    columns, scale = [], []
+    for c, name in enumerate(header):
+        if name in NOT_FEATURES or np.all(data[:,c] == data[0,c]):
+            continue
+        columns.append(name)
+        scale.append(float(np.linalg.norm(data[:,c])))
+    return columns, scale
+
+'''
+Function that saves a features spec (columns and scale) as a JSON file
+'''
+def save_spec(filename, columns, scale):
+    with open(filename, "w") as file:
+        json.dump({"columns": list(columns), "scale": [float(x) for x in scale]}, file, indent=1)
+
+'''
+Function that builds the classifier of the notebook (Keras model) for the
+given num of features, the one trained by src/phase 1/training.py and by the
+active learning. If a seed is given, the weights are initialized by it
+'''
+def build_model(features, learning_rate=0.0003, seed=None):
+    try:
+        import tensorflow as tf
+    except ImportError:
+        raise ImportError("TensorFlow is needed to train the classifier")
+    from tensorflow.keras import layers
+    from tensorflow.keras.regularizers import l1
+    if seed is not None:
+        tf.keras.utils.set_random_seed(seed)
+    model = tf.keras.Sequential([
+        layers.Dense(256, input_shape=(features,), activation="relu", kernel_regularizer=l1(1e-4)),
+        layers.Dense(128, activation="relu", kernel_regularizer=l1(1e-4)),
+        layers.Dense(64, activation="relu", kernel_regularizer=l1(1e-4)),
+        layers.Dense(32, activation="relu", kernel_regularizer=l1(1e-4)),
+        layers.Dense(2, activation="softmax")
+    ])
+    model.compile(loss="sparse_categorical_crossentropy", optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  metrics=["accuracy"])
+    return model
+
+'''
+Class that holds a classifier and its features spec, to predict the
+probability of label 1 (the composite can be considered) of composites given
+their rows of generated data (all the columns of header, without Y)
+model -> object with a predict function: rows of features -> probabilities
+         (two columns, softmax of labels 0 and 1, or one, of label 1)
+columns, scale, offset -> features spec (see above)
+header -> columns of the rows given (data_generator.header without Y)
+options -> arguments for the predict function of the model
+'''
+class Surrogate:
+    #Constructor of the Surrogate class
+    def __init__(self,model,columns,scale,header,offset=None,**options):
+        self.model = model
+        self.options = options
+        self.columns = list(columns)
+        self.scale = np.array(scale, dtype=float)
+        self.offset = np.zeros(self.scale.size) if offset is None else np.array(offset, dtype=float)
+        missing = [name for name in self.columns if name not in header]
+        if missing:
+            raise ValueError("Columns of the model missing on the data: " + ", ".join(missing))
+        self.index = np.array([header.index(name) for name in self.columns], dtype=int)
+
+    #Function that loads a Keras model (file saved with model.save) and its
+    #features spec (JSON file, <model file>.json by default)
+    @staticmethod
+    def load(filename, header, spec=None):
+        try:
+            import tensorflow as tf
+        except ImportError:
+            raise ImportError("TensorFlow is needed to load the classifier " + filename)
+        with open(filename + ".json" if spec is None else spec) as file:
+            data = json.load(file)
+        return Surrogate(tf.keras.models.load_model(filename), data["columns"], data["scale"], header,
+                         data.get("offset"), verbose=0)
+
+    #Function that returns the features given to the model for some rows
+    def features(self,rows):
+        return (np.asarray(rows, dtype=float)[:,self.index] - self.offset) / self.scale
+
+    #Function that returns the probability of label 1 of some rows, predicted
+    #by blocks of the given num of rows
+    def probability(self,rows,block=65536):
+        x = self.features(rows)
+        p = np.zeros(len(x))
+        for a in range(0, len(x), block):
+            y = np.asarray(self.model.predict(x[a:a+block], **self.options))
+            p[a:a+block] = y[:,1] if y.ndim == 2 and y.shape[1] == 2 else y.reshape(-1)
+        return p
@@ -1,4 +1,6 @@
 import math
+import os
+import tempfile
 import numpy as np
 
 '''
@@ -40,11 +42,58 @@ class Layer:
         
     #Function that finds the needed num of nodes and creates the mesh grid
     #goven the delta time and final time
-    def nodes(self,deltat,tsize):
+    #If alloc is False, the mesh is not created (the simulation sets it)
+    #If a scratch directory is given, the mesh is a memory-mapped file on it
+    #(np.memmap), so meshes larger than the memory can be simulated. The file
+    #is kept until free_mesh is called
+    #dtype is the type of the floats of the mesh: np.float32 takes half the
+    #memory (the simulations add the stresses in float64 and only store them
+    #in float32)
+    #stride is the num of time steps between the rows stored on the mesh (only
+    #every stride-th row is kept, V3 and the lattice). If window is True, the
+    #max and min of each node over the time steps from a stored row until the
+    #next one are kept too (mesh_max and mesh_min), so no peak is lost
+    def nodes(self,deltat,tsize,alloc=True,scratch=None,dtype=float,stride=1,window=False):
         self.dinit = self.c * deltat
         self.numnod = int(round(self.h / self.dinit)+1) #+1 to make it have one node more when we have an 'exact' model
         self.h = self.numnod * self.dinit
-        self.mesh = np.zeros((tsize,self.numnod))
+        self.stride = stride
+        self.mesh = None
+        self.mesh_max = None
+        self.mesh_min = None
+        self.mesh_files = []
+        if alloc:
+            rows = -(-tsize // stride) #rows 0, stride, 2*stride, ...
+            self.mesh = self.new_mesh(rows,scratch,dtype)
+            if window:
+                self.mesh_max = self.new_mesh(rows,scratch,dtype)
+                self.mesh_min = self.new_mesh(rows,scratch,dtype)
+        self.stats = None #reductions of the mesh, if the simulation only keeps those
+        self.probes = None #series of some nodes (node -> values), if the simulation only records those
+
+    #Function that creates an array for a mesh with the given num of rows, in
+    #memory or as a memory-mapped file on the scratch directory
+    def new_mesh(self,rows,scratch,dtype):
+        if scratch is None:
+            return np.zeros((rows,self.numnod), dtype=dtype)
+        os.makedirs(scratch, exist_ok=True)
+        fd, filename = tempfile.mkstemp(prefix="layer_", suffix=".mesh", dir=scratch)
+        os.close(fd)
+        self.mesh_files.append(filename)
+        return np.memmap(filename, dtype=dtype, mode="w+", shape=(rows,self.numnod))
+
+    #Function that frees the meshes of the layer, removing their files if
+    #they're memory-mapped
+    def free_mesh(self):
+        self.mesh = None
+        self.mesh_max = None
+        self.mesh_min = None
+        for filename in getattr(self, "mesh_files", []):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass #still in use (other references to the mesh)
+        self.mesh_files = []
     
     #Function that returns an array for discrete width of layer
     #For example, for h = 3 and numnod = 7, returns [0,0.5,1,1.5,2,2.5,3]
@@ -59,7 +108,27 @@ class Layer:
         #We calculate the stresses considering a local confinement. We consider
         #the generalized Hooke's Law to calculate sigma_x, sigma_y and sigma_y
         hyd = lambda x: ((self.v*x/(1-self.v))*2 + x)/3
-        return hyd(self.mesh)
+        return hyd(np.asarray(self.mesh))
+    
+    #Function that returns the max and min hydrostatic stress (all times and
+    #all points). Uses the reductions of the simulation (stats) if there's no mesh
+    #The hydrostatic stress grows with the stress, so it's found from the max
+    #and min stress (the mesh is read only once, without another copy of it)
+    #If the mesh has a stride, the max and min of its windows are used, as the
+    #peaks between the stored rows would be lost (without a window, the range
+    #can't be found and an error is raised)
+    def hydRange(self):
+        hyd = lambda x: ((self.v*x/(1-self.v))*2 + x)/3
+        if self.stats is not None:
+            values = (hyd(self.stats.max), hyd(self.stats.min))
+        elif getattr(self, "mesh_max", None) is not None:
+            values = (hyd(np.amax(self.mesh_max)), hyd(np.amin(self.mesh_min)))
+        elif getattr(self, "stride", 1) != 1:
+            raise ValueError("The mesh only has every {0}-th time step, the peaks between them are lost "
+                             "(use a window to keep them)".format(self.stride))
+        else:
+            values = (hyd(np.amax(self.mesh)), hyd(np.amin(self.mesh)))
+        return max(values), min(values)
     
     #String representation (readable format) of the Layer
     def __str__(self):
@@ -88,6 +157,31 @@ class Wave:
         self.direct = direct #0 -> left, 1 ->right
         self.value = value
          
+'''
+Class that takes the place of a mesh of lower precision (float32) during the
+simulation of V2: the rows being simulated (the current and the previous
+time step) are kept in float64 and each row is only rounded to the mesh once
+it's complete (flush), so the error doesn't grow with the num of waves added
+'''
+class RowBuffer:
+    #Constructor of the RowBuffer class, given the mesh to fill
+    def __init__(self,mesh):
+        self.mesh = mesh
+        self.rows = {0: mesh[0].astype(float)}
+    
+    #Function that returns the float64 row of the given time step
+    def __getitem__(self,i):
+        return self.rows[i]
+    
+    #Function that sets the float64 row of the given time step (a copy)
+    def __setitem__(self,i,value):
+        self.rows[i] = np.array(value, dtype=float)
+    
+    #Function that stores the row of the given time step on the mesh and
+    #drops its float64 copy
+    def flush(self,i):
+        self.mesh[i] = self.rows.pop(i)
+
 '''
 Function that calculates the coefficient of transmitted stress
 '''
@@ -104,8 +198,18 @@ def csR(z1,z2):
 Function that runs the main simulation for the elastic waves propagation
 Receives the List of Layers to consider (with the initial waves on them),
 the time vector for the simulation and the time step
+If verbose is False, the advance of the simulation is not printed
 '''
-def simulate_waves(all_layers, t, step):
+def simulate_waves(all_layers, t, step, verbose=True):
+    #Every row of the meshes is needed (stride is only supported by V3 and the lattice)
+    if any(getattr(layer, "stride", 1) != 1 for layer in all_layers):
+        raise ValueError("V2 needs the meshes with every time step (stride 1)")
+    #Meshes of lower precision are filled through float64 rows (RowBuffer)
+    buffers = {}
+    for layer in all_layers:
+        if layer.mesh.dtype != np.float64:
+            buffers[layer] = RowBuffer(layer.mesh)
+            layer.mesh = buffers[layer]
     #Get layers and store its length on a variable
     qty_layers = len(all_layers);
     
@@ -137,8 +241,9 @@ def simulate_waves(all_layers, t, step):
     #STARTS THE MAIN SIMULATION!
     #Iterations for all times
     next_percentage_advance = 10 #next advance percentage to print (status)
-    print("    --- Current advance on simulation (%) ---")
-    print(" "*8,end="")
+    if verbose:
+        print("    --- Current advance on simulation (%) ---")
+        print(" "*8,end="")
     for i in range(1,t.size):
         #Then, we start simulating each wave of each layer
         inactive_waves = {} #dictionary of inactive waves, storing (layer,wave) pairs
@@ -226,11 +331,18 @@ def simulate_waves(all_layers, t, step):
                     wave2.value += wave1.value
                     layer.waves.remove(wave1)
                     break
+        #The previous time step is complete
+        for buffer in buffers.values():
+            buffer.flush(i-1)
         #STATUS: Print statement to check advance of simulation
-        if (i / t.size)*100 >= next_percentage_advance:
+        if verbose and (i / t.size)*100 >= next_percentage_advance:
             print(str(next_percentage_advance)+", ",end="")
             next_percentage_advance += 10
     #Simulation completed!
-    print("100")
+    for layer, buffer in buffers.items():
+        buffer.flush(t.size-1)
+        layer.mesh = buffer.mesh
+    if verbose:
+        print("100")
                 
         
\ No newline at end of file
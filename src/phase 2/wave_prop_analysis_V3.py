@@ -0,0 +1,603 @@
+import warnings
+import numpy as np
+from wave_prop_analysis_V2 import Layer, Wave, csT, csR
+from mesh_storage import DenseRecorder, EventRecorder, ReduceRecorder, ProbeRecorder
+
+'''
+Vectorized version of the elastic waves propagation (V3)
+The model is exactly the one of V2 (same Layer and Wave classes, same
+propagation, reflection, transmission and combination rules), but the waves
+of the whole composite are stored as a structure of arrays instead of lists
+of Wave objects:
+lay -> layer each wave belongs to
+pos -> position inside its layer (node)
+direct -> direction of wave (0 -> left, 1 -> right)
+value -> stress value of wave
+The arrays are always sorted by layer and, inside each layer, by creation
+order, which is the order V2 walks its lists of waves. Keeping that order
+makes the meshes obtained identical to the ones of V2.
+The stress of all nodes of the composite at a given time is stored in a flat
+row (layers one after the other), so every layer is a slice of that row
+starting at its offset. The rows are handed to a recorder (mesh_storage)
+that stores them as needed.
+'''
+
+#Recorders available for the storage of the meshes
+RECORDERS = {"dense": DenseRecorder, "events": EventRecorder, "reduce": ReduceRecorder, "probes": ProbeRecorder}
+
+'''
+Function that builds the arrays describing the layers of one or more
+composites (list of lists of layers, all the layers one after the other):
+num of nodes, offsets on the flat row, coefficients on both sides of each
+layer and flags for the free boundaries (first and last layer of each
+composite, so the waves never go from one composite to another)
+'''
+def layer_arrays(composites):
+    all_layers = [layer for all_layers in composites for layer in all_layers]
+    qty_layers = len(all_layers)
+    numnod = np.array([layer.numnod for layer in all_layers])
+    off = np.zeros(qty_layers, dtype=int)
+    off[1:] = np.cumsum(numnod)[:-1]
+    #Coefficients for the left (row 0) and right (row 1) side of each layer.
+    #The free boundaries reflect the wave entirely (-1) and transmit nothing
+    refl = -np.ones((2,qty_layers))
+    trans = np.zeros((2,qty_layers))
+    first = np.zeros(qty_layers, dtype=bool)
+    last = np.zeros(qty_layers, dtype=bool)
+    k0 = 0
+    for layers in composites:
+        for k in range(k0, k0+len(layers)-1):
+            rhoc1, rhoc2 = all_layers[k].rhoc, all_layers[k+1].rhoc
+            refl[1][k] = csR(rhoc1,rhoc2)
+            trans[1][k] = csT(rhoc1,rhoc2)
+            refl[0][k+1] = csR(rhoc2,rhoc1)
+            trans[0][k+1] = csT(rhoc2,rhoc1)
+        first[k0] = True
+        last[k0+len(layers)-1] = True
+        k0 += len(layers)
+    return numnod, off, refl, trans, first, last
+
+'''
+Function that collects the waves of all layers (Wave objects) into the
+structure of arrays used by the engine: an integer array with the layer,
+position and direction of each wave (one row each) and the array of values
+'''
+def gather_waves(all_layers):
+    ints, value = [], []
+    for k, layer in enumerate(all_layers):
+        for wave in layer.waves:
+            ints.append((k, wave.pos, wave.direct))
+            value.append(wave.value)
+    return np.array(ints, dtype=int).reshape(-1,3).T.copy(), np.array(value, dtype=float)
+
+'''
+Function that stores back the state of the waves into the layers as Wave
+objects, so the layers look the same as after a V2 simulation
+'''
+def scatter_waves(all_layers, ints, value):
+    for layer in all_layers:
+        layer.waves = []
+    for (k, p, d), v in zip(ints.T.tolist(), value.tolist()):
+        all_layers[k].waves.append(Wave(p,all_layers[k].numnod,d,v))
+
+'''
+Function that returns, for a sorted array of groups, a boolean mask with the
+last element of each group
+'''
+def last_of_group(groups):
+    mask = np.ones(groups.size, dtype=bool)
+    mask[:-1] = groups[1:] != groups[:-1]
+    return mask
+
+'''
+Function that inserts new columns (waves) on the given array before the
+given (sorted) positions, the same as np.insert but faster for few columns
+'''
+def insert_cols(arr, at, cols):
+    n = arr.shape[-1]
+    dest = at + np.arange(at.size)
+    src = np.empty(n+at.size, dtype=int)
+    src[dest] = n + np.arange(at.size)
+    keep = np.ones(src.size, dtype=bool)
+    keep[dest] = False
+    src[keep] = np.arange(n)
+    return np.concatenate((arr, cols), axis=-1).take(src, axis=-1)
+
+'''
+Function that advances all the waves one time step
+Receives the arrays of the layers and the arrays of the waves and returns
+the new arrays of the waves together with the stresses to add on the
+current row (node, value) and on the previous row (node, value), both in the
+same order V2 adds them. Waves that don't change a node add 0 to it, so the
+arrays don't need to be compressed
+If an Instruments object is given (see instrumentation), the reflections,
+transmissions and combinations of waves and the time taken are recorded on it
+'''
+def advance(numnod, off, refl, trans, first, last, ints, value, instruments=None):
+    lay, pos, direct = ints
+    size = numnod[lay]
+    left = direct == 0
+    at_b = pos == 0
+    at_e = pos == size-1
+    #Cases of V2, in the same priority order:
+    #bounce -> reaching a side (reflection on the side it is going to)
+    #new -> created on the last time step on the opposite side
+    #any other wave just moves one node
+    bounce_l = left & at_b
+    bounce_r = ~left & at_e
+    bounce = bounce_l | bounce_r
+    new = (left & at_e & ~at_b) | (~left & at_b & ~at_e)
+    #Reflections change the value of the wave given the coefficient
+    if bounce.any():
+        value = value * np.where(bounce_l, refl[0][lay], np.where(bounce_r, refl[1][lay], 1.0))
+        if instruments is not None:
+            instruments.count("reflections", lay[bounce])
+    #Every wave moves one node (bouncing waves change direction first)
+    move = 1 - 2*(left ^ bounce)
+    #Nodes of the current time step changed by each wave, in V2 order: the
+    #node it is on (only bouncing and new waves) and the node it moves to
+    two = bounce | new
+    base = off[lay] + pos
+    cur_nodes = np.empty((lay.size,2), dtype=int)
+    cur_nodes[:,0] = base
+    cur_nodes[:,1] = base + move
+    cur_vals = np.empty((lay.size,2))
+    cur_vals[:,0] = np.where(two, value, 0.0)
+    cur_vals[:,1] = value
+    #Bouncing waves on interfaces and new waves also change the stress of
+    #the previous time step on the node they are on
+    prev_mask = new | (bounce_l & ~first[lay]) | (bounce_r & ~last[lay])
+    prev_vals = np.where(prev_mask, value, 0.0)
+    #Transmitted waves for the neighbour layers (one node before the sides)
+    spawn = ~(two | np.where(left, first[lay] | (pos != 1), last[lay] | (pos != size-2)))
+    #Candidate waves to combine: the new ones (the last one of each layer)
+    cand = new
+    spawn_idx = np.nonzero(spawn)[0]
+    ints = ints.copy()
+    ints[1] += move
+    ints[2] ^= bounce
+    if spawn_idx.size > 0:
+        #Only the last wave transmitted to each layer is kept (as V2 does)
+        idx = spawn_idx
+        going_l = left[idx]
+        tgt = lay[idx] + np.where(going_l, -1, 1)
+        tgt_vals = value[idx] * np.where(going_l, trans[0][lay[idx]], trans[1][lay[idx]])
+        order = np.argsort(tgt, kind='stable')
+        idx = order[last_of_group(tgt[order])]
+        new_lay = tgt[idx]
+        new_dir = (~going_l[idx]).astype(int)
+        new_pos = np.where(going_l[idx], numnod[new_lay]-1, 0)
+        if instruments is not None:
+            lost = np.ones(tgt.size, dtype=bool)
+            lost[idx] = False
+            instruments.count("transmissions", new_lay)
+            instruments.count("lost", tgt[lost])
+        #New waves go to the end of the list of their layer
+        at = np.searchsorted(lay, new_lay, side='right')
+        cand = insert_cols(cand, at, np.zeros(at.size, dtype=bool))
+        ints = insert_cols(ints, at, np.stack((new_lay, new_pos, new_dir)))
+        value = insert_cols(value, at, tgt_vals[idx])
+    if instruments is not None:
+        instruments.lap("propagate")
+    #Finally, we check for possible waves to combine
+    if cand.any():
+        idx = np.nonzero(cand)[0]
+        cands = idx[last_of_group(ints[0][idx])]
+        #First existing wave with same layer, position and direction
+        key = (ints[0]*(numnod.max()+1) + ints[1])*2 + ints[2]
+        if cands.size*key.size <= 100000:
+            #Few waves (one composite), a direct comparison is faster
+            match = key[:,None] == key[cands]
+            match[cands, np.arange(cands.size)] = False
+            found = match.any(axis=0)
+            merged = cands[found]
+            targets = match[:,found].argmax(axis=0)
+        else:
+            #Many waves (batch of composites), matching through sorted keys
+            match = np.isin(key, key[cands])
+            match[cands] = False
+            found = np.nonzero(match)[0]
+            keys, first_idx = np.unique(key[found], return_index=True)
+            merged = cands[np.isin(key[cands], keys)]
+            targets = found[first_idx][np.searchsorted(keys, key[merged])]
+        if merged.size > 0:
+            value[targets] += value[merged]
+            if instruments is not None:
+                instruments.count("merges", ints[0][targets])
+            keep = np.ones(value.size, dtype=bool)
+            keep[merged] = False
+            ints, value = ints.compress(keep, axis=1), value.compress(keep)
+    if instruments is not None:
+        instruments.lap("merge")
+    return (ints, value), (cur_nodes.ravel(), cur_vals.ravel()), (base, prev_vals)
+
+'''
+Class that holds the results of a simulation other than the stresses
+(culling of waves):
+tol -> threshold (Pa) of each layer at the end, waves with a smaller abs
+       value are dropped (0 if waves are never dropped)
+dropped -> num of waves dropped
+discarded -> sum of the abs values of the waves dropped on each layer (Pa),
+             only the values they had when dropped
+bound -> bound of the error of the stresses of the nodes of each layer at
+         any time (Pa), see error_bound: every dropped wave would have kept
+         reflecting and transmitting until the end, so its values are
+         amplified by the largest growth of the waves it would have created
+peak -> peak stress of each layer (max abs stress of its nodes, all times,
+        0 if waves are never dropped)
+relative -> bound of each layer relative to its peak stress (inf for a layer
+            without stresses but with a bound). Above 1, the culling may have
+            changed the stresses as much as their own size
+and the failures found if the simulation stopped on them (stop_on_failure):
+failures -> for each composite, None if it didn't fail or (time, layer num,
+            mode) of its failure, mode "tension", "compression" or "both"
+            (None if the failures weren't checked)
+failure -> failure of the first composite (the only one for simulate_waves)
+'''
+class SimulationResult:
+    #Constructor of the SimulationResult class
+    def __init__(self,tol,dropped,discarded,bound=None,peak=None,failures=None):
+        self.tol = tol
+        self.dropped = dropped
+        self.discarded = discarded
+        self.bound = np.zeros(discarded.size) if bound is None else np.asarray(bound, dtype=float)
+        self.peak = np.zeros(discarded.size) if peak is None else np.asarray(peak, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.relative = np.where(self.bound > 0, self.bound/self.peak, 0.0)
+        self.failures = failures
+        self.failure = failures[0] if failures else None
+
+    #String representation (readable format) of the result
+    def __str__(self):
+        k = int(np.argmax(self.relative)) if self.relative.size > 0 else 0
+        text = "dropped waves = {0}, error of the stresses <= {1:.4g} times the peak stress".format(
+            self.dropped, self.relative[k] if self.relative.size > 0 else 0.0)
+        if self.dropped > 0:
+            text += " (layer #{0}, {1:.4e} Pa)".format(k+1, self.bound[k])
+        if self.failure is not None:
+            text += ", {2} failure of layer #{1} at {0:.2f} micro-s".format(*self.failure)
+        return "{" + text + "}"
+
+    #String representation of the result
+    def __repr__(self):
+        return self.__str__()
+
+'''
+Function that returns the bound of the error of the stresses of each layer
+caused by the waves dropped (culling), given the arrays of the layers, the
+dropped waves (arrays of their layer, position, direction, time step when
+dropped and abs value) and the last time step of the composite of each layer
+The model is linear, so the error of a node at a time is the sum of the
+stresses the dropped waves (and the waves they would have created) would
+have added to it, and each one adds at most its abs value to each node of
+its layer. A wave reaching a side creates a reflected wave (|R| times its
+value) and a transmitted one (|T| times its value, T can be up to 2), so the
+bound of a layer is the sum of the abs values of every wave that would have
+been created on it until the end: each dropped wave is followed to the sides
+of the layers (reaching the next side after numnod-1 time steps at most) and
+the sum of |R| and |T| of every side reached is compounded
+It's only a loose upper limit when it holds: the signs of the waves are
+ignored (they mostly cancel) and |R|+|T| > 1 on every side towards a stiffer
+layer, so it grows geometrically with the time left and the contrast of the
+layers (on single2.txt with rtol=0.01 it's ~240 times the actual error).
+And it doesn't hold on every composite: the model of V2 is not linear, only
+one of the waves transmitted to a layer on the same time step is kept and
+only the newest wave of each layer is combined, so dropping a wave (however
+small) can change which waves are kept. On the bundled files adding a wave
+of 1e-6 Pa changes the stresses by ~10 Pa (singleB.txt), and with rtol=0.001
+the error is 1.4 times the peak stress on single1.txt while the bound is
+0.38, and 8 times the bound on singleB.txt. It holds on the composites whose
+transmissions are never lost (see instrumentation), and with stop_on_failure
+the time of the failure can change too
+'''
+def error_bound(numnod, refl, trans, drops, ends):
+    lay, pos, direct, steps, values = drops
+    qty_layers = numnod.size
+    total = np.zeros(qty_layers)
+    if values.size == 0:
+        return total
+    delay = np.maximum(numnod-1, 1)
+    #Time step each dropped wave reaches the side it is going to
+    arrival = steps + np.where(direct == 0, pos, numnod[lay]-1-pos)
+    order = np.argsort(arrival, kind='stable')
+    arrival, side, lay, values = arrival[order], direct[order], lay[order], values[order]
+    #Abs values reaching each side (0 left, 1 right) of each layer in the
+    #next time steps (circular buffer)
+    size = int(delay.max())+1
+    pending = np.zeros((size,2,qty_layers))
+    np.add.at(total, lay, values)
+    k = np.arange(qty_layers)
+    a = 0
+    with np.errstate(over='ignore', invalid='ignore'):
+        for i in range(int(arrival[0]), int(ends.max())+1):
+            b = np.searchsorted(arrival, i, side='right')
+            np.add.at(pending[i % size], (side[a:b], lay[a:b]), values[a:b])
+            a = b
+            reaching = pending[i % size].copy()
+            pending[i % size] = 0
+            reaching[:,ends < i] = 0 #the composite already ended
+            reflected = np.abs(refl)*reaching
+            transmitted = np.abs(trans)*reaching
+            total += reflected.sum(axis=0)
+            total[:-1] += transmitted[0][1:]
+            total[1:] += transmitted[1][:-1]
+            #Reflected waves go to the other side of the layer, transmitted
+            #ones to the far side of the neighbour layer
+            pending[(i+delay) % size, 1, k] += reflected[0]
+            pending[(i+delay) % size, 0, k] += reflected[1]
+            pending[(i+delay[:-1]) % size, 0, k[:-1]] += transmitted[0][1:]
+            pending[(i+delay[1:]) % size, 1, k[1:]] += transmitted[1][:-1]
+    return total
+
+'''
+Class that checks the failure criteria of data_generator.label on the rows of
+one or more composites (list of lists of layers) while they are simulated:
+a relevant layer (the first one of each composite, the projectile, avoided)
+fails when its max hydrostatic tension or compression is above its failure
+stress. Only the nodes of the relevant layers with failure stresses are read
+The time vector of each composite is needed to give the time of the failures
+comp -> composite of each layer
+active -> composites that haven't failed yet
+failures -> failure of each composite (see SimulationResult)
+'''
+class FailureMonitor:
+    #Constructor of the FailureMonitor class
+    def __init__(self,composites,ts,off,numnod):
+        self.ts = ts
+        self.comp = np.repeat(np.arange(len(composites)), [len(layers) for layers in composites])
+        self.active = np.ones(len(composites), dtype=bool)
+        self.failures = [None]*len(composites)
+        #Relevant layers (index on the flat layers and num on their composite)
+        checked = []
+        for c, layers in enumerate(composites):
+            k0 = int(np.nonzero(self.comp == c)[0][0])
+            for n, layer in enumerate(layers[1:],1):
+                if layer.rel and layer.sf_t is not None:
+                    checked.append((k0+n, n, layer))
+        self.lays = np.array([k for k, n, layer in checked], dtype=int)
+        self.nums = [n for k, n, layer in checked]
+        self.v = np.array([layer.v for k, n, layer in checked])
+        self.sf_t = np.array([layer.sf_t for k, n, layer in checked])
+        self.sf_c = np.array([layer.sf_c for k, n, layer in checked])
+        #Nodes of those layers on the flat rows, one layer after the other
+        self.nodes = np.concatenate([np.arange(off[k], off[k]+numnod[k]) for k in self.lays] + [np.zeros(0, dtype=int)])
+        self.starts = np.zeros(self.lays.size, dtype=int)
+        self.starts[1:] = np.cumsum(numnod[self.lays])[:-1]
+
+    #Function that checks the complete row of time step i. Returns a mask with
+    #the composites that failed on it
+    def check(self,i,row):
+        failed = np.zeros(self.active.size, dtype=bool)
+        if self.lays.size == 0:
+            return failed
+        values = row[self.nodes]
+        #Hydrostatic stresses from the max and min stresses (as Layer.hydRange)
+        hyd = lambda x: ((self.v*x/(1-self.v))*2 + x)/3
+        tension = np.maximum(hyd(np.maximum.reduceat(values, self.starts)), 0) > self.sf_t
+        compression = np.abs(np.minimum(hyd(np.minimum.reduceat(values, self.starts)), 0)) > self.sf_c
+        layers_failed = (tension | compression) & self.active[self.comp[self.lays]]
+        #The first relevant layer that fails gives the failure of its composite
+        for r in np.nonzero(layers_failed)[0]:
+            c = self.comp[self.lays[r]]
+            if not failed[c]:
+                failed[c] = True
+                mode = "both" if tension[r] and compression[r] else ("tension" if tension[r] else "compression")
+                self.failures[c] = (float(self.ts[c][i]), self.nums[r], mode)
+        self.active &= ~failed
+        return failed
+
+'''
+Function that runs the main simulation for the elastic waves propagation
+Receives the List of Layers to consider (with the initial waves on them),
+the time vector for the simulation and the time step
+Same interface and results as wave_prop_analysis_V2.simulate_waves
+Returns a SimulationResult
+Optional arguments:
+verbose -> print the advance of the simulation (True by default)
+storage -> how to store the mesh of each layer:
+    "dense" -> complete mesh on layer.mesh (default), allocated by Layer.nodes
+               (only every stride-th row and the max/min of the windows, if
+               the meshes were allocated with a stride)
+    "events" -> only the changes of each time step and a complete row every
+                <keyframe> time steps (layer.mesh is an EventMesh that rebuilds
+                rows and time series of nodes on demand). Layer.nodes can be
+                called with alloc=False
+    "reduce" -> no mesh at all, only the max/min stresses (global, per node
+                and per time step) and the time of the peaks on layer.stats
+                (LayerStats). Layer.nodes can be called with alloc=False
+    "probes" -> no mesh at all, only the time series of the nodes given by
+                probes and interfaces (layer.probes, see
+                mesh_storage.probe_nodes) and the reductions of "reduce"
+                (layer.stats). Layer.nodes can be called with alloc=False
+keyframe -> time steps between complete rows for "events" (500 by default)
+probes, interfaces -> nodes to record for "probes": list of (layer, node or
+                      position in mm) and if the nodes at both sides of the
+                      interfaces are recorded too
+atol, rtol -> tolerances to drop the waves with small values (culling), as
+              an absolute value (Pa) or relative to the peak stress of their
+              layer so far (max abs stress of its nodes until that time
+              step), the largest of both is used. Waves are never dropped by
+              default (0). The results are not the same as V2 anymore, the
+              SimulationResult has a bound of their error for each layer,
+              also relative to its peak stress (see error_bound, it's a loose
+              upper limit and doesn't hold on every composite). A warning is
+              given if it's above the peak stress
+instruments -> Instruments object to record the counts and times of the
+               simulation (see instrumentation), None by default
+stop_on_failure -> if the simulation stops once a relevant layer fails (the
+                   criteria of data_generator.label, checked on every time
+                   step), False by default. The meshes (or stats, probes) then
+                   end at the time step of the failure, and the failure is
+                   given on the SimulationResult. Not available for "events"
+'''
+def simulate_waves(all_layers, t, step, verbose=True, storage="dense", atol=0.0, rtol=0.0, instruments=None,
+                   stop_on_failure=False, **kwargs):
+    if stop_on_failure and storage == "events":
+        raise ValueError("The simulation can't stop on failure with events storage")
+    arrays = layer_arrays([all_layers])
+    numnod, off = arrays[:2]
+    ints, value = gather_waves(all_layers)
+    recorder = RECORDERS[storage](all_layers, off, numnod, t, **kwargs)
+    monitor = FailureMonitor([all_layers], [t], off, numnod) if stop_on_failure else None
+    (ints, value), result = run(arrays, ints, value, t.size, recorder, verbose, atol=atol, rtol=rtol,
+                                instruments=instruments, monitor=monitor)
+    scatter_waves(all_layers, ints, value)
+    if instruments is not None:
+        instruments.finish(all_layers)
+    return result
+
+'''
+Function that runs many composites at once (batch), all of them advanced
+together on the same arrays
+Receives the list of composites (each one a list of Layers, discretized and
+with the initial waves on them), the list of time vectors of each composite
+(they can have different lengths) and the time step
+Only the reductions are kept: every layer ends with its mesh set to None and
+its stats (LayerStats) on layer.stats, the same as simulate_waves with
+storage="reduce" for each composite. The waves of each composite are removed
+once it reaches its final time, so only the longest ones keep their waves
+atol and rtol are the tolerances to drop waves (see simulate_waves), relative
+ones to the peak stress of each layer. instruments is an Instruments
+object to record the simulation (see simulate_waves). If stop_on_failure is
+True, every composite stops once one of its relevant layers fails (its waves
+are removed and its stats end at that time step), and the simulation ends
+once no composite is left. Returns a SimulationResult
+'''
+def simulate_batch(composites, ts, step, verbose=False, atol=0.0, rtol=0.0, instruments=None, stop_on_failure=False):
+    all_layers = [layer for layers in composites for layer in layers]
+    arrays = layer_arrays(composites)
+    numnod, off = arrays[:2]
+    ints, value = gather_waves(all_layers)
+    #Time steps of the composite of each layer
+    tsizes = np.repeat([t.size for t in ts], [len(layers) for layers in composites])
+    t = max(ts, key=len)
+    recorder = ReduceRecorder(all_layers, off, numnod, t, tsizes=tsizes)
+    monitor = FailureMonitor(composites, ts, off, numnod) if stop_on_failure else None
+    (ints, value), result = run(arrays, ints, value, t.size, recorder, verbose, tsizes, atol, rtol, instruments,
+                                monitor)
+    scatter_waves(all_layers, ints, value)
+    if instruments is not None:
+        instruments.finish(all_layers)
+    return result
+
+'''
+Function with the main loop of the simulation, common to one composite and
+to a batch of composites
+Receives the arrays of the layers, the arrays of the waves, the num of time
+steps, the recorder and, for batches, the num of time steps of the
+composite of each layer (the waves of a composite are removed once it
+reaches its final time, so its last rows don't change anymore) and the
+tolerances to drop waves (after every time step, the waves with a smaller
+abs value than atol or than rtol times the peak stress of their layer so far
+are dropped), the Instruments object to record the
+simulation on (None to not record it) and the FailureMonitor to stop the
+composites that fail (None to not check them). A failed composite loses its
+waves and its rows don't change anymore (for batches, its num of time steps
+is set to the ones until the failure), and the simulation ends once no
+composite is left
+Returns the arrays of the waves at the end of the simulation and the
+SimulationResult
+'''
+def run(arrays, ints, value, tsize, recorder, verbose, tsizes=None, atol=0.0, rtol=0.0, instruments=None,
+        monitor=None):
+    numnod, off, refl, trans, first, last = arrays
+    stops = set() if tsizes is None else set(tsizes.tolist())
+    cull = atol > 0 or rtol > 0
+    tol = np.full(numnod.size, float(atol))
+    peak = np.zeros(numnod.size) #max abs stress of each layer so far (culling)
+    dropped = 0
+    discarded = np.zeros(numnod.size)
+    drops = [] #dropped waves (layer, position, direction, time step, abs value)
+    #Flat rows of stresses for the whole composite: previous and current
+    prev = np.zeros(numnod.sum())
+    end = tsize-1 #last time step simulated
+    if instruments is not None:
+        instruments.start(numnod, tsize, ints)
+
+    #STARTS THE MAIN SIMULATION!
+    #Iterations for all times
+    next_percentage_advance = 10 #next advance percentage to print (status)
+    if verbose:
+        print("    --- Current advance on simulation (%) ---")
+        print(" "*8,end="")
+    for i in range(1,tsize):
+        if i > end:
+            break #every composite stopped
+        if i in stops:
+            #Composites that reached their final time
+            keep = tsizes[ints[0]] > i
+            ints, value = ints.compress(keep, axis=1), value.compress(keep)
+        if instruments is not None:
+            instruments.lap("other")
+        cur = prev.copy() #copy previous time step
+        if instruments is not None:
+            instruments.lap("copy")
+        (ints, value), changes_cur, changes_prev = advance(
+            numnod, off, refl, trans, first, last, ints, value, instruments)
+        np.add.at(cur, *changes_cur)
+        np.add.at(prev, *changes_prev)
+        if instruments is not None:
+            instruments.lap("apply")
+        if cull:
+            #Thresholds given by the peak stress of each layer so far
+            np.maximum(peak, np.maximum.reduceat(np.abs(prev), off), out=peak)
+            np.maximum(peak, np.maximum.reduceat(np.abs(cur), off), out=peak)
+            tol = np.maximum(atol, rtol*peak)
+            #Waves too small to consider are dropped, keeping track of their values
+            small = np.abs(value) < tol[ints[0]]
+            if small.any():
+                dropped += np.count_nonzero(small)
+                np.add.at(discarded, ints[0][small], np.abs(value[small]))
+                drops.append(np.vstack((ints[:,small], np.full(np.count_nonzero(small), i), np.abs(value[small]))))
+                if instruments is not None:
+                    instruments.count("dropped", ints[0][small])
+                ints, value = ints.compress(~small, axis=1), value.compress(~small)
+            if instruments is not None:
+                instruments.lap("cull")
+        if monitor is not None:
+            failed = monitor.check(i-1, prev)
+            if failed.any():
+                #The failed composites are stopped at the previous time step
+                lays = failed[monitor.comp]
+                keep = ~lays[ints[0]]
+                ints, value = ints.compress(keep, axis=1), value.compress(keep)
+                for k in np.nonzero(lays)[0]:
+                    cur[off[k]:off[k]+numnod[k]] = prev[off[k]:off[k]+numnod[k]]
+                if tsizes is None:
+                    end = i-1
+                else:
+                    tsizes[lays] = i
+                    end = tsizes.max()-1
+                if end < i:
+                    break
+        #Previous time step is now complete, we hand it to the recorder
+        recorder.step(i, prev, cur, changes_cur, changes_prev)
+        if instruments is not None:
+            instruments.lap("record")
+            instruments.end_step(i, ints)
+        prev = cur
+        #STATUS: Print statement to check advance of simulation
+        if verbose and (i / tsize)*100 >= next_percentage_advance:
+            print(str(next_percentage_advance)+", ",end="")
+            next_percentage_advance += 10
+    if monitor is not None and end == tsize-1:
+        monitor.check(end, prev) #the last row can only be checked
+    recorder.finish(end, prev)
+    if instruments is not None:
+        instruments.lap("record")
+    #Simulation completed!
+    if verbose:
+        print("100")
+    bound = np.zeros(numnod.size)
+    if drops:
+        drops = np.hstack(drops)
+        ends = np.full(numnod.size, end) if tsizes is None else tsizes-1
+        bound = error_bound(numnod, refl, trans, (drops[0].astype(int), drops[1].astype(int), drops[2].astype(int),
+                                                  drops[3].astype(int), drops[4]), ends)
+    result = SimulationResult(tol, dropped, discarded, bound, peak, None if monitor is None else monitor.failures)
+    if (result.relative > 1).any():
+        warnings.warn("The bound of the error of the culling is above the peak stress of the layers {0} "
+                      "(up to {1:.4g} times), the stresses may not be reliable (use smaller tolerances)".format(
+                          ", ".join("#"+str(k+1) for k in np.nonzero(result.relative > 1)[0]),
+                          result.relative.max()))
+    return (ints, value), result
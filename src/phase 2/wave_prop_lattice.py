@@ -0,0 +1,235 @@
+import heapq
+import time
+import numpy as np
+from wave_prop_analysis_V2 import Wave
+from wave_prop_analysis_V3 import layer_arrays
+from mesh_storage import probe_nodes
+
+'''
+Event-driven version of the elastic waves propagation (lattice diagram)
+The model is the discrete one of V2 (a wave moves one node per time step,
+same reflection, transmission and combination rules), but instead of moving
+every wave every time step, each wavefront is handled only when it reaches a
+side of its layer. Between those events, a wavefront just changes the stress
+of one node per time step by its value, so it's completely described by:
+lay -> layer it belongs to
+direct -> direction (0 -> left, 1 -> right)
+start -> time step when it passes its entry node (node 0 if going right,
+         last node if going left), the node at a distance m of that node is
+         passed at the time step start+m
+value -> stress value of the wavefront
+late -> True if it passes its entry node one time step later (reflections
+        on the free boundaries, as V2 applies them on the next time step)
+The stress of a node at a time step is the sum of the values of all the
+wavefronts that passed it up to that time step, so the meshes are piecewise
+constant and the stresses of a point (or of a layer at a time) can be found
+directly from the list of wavefronts. The cost of the simulation depends on
+the num of wavefronts hitting the sides of the layers, instead of the num of
+nodes times the num of time steps.
+As in V2, a layer gets at most one new wave (transmitted) per time step:
+if both neighbour layers transmit a wave to it on the same time step, the one
+coming from the right is the one kept. Wavefronts passing the same node in
+the same direction on the same time step are combined. The layers need at
+least 3 nodes each (solve raises an error otherwise).
+'''
+
+'''
+Class that holds the wavefronts of a simulation and finds the stresses
+(piecewise constant fields) from them
+'''
+class Lattice:
+    #Constructor of the Lattice class
+    def __init__(self,numnod,tsize,fronts):
+        self.numnod = numnod
+        self.tsize = tsize
+        #Arrays of the wavefronts of each layer (direct, start, value, late)
+        self.fronts = []
+        for k in range(numnod.size):
+            direct, start, value, late = zip(*fronts[k]) if fronts[k] else ((),)*4
+            self.fronts.append((np.array(direct, dtype=int), np.array(start, dtype=int),
+                                np.array(value, dtype=float), np.array(late, dtype=bool)))
+
+    #Function that returns the time steps when the wavefronts of a layer pass
+    #the given nodes (distance m to their entry node) and if they do it during
+    #the simulation (the changes of the entry node are applied by V2 on the
+    #next time step, so they need that time step to be simulated too)
+    def passes(self,k,m):
+        direct, start, value, late = self.fronts[k]
+        row = start + m + (late & (m == 0))
+        applied = start + np.maximum(m, 1)
+        return row, (applied >= 1) & (applied <= self.tsize-1)
+
+    #Function that returns the distance of node j to the entry node of each
+    #wavefront of a layer
+    def distance(self,k,j):
+        direct = self.fronts[k][0]
+        return np.where(direct == 1, j, self.numnod[k]-1-j)
+
+    #Function that returns the stress of node j of layer k for all time steps
+    def history(self,k,j):
+        j = j + self.numnod[k] if j < 0 else j
+        row, valid = self.passes(k, self.distance(k, j))
+        series = np.zeros(self.tsize)
+        np.add.at(series, row[valid], self.fronts[k][2][valid])
+        return np.cumsum(series)
+
+    #Function that returns the stresses of layer k (all nodes) at time step i
+    def field(self,k,i):
+        direct, start, value, late = self.fronts[k]
+        n = self.numnod[k]
+        #Distances to the entry node passed up to time step i (a range on each wavefront)
+        entry = (start >= 0) & (start <= self.tsize-2) & (start + late <= i)
+        lo = np.where(entry, 0, np.maximum(1, 1-start))
+        hi = np.minimum(n-1, i-start)
+        keep = lo <= hi
+        lo, hi, value, right = lo[keep], hi[keep], value[keep], direct[keep] == 1
+        #Nodes of those ranges, added to the field as a difference array
+        first = np.where(right, lo, n-1-hi)
+        end = np.where(right, hi, n-1-lo) + 1
+        diff = np.zeros(n+1)
+        np.add.at(diff, first, value)
+        np.add.at(diff, end, -value)
+        return np.cumsum(diff[:-1])
+
+    #Function that returns the complete mesh (all time steps, all nodes) of layer k
+    def mesh(self,k):
+        n = self.numnod[k]
+        jumps = np.zeros((self.tsize+1,n))
+        for m in range(n):
+            row, valid = self.passes(k, m)
+            nodes = np.where(self.fronts[k][0][valid] == 1, m, n-1-m)
+            np.add.at(jumps, (row[valid], nodes), self.fronts[k][2][valid])
+        return np.cumsum(jumps[:-1], axis=0)
+
+'''
+Function that runs the simulation of the wavefronts (event-driven) and
+returns the Lattice with all of them, together with the waves left at the
+end of the simulation (Wave objects, by layer)
+Receives the List of Layers to consider (with the initial waves on them) and
+the num of time steps of the simulation
+'''
+def solve(all_layers, tsize):
+    numnod, off, refl, trans, first, last = layer_arrays([all_layers])
+    #A wavefront enters a layer by one side and is transmitted one node before
+    #the other one, so every layer needs at least 3 nodes
+    small = np.flatnonzero(numnod < 3)
+    if small.size > 0:
+        raise ValueError("Layer #{0} has {1} nodes, the lattice needs at least 3 per layer "
+                         "(thicker layer or smaller time step)".format(small[0]+1, numnod[small[0]]))
+    qty_layers = numnod.size
+    free = np.array([first, last]) #free boundaries, left (row 0) and right (row 1)
+    waves = {} #wavefronts not handled yet, (lay, direct, start) -> value, late
+    events = [] #priority queue of (time step reaching a side, lay, direct, start)
+    fronts = [[] for k in range(qty_layers)] #wavefronts already handled
+
+    #Function that adds a wavefront (combined with an existing one if any)
+    def add(k, d, start, value, late=False):
+        key = (k, d, start)
+        if key in waves:
+            waves[key][0] += value
+        else:
+            waves[key] = [value, late]
+            heapq.heappush(events, (start+numnod[k]-1, k, d, start))
+
+    #The initial waves already passed the nodes behind them
+    for k, layer in enumerate(all_layers):
+        for wave in layer.waves:
+            add(k, wave.direct, -(wave.pos if wave.direct == 1 else numnod[k]-1-wave.pos), wave.value)
+    #Events of each time step, in order
+    ends = []
+    while events and events[0][0] <= tsize-1:
+        i = events[0][0]
+        hits = []
+        while events and events[0][0] == i:
+            hits.append(heapq.heappop(events)[1:])
+        #Wavefronts reaching a side, in the order V2 handles them (by layer)
+        new_waves = {}
+        for k, d, start in sorted(hits):
+            value, late = waves.pop((k, d, start))
+            fronts[k].append((d, start, value, late))
+            #Transmitted wave, created on this time step (the last one for a layer is kept)
+            if i >= 1 and not free[d][k]:
+                new_waves[k+1 if d == 1 else k-1] = (d, value*trans[d][k])
+            #Reflected wave, applied on the next time step
+            if i+1 <= tsize-1:
+                add(k, 1-d, i, value*refl[d][k], free[d][k])
+            else:
+                ends.append((k, d, numnod[k]-1 if d == 1 else 0, value))
+        for k in new_waves:
+            d, value = new_waves[k]
+            add(k, d, i, value)
+    #Wavefronts still moving at the end of the simulation
+    for (k, d, start), (value, late) in waves.items():
+        fronts[k].append((d, start, value, late))
+        m = tsize-1-start
+        ends.append((k, d, m if d == 1 else numnod[k]-1-m, value))
+    left = [[] for k in range(qty_layers)]
+    for k, p, d, value in sorted((k, p, d, value) for k, d, p, value in ends):
+        left[k].append(Wave(p,numnod[k],d,value))
+    return Lattice(numnod, tsize, fronts), left
+
+'''
+Function that runs the main simulation for the elastic waves propagation
+with the same parameters as wave_prop_analysis_V2.simulate_waves
+The meshes of the layers (if allocated) are filled from the wavefronts (only
+every stride-th row and the max/min of the windows, if the meshes have a
+stride, see Layer.nodes), and the waves of the layers are left as at the end
+of the simulation. Each layer also gets the Lattice of the simulation
+(layer.lattice, with its index on layer.lattice_index) to find the stresses
+of points directly. Returns the Lattice
+With storage="probes", only the series of the nodes given by probes and
+interfaces are set on the layers (layer.probes, as the "probes" storage of
+wave_prop_analysis_V3.simulate_waves) and the meshes are not filled
+'''
+def simulate_waves(all_layers, t, step, verbose=True, storage="dense", probes=(), interfaces=False):
+    if verbose:
+        print("    --- Event-driven simulation (lattice) ---")
+    lattice, left = solve(all_layers, t.size)
+    for k, layer in enumerate(all_layers):
+        layer.waves = left[k]
+        layer.lattice = lattice
+        layer.lattice_index = k
+        if storage == "probes":
+            layer.mesh = None
+            layer.probes = {}
+        elif layer.mesh is not None:
+            mesh = lattice.mesh(k)
+            stride = getattr(layer, "stride", 1)
+            layer.mesh[:] = mesh[::stride]
+            if getattr(layer, "mesh_max", None) is not None:
+                starts = np.arange(0, t.size, stride)
+                layer.mesh_max[:] = np.maximum.reduceat(mesh, starts, axis=0)
+                layer.mesh_min[:] = np.minimum.reduceat(mesh, starts, axis=0)
+    if storage == "probes":
+        for k, j in probe_nodes(all_layers, probes, interfaces):
+            all_layers[k].probes[j] = lattice.history(k, j)
+    if verbose:
+        print("        {0} wavefronts".format(sum(f[0].size for f in lattice.fronts)))
+    return lattice
+
+'''
+Function that validates the event-driven simulation against the simulation
+of wave_prop_analysis_V3 (same results as V2) for an input file, printing
+the max difference of the meshes of each layer and the times of both
+Returns the max difference relative to the max stress of the composite
+'''
+def validate(filename):
+    import wave_prop_analysis_V3
+    from composite_reader import read_composite
+    all_layers, t, step, finalt, options = read_composite(filename)
+    start_time = time.time()
+    wave_prop_analysis_V3.simulate_waves(all_layers, t, step, verbose=False)
+    time_v3 = time.time() - start_time
+    other_layers, t, step, finalt, options = read_composite(filename, False)
+    start_time = time.time()
+    lattice, left = solve(other_layers, t.size)
+    time_lattice = time.time() - start_time
+    max_stress = max(np.abs(layer.mesh).max() for layer in all_layers)
+    max_diff = 0
+    for k, layer in enumerate(all_layers):
+        diff = np.abs(lattice.mesh(k) - layer.mesh).max()
+        max_diff = max(max_diff, diff)
+        print("Layer {0}: max difference {1:.3e}".format(k+1, diff))
+    print("--- V3: {0:f} seconds, lattice: {1:f} seconds ({2} wavefronts) ---".format(
+        time_v3, time_lattice, sum(f[0].size for f in lattice.fronts)))
+    return max_diff/max_stress if max_stress > 0 else max_diff
@@ -0,0 +1,127 @@
+import threading
+import time
+import numpy as np
+import xlsxwriter as xlsx
+
+'''
+Export of the meshes of a simulation to an xlsx file
+The workbook is written in the constant memory mode of xlsxwriter: each row
+is flushed to the file once the next one starts, so the sheets are written
+row by row (time step by time step) and the memory used doesn't depend on
+the size of the meshes. The meshes are read by blocks of rows, so memory-
+mapped, event or archive meshes are never loaded entirely.
+Each layer gets a sheet (split every 16000 columns) with the positions of
+the nodes on the first row and the times on the first column, plus the
+sheets of the max and min of the windows (if the meshes have them) or only
+the sheet of the probes (if only those were recorded).
+The rows (time steps) and the columns (nodes) can be downsampled to a max
+num of them: every k-th one is kept, and the max/min of the windows keep
+the max/min of each group instead, so no peak is lost
+'''
+
+#Max num of columns of a sheet (nodes) and of rows (time steps, the first
+#two rows are the headers)
+MAX_COLS = 16000
+MAX_ROWS = 1048576 - 2
+
+'''
+Function that returns the indexes kept when downsampling n rows (or columns)
+to at most target of them (every k-th one, starting at the first), and k
+'''
+def downsample(n, target=None):
+    k = 1 if target is None or n <= target else -(-n // target)
+    return np.arange(0, n, k), k
+
+'''
+Function that returns the rows of a mesh downsampled (see downsample), one by
+one. reduce is None to keep the k-th rows and columns, or np.maximum or
+np.minimum to keep the max or min of each group of them
+'''
+def mesh_rows(mesh, ridx, k, cidx, kc, reduce=None, block=256):
+    for a in range(0, ridx.size, block):
+        rows = np.asarray(mesh[ridx[a]:ridx[min(a+block,ridx.size)-1]+k])
+        if reduce is None:
+            rows = rows[::k][:,cidx]
+        else:
+            rows = reduce.reduceat(reduce.reduceat(rows, np.arange(0,len(rows),k), axis=0), cidx, axis=1)
+        for row in rows:
+            yield row
+
+'''
+Function that writes a sheet: positions of the columns (mm) on the first row,
+times on the first column and the rows of values, in order
+Returns the num of cells written
+'''
+def write_sheet(workbook, name, cols, times, rows):
+    sheet = workbook.add_worksheet(name)
+    sheet.write_string(0,1,'h (mm)')
+    sheet.write_row(0,2,cols.tolist())
+    sheet.write_string(1,0,'t (micro-s)')
+    cells = 0
+    for rowNum, (time_row, data) in enumerate(zip(times.tolist(), rows),2):
+        sheet.write_number(rowNum,0,time_row)
+        sheet.write_row(rowNum,2,data.tolist())
+        cells += data.size + 1
+    return cells
+
+'''
+Function that exports the meshes of the layers (after a simulation) to an
+xlsx file, given the time vector of the simulation and, optionally, the max
+num of rows and of columns of each mesh (all of them by default, the rows up
+to the max of a sheet). Prints the time taken and the cells written per
+second if verbose. Returns the num of cells written
+'''
+def export_xlsx(fileName, all_layers, t, max_rows=None, max_cols=None, verbose=True):
+    start_time = time.time()
+    max_rows = MAX_ROWS if max_rows is None else min(max_rows, MAX_ROWS)
+    cells = 0
+    workbook = xlsx.Workbook(fileName, {'constant_memory': True})
+    for sheetNum, layer in enumerate(all_layers):
+        name = 'Layer ' + str(sheetNum+1)
+        hval = layer.hval()
+        if getattr(layer, "probes", None) is not None:
+            #Only the probes were recorded: one column for each one
+            nodes = sorted(layer.probes)
+            if len(nodes) > 0:
+                ridx, k = downsample(t.size, max_rows)
+                values = np.column_stack([layer.probes[j][ridx] for j in nodes])
+                cells += write_sheet(workbook, name + ' probes', hval[nodes], t[ridx], values)
+            continue
+        if layer.mesh is None:
+            continue #only the reductions were kept
+        #Sheets of the mesh and, if kept, of the max and min of the windows
+        times = t[::getattr(layer, "stride", 1)]
+        ridx, k = downsample(len(layer.mesh), max_rows)
+        cidx, kc = downsample(layer.numnod, max_cols)
+        meshes = [("", layer.mesh, None)]
+        if getattr(layer, "mesh_max", None) is not None:
+            meshes += [(" max", layer.mesh_max, np.maximum), (" min", layer.mesh_min, np.minimum)]
+        for suffix, mesh, reduce in meshes:
+            parts = -(-cidx.size // MAX_COLS)
+            for i in range(parts): #A sheet for every 16000 columns
+                part = slice(i*MAX_COLS, (i+1)*MAX_COLS)
+                rows = (row[part] for row in mesh_rows(mesh, ridx, k, cidx, kc, reduce))
+                cells += write_sheet(workbook, name + suffix + ('.' + str(i+1) if parts > 1 else ''),
+                                     hval[cidx][part], times[ridx], rows)
+    workbook.close()
+    if verbose:
+        elapsed = time.time() - start_time
+        print("\n--- Export to {0} done: {1} cells in {2:f} seconds ({3:.0f} cells/s) ---".format(
+            fileName, cells, elapsed, cells/elapsed if elapsed > 0 else 0))
+    return cells
+
+'''
+Function that runs export_xlsx (same parameters) on a background thread, so
+the analysis can go on while the file is written. Returns the thread (join
+it before freeing the meshes)
+'''
+def export_background(fileName, all_layers, t, max_rows=None, max_cols=None):
+    #Function that runs the export, printing the error if it fails
+    def export():
+        try:
+            export_xlsx(fileName, all_layers, t, max_rows, max_cols)
+        except Exception as e:
+            print("\n--- Export to {0} failed: {1} ---".format(fileName, e))
+    thread = threading.Thread(target=export)
+    thread.start()
+    return thread